@@ -31,61 +31,25 @@ from pox.lib.util import str_to_bool, dpid_to_str, str_to_dpid
 from pox.forwarding.l2_learning import LearningSwitch
 
 import pox.openflow.libopenflow_01 as of
+import pox.openflow.nicira as nx
+from pox.lib.lb.selection import make_selector
+from pox.lib.lb.memory import MemoryEntry, FlowMemory
+from pox.lib.lb.fastpath import peek_tcp
+from pox.lib.lb.monitor import LoadMonitor
+from pox.lib.lb.health import HealthChecker, parse_check
+from pox.lib.lb import ServerDrained, servers_with_flows
+from pox.lib.revent import EventMixin
 
 import time
 import random
 
 FLOW_IDLE_TIMEOUT = 10
 FLOW_MEMORY_TIMEOUT = 60 * 5
+FLOW_FIN_LINGER = FLOW_IDLE_TIMEOUT # How long to remember closed flows
+DRAIN_CHECK_INTERVAL = 5 # How often to ask the switch about draining servers
 
-CURRENT_RR_INDEX = 0
 
-
-class MemoryEntry (object):
-  """
-  Record for flows we are balancing
-
-  Table entries in the switch "remember" flows for a period of time, but
-  rather than set their expirations to some long value (potentially leading
-  to lots of rules for dead connections), we let them expire from the
-  switch relatively quickly and remember them here in the controller for
-  longer.
-
-  Another tactic would be to increase the timeouts on the switch and use
-  the Nicira extension which can match packets with FIN set to remove them
-  when the connection closes.
-  """
-  def __init__ (self, server, first_packet, client_port):
-    self.server = server
-    self.first_packet = first_packet
-    self.client_port = client_port
-    self.refresh()
-
-  def refresh (self):
-    self.timeout = time.time() + FLOW_MEMORY_TIMEOUT
-
-  @property
-  def is_expired (self):
-    return time.time() > self.timeout
-
-  @property
-  def key1 (self):
-    ethp = self.first_packet
-    ipp = ethp.find('ipv4')
-    tcpp = ethp.find('tcp')
-
-    return ipp.srcip,ipp.dstip,tcpp.srcport,tcpp.dstport
-
-  @property
-  def key2 (self):
-    ethp = self.first_packet
-    ipp = ethp.find('ipv4')
-    tcpp = ethp.find('tcp')
-
-    return self.server,ipp.srcip,tcpp.dstport,tcpp.srcport
-
-
-class iplb (object):
+class iplb (EventMixin):
   """
   A simple IP load balancer
 
@@ -93,10 +57,17 @@ class iplb (object):
   to service_ip will be randomly redirected to one of the servers.
 
   We probe the servers to see if they're alive by sending them ARPs.
+
+  Servers can be drained (see drain_server()), and we raise ServerDrained
+  when a draining server's last flow is gone.
   """
-  def __init__ (self, connection, service_ip, servers = []):
+  _eventMixin_events = set([ServerDrained])
+
+  def __init__ (self, connection, service_ip, servers = [],
+                selector = None, health_check = None, fin_timeout = None):
     self.service_ip = IPAddr(service_ip)
     self.servers = [IPAddr(a) for a in servers]
+    self._server_set = frozenset(self.servers)
     self.con = connection
     self.mac = self.con.eth_addr
     self.live_servers = {} # IP -> MAC,port
@@ -118,7 +89,47 @@ class iplb (object):
     # We remember where we directed flows so that if they start up again,
     # we can send them to the same server if it's still up.  Alternate
     # approach: hashing.
-    self.memory = {} # (srcip,dstip,srcport,dstport) -> MemoryEntry
+    # (srcip,dstip,srcport,dstport) -> MemoryEntry
+    self.memory = FlowMemory(FLOW_MEMORY_TIMEOUT)
+    self._templates = {} # See _flow_template()
+
+    # How we pick a server for a new flow (see pox.lib.lb.selection).
+    # With the "hash" selector, a forgotten flow is sent back to the same
+    # server, so memory can be rebuilt from scratch (e.g., after a restart).
+    if selector is None: selector = 'rr'
+    self.selector = make_selector(selector)
+
+    # Load-aware selectors get kept up to date with how many flows each
+    # server has and how much traffic the switch sees for it.
+    self.monitor = None
+    if self.selector.needs_connections:
+      self.selector.connections = self.memory.server_counts
+    if self.selector.needs_rates:
+      self.monitor = LoadMonitor(self)
+      self.selector.rates = self.monitor.rates
+
+    # Optional active health checks (e.g., "http:80/status"; see
+    # pox.lib.lb.health).  Servers only get new flows if they answer our
+    # ARPs *and* pass their health checks.
+    self.health = None
+    if health_check is not None:
+      mode,port,path = parse_check(health_check)
+      self.health = HealthChecker(self.servers, self._health_changed,
+                                  port=port, mode=mode, path=path)
+
+    # Servers not getting new flows (server -> True once it has no flows)
+    self.draining = {}
+    self._drain_check = None # Flow stats request about them
+    self._drain_check_time = 0
+
+    # If fin_timeout is set (Open vSwitch only), our flow rules use the
+    # Nicira fin_timeout action so that seeing a FIN or RST gives them a
+    # hard timeout of fin_timeout seconds, and ask for FlowRemoved
+    # messages.  Our rules otherwise never have a hard timeout, so a rule
+    # removed for that reason means the connection is closing.  (Without
+    # fin_timeout, a removal only means the flow went idle, and we keep
+    # remembering it anyway, so we don't ask.)
+    self.fin_timeout = fin_timeout
 
     self._do_probe() # Kick off the probing
 
@@ -140,13 +151,13 @@ class iplb (object):
         if ip in self.live_servers:
           self.log.warn("Server %s down", ip)
           del self.live_servers[ip]
+          self._servers_changed()
 
     # Expire old flows
-    c = len(self.memory)
-    self.memory = {k:v for k,v in self.memory.items()
-                   if not v.is_expired}
-    if len(self.memory) != c:
-      self.log.debug("Expired %i flows", c-len(self.memory))
+    c = self.memory.expire(t)
+    if c:
+      self.log.debug("Expired %i flows", c)
+    if self.draining: self._check_drained(t)
 
   def _do_probe (self):
     """
@@ -188,140 +199,268 @@ class iplb (object):
     r = max(.25, r) # Cap it at four per second
     return r
 
+  def _usable_servers (self):
+    """
+    Servers which may be given new flows
+    """
+    servers = [s for s in self.live_servers if s not in self.draining]
+    if self.health is None: return servers
+    return [s for s in servers if self.health.is_healthy(s)]
+
+  def drain_server (self, server):
+    """
+    Stop giving new flows to a server
+
+    Flows it already has keep going to it (their memory entries and table
+    entries are left alone).  Once it has none left (in our memory or in
+    the switch), we raise ServerDrained and it can be taken down without
+    breaking any connections.
+    """
+    server = IPAddr(server)
+    if server not in self.servers:
+      raise RuntimeError("%s is not one of our servers" % (server,))
+    if server in self.draining: return
+    self.log.info("Draining %s", server)
+    self.draining[server] = False
+    self._servers_changed()
+    self._check_drained()
+
+  def undrain_server (self, server):
+    """
+    Let a draining server have new flows again
+    """
+    server = IPAddr(server)
+    if self.draining.pop(server, None) is None: return
+    self.log.info("No longer draining %s", server)
+    self._servers_changed()
+
+  def _check_drained (self, now = None):
+    """
+    Asks the switch about draining servers which we remember no flows for
+
+    We forget flows which haven't sent us a PacketIn for a while, but a
+    long-lived one may still be going through the switch, so a server is
+    only drained once the switch has no rules for it either.
+    """
+    if self._drain_check is not None: return
+    if now is None: now = time.time()
+    if now - self._drain_check_time < DRAIN_CHECK_INTERVAL: return
+    for server,drained in self.draining.iteritems():
+      if not drained and not self.memory.server_counts.get(server): break
+    else:
+      return
+    self._drain_check_time = now
+    match = of.ofp_match(dl_type = ethernet.IP_TYPE,
+                         nw_proto = ipv4.TCP_PROTOCOL)
+    msg = of.ofp_stats_request(body = of.ofp_flow_stats_request(match=match))
+    # (If we're disconnected, it has already failed when this returns)
+    r = self.con.request(msg, self._drain_checked)
+    if not r.done: self._drain_check = r
+
+  def _drain_checked (self, request):
+    self._drain_check = None
+    if not request.ok: return # We'll ask again
+    busy = servers_with_flows(request.body, self.service_ip)
+    for server,drained in self.draining.items():
+      if drained or self.memory.server_counts.get(server): continue
+      if server in busy: continue
+      self.draining[server] = True
+      self.log.info("Server %s is drained", server)
+      self.raiseEvent(ServerDrained, self, server)
+
+  def server_status (self):
+    """
+    Returns a list of dicts describing our servers
+    """
+    r = []
+    for server in sorted(self.servers):
+      d = {'server' : str(server),
+           'live' : server in self.live_servers,
+           'draining' : server in self.draining,
+           'drained' : self.draining.get(server, False),
+           'connections' : self.memory.server_counts.get(server, 0)}
+      if self.health is not None:
+        d['healthy'] = self.health.is_healthy(server)
+      r.append(d)
+    return r
+
+  def _health_changed (self, server, healthy):
+    self._servers_changed()
+
+  def _servers_changed (self):
+    """
+    Called when live_servers has changed
+    """
+    self._templates.clear()
+    self.selector.set_servers(self._usable_servers())
+
   def _pick_server (self, key, inport):
-    global CURRENT_RR_INDEX
-    print self.live_servers.keys()
-    try:
-      ch = self.live_servers.keys()[CURRENT_RR_INDEX]
-      CURRENT_RR_INDEX += 1
-      return ch
-    except:
-      CURRENT_RR_INDEX = 0
-      ch = self.live_servers.keys()[CURRENT_RR_INDEX]
-      CURRENT_RR_INDEX += 1
-      return ch
-    # ch = random.choice(self.live_servers.keys())
+    """
+    Pick a server for a (hopefully) new connection
+    """
+    return self.selector.pick(key, inport)
+
+  def _flow_actions (self):
+    """
+    Starts the action list for a per-flow rule
+    """
+    if self.fin_timeout is None: return []
+    return [nx.nx_action_fin_timeout(fin_idle_timeout = 0,
+                                     fin_hard_timeout = self.fin_timeout)]
+
+  def _flow_flags (self):
+    """
+    Returns the flags for a per-flow rule
+    """
+    if self.fin_timeout is None: return 0
+    return of.OFPFF_SEND_FLOW_REM
+
+  def _flow_template (self, to_server, mac, ip, port):
+    """
+    Returns the FlowModTemplate for per-flow rules with the given rewrite
+
+    Rules toward a server rewrite the destination to its mac and ip;
+    rules back to a client rewrite the source.  There's only one action
+    list per server (or client port), so they're packed once and reused.
+    """
+    key = to_server,mac,ip,port
+    template = self._templates.get(key)
+    if template is None:
+      actions = self._flow_actions()
+      if to_server:
+        actions.append(of.ofp_action_dl_addr.set_dst(mac))
+        actions.append(of.ofp_action_nw_addr.set_dst(ip))
+      else:
+        actions.append(of.ofp_action_dl_addr.set_src(mac))
+        actions.append(of.ofp_action_nw_addr.set_src(ip))
+      actions.append(of.ofp_action_output(port = port))
+      template = of.FlowModTemplate(command=of.OFPFC_ADD,
+                                    idle_timeout=FLOW_IDLE_TIMEOUT,
+                                    hard_timeout=of.OFP_FLOW_PERMANENT,
+                                    flags=self._flow_flags(),
+                                    actions=actions)
+      self._templates[key] = template
+    return template
+
+  def _handle_FlowRemoved (self, event):
+    if not event.hardTimeout: return
+    m = event.ofp.match
+    if m.nw_proto != ipv4.TCP_PROTOCOL: return
+    # Works for rules in either direction, since they match on the
+    # flow's key1 or key2 respectively
+    entry = self.memory.get((m.nw_src, m.nw_dst, m.tp_src, m.tp_dst))
+    if entry is None: return
+    self.memory.linger(entry, FLOW_FIN_LINGER)
+
+  def _drop (self, event):
+    if event.ofp.buffer_id is not None:
+      # Kill the buffer
+      msg = of.ofp_packet_out(data = event.ofp)
+      self.con.send(msg)
+    return None
 
   def _handle_PacketIn (self, event):
+    # Nearly everything we see is TCP, and for that we only need a few
+    # header fields, so we peek at them rather than parse the whole packet.
+    h = peek_tcp(event.data)
+    if h is not None:
+      return self._handle_tcp(event, h)
+
     inport = event.port
     packet = event.parsed
+    arpp = packet.find('arp')
+    if arpp:
+      # Handle replies to our server-liveness probes
+      if arpp.opcode == arpp.REPLY:
+        if arpp.protosrc in self.outstanding_probes:
+          # A server is (still?) up; cool.
+          del self.outstanding_probes[arpp.protosrc]
+          if (self.live_servers.get(arpp.protosrc, (None,None))
+              == (arpp.hwsrc,inport)):
+            # Ah, nothing new here.
+            pass
+          else:
+            # Ooh, new server.
+            self.live_servers[arpp.protosrc] = arpp.hwsrc,inport
+            self._servers_changed()
+            self.log.info("Server %s up", arpp.protosrc)
+      return
+
+    # Not TCP and not ARP.  Don't know what to do with this.  Drop it.
+    return self._drop(event)
+
+  def _handle_tcp (self, event, h):
+    """
+    Handles a TCP PacketIn given its headers (see pox.lib.lb.fastpath)
+    """
+    inport = event.port
 
-    def drop ():
-      if event.ofp.buffer_id is not None:
-        # Kill the buffer
-        msg = of.ofp_packet_out(data = event.ofp)
-        self.con.send(msg)
-      return None
-
-    tcpp = packet.find('tcp')
-    if not tcpp:
-      arpp = packet.find('arp')
-      if arpp:
-        # Handle replies to our server-liveness probes
-        if arpp.opcode == arpp.REPLY:
-          if arpp.protosrc in self.outstanding_probes:
-            # A server is (still?) up; cool.
-            del self.outstanding_probes[arpp.protosrc]
-            if (self.live_servers.get(arpp.protosrc, (None,None))
-                == (arpp.hwsrc,inport)):
-              # Ah, nothing new here.
-              pass
-            else:
-              # Ooh, new server.
-              self.live_servers[arpp.protosrc] = arpp.hwsrc,inport
-              self.log.info("Server %s up", arpp.protosrc)
-        return
-
-      # Not TCP and not ARP.  Don't know what to do with this.  Drop it.
-      return drop()
-
-    # It's TCP.
-    
-    ipp = packet.find('ipv4')
-
-    if ipp.srcip in self.servers:
+    if h.nw_src in self._server_set:
       # It's FROM one of our balanced servers.
       # Rewrite it BACK to the client
 
-      key = ipp.srcip,ipp.dstip,tcpp.srcport,tcpp.dstport
+      key = h.nw_src,h.nw_dst,h.tp_src,h.tp_dst
       entry = self.memory.get(key)
 
       if entry is None:
         # We either didn't install it, or we forgot about it.
         self.log.debug("No client for %s", key)
-        return drop()
+        return self._drop(event)
 
       # Refresh time timeout and reinstall.
-      entry.refresh()
+      self.memory.refresh(entry)
 
       #self.log.debug("Install reverse flow for %s", key)
 
       # Install reverse table entry
       mac,port = self.live_servers[entry.server]
 
-      actions = []
-      actions.append(of.ofp_action_dl_addr.set_src(self.mac))
-      actions.append(of.ofp_action_nw_addr.set_src(self.service_ip))
-      actions.append(of.ofp_action_output(port = entry.client_port))
-      match = of.ofp_match.from_packet(packet, inport)
-
-      msg = of.ofp_flow_mod(command=of.OFPFC_ADD,
-                            idle_timeout=FLOW_IDLE_TIMEOUT,
-                            hard_timeout=of.OFP_FLOW_PERMANENT,
-                            data=event.ofp,
-                            actions=actions,
-                            match=match)
-      self.con.send(msg)
+      template = self._flow_template(False, self.mac, self.service_ip,
+                                     entry.client_port)
+      self.con.send(template.pack(h.match(inport), data=event.ofp))
 
-    elif ipp.dstip == self.service_ip:
+    elif h.nw_dst == self.service_ip:
       # Ah, it's for our service IP and needs to be load balanced
 
       # Do we already know this flow?
-      key = ipp.srcip,ipp.dstip,tcpp.srcport,tcpp.dstport
+      key = h.nw_src,h.nw_dst,h.tp_src,h.tp_dst
       entry = self.memory.get(key)
       if entry is None or entry.server not in self.live_servers:
         # Don't know it (hopefully it's new!)
         if len(self.live_servers) == 0:
           self.log.warn("No servers!")
-          return drop()
+          return self._drop(event)
 
         # Pick a server for this flow
         server = self._pick_server(key, inport)
+        if server is None:
+          self.log.warn("No servers accepting new flows!")
+          return self._drop(event)
+
         # print serverlist
         # server = serverlist[0]
         # self.log.debug("Received server: %s", server)
         self.log.debug("Directing traffic to %s", server)
-        entry = MemoryEntry(server, packet, inport)
+        entry = MemoryEntry(server, key, inport)
         self.log.debug("Looked up entry server %s", entry.server)
-        self.memory[entry.key1] = entry
-        self.memory[entry.key2] = entry
+        self.memory.add(entry)
    
       # Update timestamp
-      entry.refresh()
+      self.memory.refresh(entry)
 
       # Set up table entry towards selected server
       mac,port = self.live_servers[entry.server]
 
-      actions = []
-      actions.append(of.ofp_action_dl_addr.set_dst(mac))
-      actions.append(of.ofp_action_nw_addr.set_dst(entry.server))
-      actions.append(of.ofp_action_output(port = port))
-      match = of.ofp_match.from_packet(packet, inport)
-
-      msg = of.ofp_flow_mod(command=of.OFPFC_ADD,
-                            idle_timeout=FLOW_IDLE_TIMEOUT,
-                            hard_timeout=of.OFP_FLOW_PERMANENT,
-                            data=event.ofp,
-                            actions=actions,
-                            match=match)
-      self.con.send(msg)
+      template = self._flow_template(True, mac, entry.server, port)
+      self.con.send(template.pack(h.match(inport), data=event.ofp))
 
 
 # Remember which DPID we're operating on (first one to connect)
 _dpid = None
 LBinitDone = 0
 
-def launch (ip, servers, lb_dpid):
+def launch (ip, servers, lb_dpid, selector=None, health_check=None,
+            fin_timeout=None):
   global _dpid, LBinitDone
   try:
 
@@ -329,6 +468,7 @@ def launch (ip, servers, lb_dpid):
     servers = [IPAddr(x) for x in servers]
     ip = IPAddr(ip)
     _dpid = str_to_dpid(lb_dpid)
+    if fin_timeout is not None: fin_timeout = int(fin_timeout)
 
     # Boot up ARP Responder
     from proto.arp_responder import launch as arp_launch
@@ -349,7 +489,8 @@ def launch (ip, servers, lb_dpid):
       else:
         if (LBinitDone != 1):
           log.info("IP Load Balancer Ready.")
-          core.registerNew(iplb, event.connection, IPAddr(ip), servers)
+          core.registerNew(iplb, event.connection, IPAddr(ip), servers,
+                           selector, health_check, fin_timeout)
           LBinitDone = 1
 
         log.info("Load Balancing on %s", event.connection)
@@ -12,9 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """
-A very sloppy IP load balancer.
+A very sloppy IP load balancer for many switches and services.
 
-Run it with --ip=<Service IP> --servers=IP1,IP2,...
+Run it with --config=<services file> (see pox.lib.lb.registry), and/or
+--ip=<Service IP> --servers=IP1,IP2,... --switch_dpid=<DPID>.
 
 Please submit improvements. :)
 """
@@ -30,61 +31,28 @@ from pox.lib.addresses import IPAddr, EthAddr
 from pox.lib.util import str_to_bool, dpid_to_str
 
 import pox.openflow.libopenflow_01 as of
+import pox.openflow.nicira as nx
+from pox.lib.lb.selection import make_selector
+from pox.lib.lb.memory import MemoryEntry, FlowMemory
+from pox.lib.lb.fastpath import peek_tcp
+from pox.lib.lb.monitor import LoadMonitor
+from pox.lib.lb.health import HealthChecker, parse_check
+from pox.lib.lb import ServerDrained, servers_with_flows
+from pox.lib.lb.registry import Service, ServiceRegistry, parse_services
+from pox.lib.revent import EventMixin
+import proto.arp_responder as arp_responder
+import logging
 
 import time
 import random
 
 FLOW_IDLE_TIMEOUT = 10
 FLOW_MEMORY_TIMEOUT = 60 * 5
-
-CURRENT_RR_INDEX = 0
-
-
-class MemoryEntry (object):
-  """
-  Record for flows we are balancing
-
-  Table entries in the switch "remember" flows for a period of time, but
-  rather than set their expirations to some long value (potentially leading
-  to lots of rules for dead connections), we let them expire from the
-  switch relatively quickly and remember them here in the controller for
-  longer.
-
-  Another tactic would be to increase the timeouts on the switch and use
-  the Nicira extension which can match packets with FIN set to remove them
-  when the connection closes.
-  """
-  def __init__ (self, server, first_packet, client_port):
-    self.server = server
-    self.first_packet = first_packet
-    self.client_port = client_port
-    self.refresh()
-
-  def refresh (self):
-    self.timeout = time.time() + FLOW_MEMORY_TIMEOUT
-
-  @property
-  def is_expired (self):
-    return time.time() > self.timeout
-
-  @property
-  def key1 (self):
-    ethp = self.first_packet
-    ipp = ethp.find('ipv4')
-    tcpp = ethp.find('tcp')
-
-    return ipp.srcip,ipp.dstip,tcpp.srcport,tcpp.dstport
-
-  @property
-  def key2 (self):
-    ethp = self.first_packet
-    ipp = ethp.find('ipv4')
-    tcpp = ethp.find('tcp')
-
-    return self.server,ipp.srcip,tcpp.dstport,tcpp.srcport
+FLOW_FIN_LINGER = FLOW_IDLE_TIMEOUT # How long to remember closed flows
+DRAIN_CHECK_INTERVAL = 5 # How often to ask the switch about draining servers
 
 
-class iplb (object):
+class iplb (EventMixin):
   """
   A simple IP load balancer
 
@@ -92,10 +60,19 @@ class iplb (object):
   to service_ip will be randomly redirected to one of the servers.
 
   We probe the servers to see if they're alive by sending them ARPs.
+
+  Servers can be drained (see drain_server()), and we raise ServerDrained
+  when a draining server's last flow is gone.
   """
-  def __init__ (self, connection, service_ip, servers = []):
+  _eventMixin_events = set([ServerDrained])
+
+  def __init__ (self, connection, service_ip, servers = [],
+                selector = None, health_check = None, fin_timeout = None,
+                service_port = None):
     self.service_ip = IPAddr(service_ip)
+    self.service_port = service_port # None means all ports
     self.servers = [IPAddr(a) for a in servers]
+    self._server_set = frozenset(self.servers)
     self.con = connection
     self.mac = self.con.eth_addr
     self.live_servers = {} # IP -> MAC,port
@@ -117,12 +94,97 @@ class iplb (object):
     # We remember where we directed flows so that if they start up again,
     # we can send them to the same server if it's still up.  Alternate
     # approach: hashing.
-    self.memory = {} # (srcip,dstip,srcport,dstport) -> MemoryEntry
-
+    # (srcip,dstip,srcport,dstport) -> MemoryEntry
+    self.memory = FlowMemory(FLOW_MEMORY_TIMEOUT)
+    self._templates = {} # See _flow_template()
+
+    # How we pick a server for a new flow (see pox.lib.lb.selection).
+    # With the "hash" selector, a forgotten flow is sent back to the same
+    # server, so memory can be rebuilt from scratch (e.g., after a restart).
+    if selector is None: selector = 'rr'
+    self.monitor = None
+    self._set_selector(selector)
+
+    # Optional active health checks (e.g., "http:80/status"; see
+    # pox.lib.lb.health).  Servers only get new flows if they answer our
+    # ARPs *and* pass their health checks.
+    self.health = None
+    self._set_health_check(health_check)
+
+    # Servers not getting new flows (server -> True once it has no flows)
+    self.draining = {}
+    self._drain_check = None # Flow stats request about them
+    self._drain_check_time = 0
+
+    # If fin_timeout is set (Open vSwitch only), our flow rules use the
+    # Nicira fin_timeout action so that seeing a FIN or RST gives them a
+    # hard timeout of fin_timeout seconds, and ask for FlowRemoved
+    # messages.  Our rules otherwise never have a hard timeout, so a rule
+    # removed for that reason means the connection is closing.  (Without
+    # fin_timeout, a removal only means the flow went idle, and we keep
+    # remembering it anyway, so we don't ask.)
+    self.fin_timeout = fin_timeout
+
+    self._stopped = False
     self._do_probe() # Kick off the probing
 
-    # As part of a gross hack, we now do this from elsewhere
-    self.con.addListeners(self)
+    # MultiBalancer passes us our PacketIns and FlowRemoveds
+
+  def _set_selector (self, name):
+    self.selector_name = name
+    self.selector = make_selector(name)
+
+    # Load-aware selectors get kept up to date with how many flows each
+    # server has and how much traffic the switch sees for it.
+    if self.selector.needs_connections:
+      self.selector.connections = self.memory.server_counts
+    if self.selector.needs_rates:
+      if self.monitor is None: self.monitor = LoadMonitor(self)
+      self.selector.rates = self.monitor.rates
+    elif self.monitor is not None:
+      self.monitor.stop()
+      self.monitor = None
+
+  def _set_health_check (self, health_check):
+    if self.health is not None: self.health.stop()
+    self.health = None
+    self.health_check = health_check
+    if health_check is not None:
+      mode,port,path = parse_check(health_check)
+      self.health = HealthChecker(self.servers, self._health_changed,
+                                  port=port, mode=mode, path=path)
+
+  def reconfigure (self, servers, selector = None, health_check = None):
+    """
+    Change our servers, selector and health check while running
+
+    Unlike starting a new balancer, this keeps our flow memory, which
+    servers are draining, and health check state for the servers we
+    still have.  The selector and health checker are only replaced if
+    they're actually different.
+    """
+    servers = [IPAddr(a) for a in servers]
+    for server in self._server_set.difference(servers):
+      self.live_servers.pop(server, None)
+      self.outstanding_probes.pop(server, None)
+      self.draining.pop(server, None)
+    # Change it in place, since the HealthChecker reads it too
+    self.servers[:] = servers
+    self._server_set = frozenset(servers)
+
+    if selector is None: selector = 'rr'
+    if selector != self.selector_name: self._set_selector(selector)
+    if health_check != self.health_check:
+      self._set_health_check(health_check)
+    self._servers_changed()
+
+  def stop (self):
+    """
+    Stop balancing (e.g., because our service was removed)
+    """
+    self._stopped = True
+    if self.health is not None: self.health.stop()
+    if self.monitor is not None: self.monitor.stop()
 
   def _do_expire (self):
     """
@@ -139,18 +201,19 @@ class iplb (object):
         if ip in self.live_servers:
           self.log.warn("Server %s down", ip)
           del self.live_servers[ip]
+          self._servers_changed()
 
     # Expire old flows
-    c = len(self.memory)
-    self.memory = {k:v for k,v in self.memory.items()
-                   if not v.is_expired}
-    if len(self.memory) != c:
-      self.log.debug("Expired %i flows", c-len(self.memory))
+    c = self.memory.expire(t)
+    if c:
+      self.log.debug("Expired %i flows", c)
+    if self.draining: self._check_drained(t)
 
   def _do_probe (self):
     """
     Send an ARP to a server to see if it's still up
     """
+    if self._stopped: return
     self._do_expire()
 
     server = self.servers.pop(0)
@@ -187,246 +250,413 @@ class iplb (object):
     r = max(.25, r) # Cap it at four per second
     return r
 
+  def _usable_servers (self):
+    """
+    Servers which may be given new flows
+    """
+    servers = [s for s in self.live_servers if s not in self.draining]
+    if self.health is None: return servers
+    return [s for s in servers if self.health.is_healthy(s)]
+
+  def drain_server (self, server):
+    """
+    Stop giving new flows to a server
+
+    Flows it already has keep going to it (their memory entries and table
+    entries are left alone).  Once it has none left (in our memory or in
+    the switch), we raise ServerDrained and it can be taken down without
+    breaking any connections.
+    """
+    server = IPAddr(server)
+    if server not in self.servers:
+      raise RuntimeError("%s is not one of our servers" % (server,))
+    if server in self.draining: return
+    self.log.info("Draining %s", server)
+    self.draining[server] = False
+    self._servers_changed()
+    self._check_drained()
+
+  def undrain_server (self, server):
+    """
+    Let a draining server have new flows again
+    """
+    server = IPAddr(server)
+    if self.draining.pop(server, None) is None: return
+    self.log.info("No longer draining %s", server)
+    self._servers_changed()
+
+  def _check_drained (self, now = None):
+    """
+    Asks the switch about draining servers which we remember no flows for
+
+    We forget flows which haven't sent us a PacketIn for a while, but a
+    long-lived one may still be going through the switch, so a server is
+    only drained once the switch has no rules for it either.
+    """
+    if self._drain_check is not None: return
+    if now is None: now = time.time()
+    if now - self._drain_check_time < DRAIN_CHECK_INTERVAL: return
+    for server,drained in self.draining.iteritems():
+      if not drained and not self.memory.server_counts.get(server): break
+    else:
+      return
+    self._drain_check_time = now
+    match = of.ofp_match(dl_type = ethernet.IP_TYPE,
+                         nw_proto = ipv4.TCP_PROTOCOL)
+    msg = of.ofp_stats_request(body = of.ofp_flow_stats_request(match=match))
+    # (If we're disconnected, it has already failed when this returns)
+    r = self.con.request(msg, self._drain_checked)
+    if not r.done: self._drain_check = r
+
+  def _drain_checked (self, request):
+    self._drain_check = None
+    if not request.ok: return # We'll ask again
+    busy = servers_with_flows(request.body, self.service_ip)
+    for server,drained in self.draining.items():
+      if drained or self.memory.server_counts.get(server): continue
+      if server in busy: continue
+      self.draining[server] = True
+      self.log.info("Server %s is drained", server)
+      self.raiseEvent(ServerDrained, self, server)
+
+  def server_status (self):
+    """
+    Returns a list of dicts describing our servers
+    """
+    r = []
+    for server in sorted(self.servers):
+      d = {'server' : str(server),
+           'live' : server in self.live_servers,
+           'draining' : server in self.draining,
+           'drained' : self.draining.get(server, False),
+           'connections' : self.memory.server_counts.get(server, 0)}
+      if self.health is not None:
+        d['healthy'] = self.health.is_healthy(server)
+      r.append(d)
+    return r
+
+  def _health_changed (self, server, healthy):
+    self._servers_changed()
+
+  def _servers_changed (self):
+    """
+    Called when live_servers has changed
+    """
+    self._templates.clear()
+    self.selector.set_servers(self._usable_servers())
+
   def _pick_server (self, key, inport):
-    global CURRENT_RR_INDEX
-    print self.live_servers.keys()
-    try:
-      ch = self.live_servers.keys()[CURRENT_RR_INDEX]
-      CURRENT_RR_INDEX += 1
-      return ch
-    except:
-      CURRENT_RR_INDEX = 0
-      ch = self.live_servers.keys()[CURRENT_RR_INDEX]
-      CURRENT_RR_INDEX += 1
-      return ch
-    # ch = random.choice(self.live_servers.keys())
+    """
+    Pick a server for a (hopefully) new connection
+    """
+    return self.selector.pick(key, inport)
+
+  def _flow_actions (self):
+    """
+    Starts the action list for a per-flow rule
+    """
+    if self.fin_timeout is None: return []
+    return [nx.nx_action_fin_timeout(fin_idle_timeout = 0,
+                                     fin_hard_timeout = self.fin_timeout)]
+
+  def _flow_flags (self):
+    """
+    Returns the flags for a per-flow rule
+    """
+    if self.fin_timeout is None: return 0
+    return of.OFPFF_SEND_FLOW_REM
+
+  def _flow_template (self, to_server, mac, ip, port):
+    """
+    Returns the FlowModTemplate for per-flow rules with the given rewrite
+
+    Rules toward a server rewrite the destination to its mac and ip;
+    rules back to a client rewrite the source.  There's only one action
+    list per server (or client port), so they're packed once and reused.
+    """
+    key = to_server,mac,ip,port
+    template = self._templates.get(key)
+    if template is None:
+      actions = self._flow_actions()
+      if to_server:
+        actions.append(of.ofp_action_dl_addr.set_dst(mac))
+        actions.append(of.ofp_action_nw_addr.set_dst(ip))
+      else:
+        actions.append(of.ofp_action_dl_addr.set_src(mac))
+        actions.append(of.ofp_action_nw_addr.set_src(ip))
+      actions.append(of.ofp_action_output(port = port))
+      template = of.FlowModTemplate(command=of.OFPFC_ADD,
+                                    idle_timeout=FLOW_IDLE_TIMEOUT,
+                                    hard_timeout=of.OFP_FLOW_PERMANENT,
+                                    flags=self._flow_flags(),
+                                    actions=actions)
+      self._templates[key] = template
+    return template
+
+  def _handle_FlowRemoved (self, event):
+    if not event.hardTimeout: return
+    m = event.ofp.match
+    if m.nw_proto != ipv4.TCP_PROTOCOL: return
+    # Works for rules in either direction, since they match on the
+    # flow's key1 or key2 respectively
+    entry = self.memory.get((m.nw_src, m.nw_dst, m.tp_src, m.tp_dst))
+    if entry is None: return
+    self.memory.linger(entry, FLOW_FIN_LINGER)
+
+  def _drop (self, event):
+    if event.ofp.buffer_id is not None:
+      # Kill the buffer
+      msg = of.ofp_packet_out(data = event.ofp)
+      self.con.send(msg)
+    return None
 
   def _handle_PacketIn (self, event):
+    # Nearly everything we see is TCP, and for that we only need a few
+    # header fields, so we peek at them rather than parse the whole packet.
+    h = peek_tcp(event.data)
+    if h is not None:
+      return self._handle_tcp(event, h)
+
     inport = event.port
     packet = event.parsed
+    arpp = packet.find('arp')
+    if arpp:
+      # Handle replies to our server-liveness probes
+      if arpp.opcode == arpp.REPLY:
+        if arpp.protosrc in self.outstanding_probes:
+          # A server is (still?) up; cool.
+          del self.outstanding_probes[arpp.protosrc]
+          if (self.live_servers.get(arpp.protosrc, (None,None))
+              == (arpp.hwsrc,inport)):
+            # Ah, nothing new here.
+            pass
+          else:
+            # Ooh, new server.
+            self.live_servers[arpp.protosrc] = arpp.hwsrc,inport
+            self._servers_changed()
+            self.log.info("Server %s up", arpp.protosrc)
+      return
+
+    # Not TCP and not ARP.  Don't know what to do with this.  Drop it.
+    return self._drop(event)
+
+  def _handle_tcp (self, event, h):
+    """
+    Handles a TCP PacketIn given its headers (see pox.lib.lb.fastpath)
+    """
+    inport = event.port
 
-    def drop ():
-      if event.ofp.buffer_id is not None:
-        # Kill the buffer
-        msg = of.ofp_packet_out(data = event.ofp)
-        self.con.send(msg)
-      return None
-
-    tcpp = packet.find('tcp')
-    if not tcpp:
-      arpp = packet.find('arp')
-      if arpp:
-        # Handle replies to our server-liveness probes
-        if arpp.opcode == arpp.REPLY:
-          if arpp.protosrc in self.outstanding_probes:
-            # A server is (still?) up; cool.
-            del self.outstanding_probes[arpp.protosrc]
-            if (self.live_servers.get(arpp.protosrc, (None,None))
-                == (arpp.hwsrc,inport)):
-              # Ah, nothing new here.
-              pass
-            else:
-              # Ooh, new server.
-              self.live_servers[arpp.protosrc] = arpp.hwsrc,inport
-              self.log.info("Server %s up", arpp.protosrc)
-        return
-
-      # Not TCP and not ARP.  Don't know what to do with this.  Drop it.
-      return drop()
-
-    # It's TCP.
-    
-    ipp = packet.find('ipv4')
-
-    if ipp.srcip in self.servers:
+    if h.nw_src in self._server_set:
       # It's FROM one of our balanced servers.
       # Rewrite it BACK to the client
 
-      key = ipp.srcip,ipp.dstip,tcpp.srcport,tcpp.dstport
+      key = h.nw_src,h.nw_dst,h.tp_src,h.tp_dst
       entry = self.memory.get(key)
 
       if entry is None:
         # We either didn't install it, or we forgot about it.
         self.log.debug("No client for %s", key)
-        return drop()
+        return self._drop(event)
 
       # Refresh time timeout and reinstall.
-      entry.refresh()
+      self.memory.refresh(entry)
 
       #self.log.debug("Install reverse flow for %s", key)
 
       # Install reverse table entry
       mac,port = self.live_servers[entry.server]
 
-      actions = []
-      actions.append(of.ofp_action_dl_addr.set_src(self.mac))
-      actions.append(of.ofp_action_nw_addr.set_src(self.service_ip))
-      actions.append(of.ofp_action_output(port = entry.client_port))
-      match = of.ofp_match.from_packet(packet, inport)
-
-      msg = of.ofp_flow_mod(command=of.OFPFC_ADD,
-                            idle_timeout=FLOW_IDLE_TIMEOUT,
-                            hard_timeout=of.OFP_FLOW_PERMANENT,
-                            data=event.ofp,
-                            actions=actions,
-                            match=match)
-      self.con.send(msg)
+      template = self._flow_template(False, self.mac, self.service_ip,
+                                     entry.client_port)
+      self.con.send(template.pack(h.match(inport), data=event.ofp))
 
-    elif ipp.dstip == self.service_ip:
+    elif (h.nw_dst == self.service_ip
+          and self.service_port in (None, h.tp_dst)):
       # Ah, it's for our service IP and needs to be load balanced
 
       # Do we already know this flow?
-      key = ipp.srcip,ipp.dstip,tcpp.srcport,tcpp.dstport
+      key = h.nw_src,h.nw_dst,h.tp_src,h.tp_dst
       entry = self.memory.get(key)
       if entry is None or entry.server not in self.live_servers:
         # Don't know it (hopefully it's new!)
         if len(self.live_servers) == 0:
           self.log.warn("No servers!")
-          return drop()
+          return self._drop(event)
 
         # Pick a server for this flow
         server = self._pick_server(key, inport)
+        if server is None:
+          self.log.warn("No servers accepting new flows!")
+          return self._drop(event)
+
         # print serverlist
         # server = serverlist[0]
         # self.log.debug("Received server: %s", server)
         self.log.debug("Directing traffic to %s", server)
-        entry = MemoryEntry(server, packet, inport)
+        entry = MemoryEntry(server, key, inport)
         self.log.debug("Looked up entry server %s", entry.server)
-        self.memory[entry.key1] = entry
-        self.memory[entry.key2] = entry
+        self.memory.add(entry)
    
       # Update timestamp
-      entry.refresh()
+      self.memory.refresh(entry)
 
       # Set up table entry towards selected server
       mac,port = self.live_servers[entry.server]
 
-      actions = []
-      actions.append(of.ofp_action_dl_addr.set_dst(mac))
-      actions.append(of.ofp_action_nw_addr.set_dst(entry.server))
-      actions.append(of.ofp_action_output(port = port))
-      match = of.ofp_match.from_packet(packet, inport)
-
-      msg = of.ofp_flow_mod(command=of.OFPFC_ADD,
-                            idle_timeout=FLOW_IDLE_TIMEOUT,
-                            hard_timeout=of.OFP_FLOW_PERMANENT,
-                            data=event.ofp,
-                            actions=actions,
-                            match=match)
-      self.con.send(msg)
-
-
-# Remember which DPID we're operating on (first one to connect)
-_dpid = None
-
-# hardcoding multi switch settings
-iplist = ["10.0.1.1", "10.0.1.2"]
-serverlist = ["10.0.0.1,10.0.0.2","10.0.0.4,10.0.0.5"]
-dpidlist=["3","4"]
-LBinited = [0, 0]
+      template = self._flow_template(True, mac, entry.server, port)
+      self.con.send(template.pack(h.match(inport), data=event.ofp))
 
-iplb_list = list()
 
-# hardcoding single switch settings
-# iplist = ["10.0.1.1"]
-# serverlist = ["10.0.0.1,10.0.0.2"]
-# dpidlist=["3"]
-
-from proto.arp_responder import launch as arp_launch
-import logging
+# Used when there's no config file and no service on the commandline
+DEFAULT_CONFIG = {
+  "services" : [
+    {"dpid" : "3", "vip" : "10.0.1.1", "servers" : ["10.0.0.1", "10.0.0.2"]},
+    {"dpid" : "4", "vip" : "10.0.1.2", "servers" : ["10.0.0.4", "10.0.0.5"]},
+  ]
+}
 
 
-# launch ARP reponder for the passed switch. the LB is launched elsewhere on connection Up event.
-def launchLB(service_ip, service_servers, sw_dpid):
-  try:
-    # service_servers = service_servers.replace(","," ").split()
-    # servers = [IPAddr(x) for x in service_servers]
-    ip = IPAddr(service_ip)
-    _dpid = sw_dpid
-
-    objname = "arp_resp_"+_dpid
-    arp_launch(eat_packets=False,objname=objname,**{str(ip):True})
-    logging.getLogger("proto.arp_responder").setLevel(logging.WARN)
-
-    # log.info("IP Load Balancer Ready for Switch %s", _dpid)
-    # core.registerNew(iplb, event.connection, IPAddr(ip), servers)
-    # log.info("Load Balancing on %s", _dpid)
-
-  except Exception as ex:
-    print ex 
-
-
-
-# this will launch the LB object for each switch, reading from hardcoded array values above
-def launch (ip=None, servers=None, switch_dpid=None):
-  global iplist, serverlist, dpidlist, iplb_list, LBinited
-  print iplist
-  print serverlist
-  print dpidlist
-
-  for i in range(len(iplist)):
-    launchLB(iplist[i], serverlist[i], dpidlist[i])
-
-  # global _dpid
-  # try:
-
-  #   servers = servers.replace(","," ").split()
-  #   servers = [IPAddr(x) for x in servers]
-  #   ip = IPAddr(ip)
-  #   # _dpid = switch_dpid
-
-  #   # Boot up ARP Responder
-  #   from proto.arp_responder import launch as arp_launch
-  #   arp_launch(eat_packets=False,**{str(ip):True})
-  #   import logging
-  #   logging.getLogger("proto.arp_responder").setLevel(logging.WARN)
-    
-    def _handle_ConnectionUp (event):
-      global iplist, serverlist, dpidlist, iplb_list, LBinited
-      print "Event in from dpid: " + str(event.dpid)
-
-      if str(event.dpid) in dpidlist:
-        idx = dpidlist.index(str(event.dpid))
-        temp_service_servers = serverlist[idx]
-        temp_service_servers = temp_service_servers.replace(","," ").split()
-        servers = [IPAddr(x) for x in temp_service_servers]
-
-        # core.registerNew(iplb, event.connection, IPAddr(iplist[idx]), servers)
-        if (LBinited[i] != 1):
-          iplb_obj = iplb(event.connection, IPAddr(iplist[idx]), servers)
-          lb_component_name = "iplb_"+str(event.dpid)
-          core.register(lb_component_name, iplb_obj) # todo register component with some name, and then invoke funcs on that obj
-          iplb_list.append(lb_component_name) #add this component name to list
-          LBinited[i] = 1
-
-        log.info("Load Balancing on %s", event.dpid)
+class MultiBalancer (object):
+  """
+  Runs an iplb for each service in a ServiceRegistry
+
+  We listen to all switches and hand each PacketIn and FlowRemoved to the
+  balancer for the service it belongs to, which is found with a couple of
+  dict lookups on (dpid, IP, port).  When the registry changes, balancers
+  for removed services are stopped and new ones started, and the ARP
+  responder is told about the VIPs.  A service which is still on the same
+  switch, VIP and port but has new servers, selector or health check has
+  its balancer reconfigured instead, so it doesn't lose its state.
+  """
+  def __init__ (self, registry, selector = None, fin_timeout = None):
+    self.registry = registry
+    self.default_selector = selector
+    self.fin_timeout = fin_timeout
+    self.balancers = {} # Service key -> iplb
+    self._by_dpid = {} # dpid -> [iplb]
+    self._vips = set()
+
+    self._update_arp()
+    registry.addListeners(self)
+    core.openflow.addListeners(self)
+
+  def _update_arp (self):
+    vips = set(s.vip for s in self.registry.services.itervalues())
+    for vip in self._vips.difference(vips):
+      arp_responder._arp_table.pop(vip, None)
+    for vip in vips.difference(self._vips):
+      arp_responder._arp_table[vip] = arp_responder.Entry(True)
+    self._vips = vips
+
+  def _start (self, service, connection):
+    selector = service.selector or self.default_selector
+    lb = iplb(connection, service.vip, service.servers, selector,
+              service.health_check, fin_timeout = self.fin_timeout,
+              service_port = service.port)
+    self.balancers[service.key] = lb
+    self._by_dpid.setdefault(service.dpid, []).append(lb)
+    core.register(service.name, lb)
+    log.info("Balancing %s", service)
+
+  def _stop (self, service):
+    lb = self.balancers.pop(service.key, None)
+    if lb is None: return
+    lb.stop()
+    self._by_dpid[service.dpid].remove(lb)
+    if core.components.get(service.name) is lb:
+      del core.components[service.name]
+    log.info("Stopped balancing %s", service)
+
+  def _update (self, service, lb):
+    selector = service.selector or self.default_selector
+    lb.reconfigure(service.servers, selector, service.health_check)
+    log.info("Updated %s", service)
+
+  def _handle_ServicesChanged (self, event):
+    added = dict((s.key, s) for s in event.added)
+    updated = set()
+    for service in event.removed:
+      lb = self.balancers.get(service.key)
+      if lb is not None and service.key in added:
+        self._update(added[service.key], lb)
+        updated.add(service.key)
+      else:
+        self._stop(service)
+    for service in event.added:
+      if service.key in updated: continue
+      con = core.openflow.getConnection(service.dpid)
+      if con is not None: self._start(service, con)
+    self._update_arp()
+
+  def _handle_ConnectionUp (self, event):
+    for service in self.registry.services_for(event.dpid):
+      lb = self.balancers.get(service.key)
+      if lb is None:
+        self._start(service, event.connection)
       else:
-        log.warn("this dpid %s not found in dpid list!", event.dpid)
-
-  #     global _dpid
-  #     if _dpid is None:
-  #       log.info("IP Load Balancer Ready.")
-  #       core.registerNew(iplb, event.connection, IPAddr(ip), servers)
-  #       # if switch not specified in params, then LB the first switch which connects
-  #       # else set it to the passed value in params
-  #       if (switch_dpid is None):
-  #         _dpid = event.dpid
-  #       else:
-  #         _dpid = switch_dpid
-
-  #     if str(_dpid) != str(event.dpid):
-  #       log.warn("Ignoring switch %s. Needed dpid: %s, found in event: %s", event.connection, _dpid, event.dpid)
-  #     else:
-  #       log.info("Load Balancing on %s", event.connection)
-
-  #       '''
-  #       # Gross hack
-  #       # core.iplb.con = event.connection
-  #       # event.connection.addListeners(core.iplb)
-  #       '''
-
-  # except Exception as ex:
-  #   print ex 
-
-
-  core.openflow.addListenerByName("ConnectionUp", _handle_ConnectionUp)
+        lb.con = event.connection # Switch reconnected
+
+  def _handle_PacketIn (self, event):
+    h = peek_tcp(event.data)
+    if h is not None:
+      service = self.registry.lookup(event.dpid, h.nw_dst, h.tp_dst)
+      if service is None:
+        service = self.registry.lookup_server(event.dpid, h.nw_src, h.tp_src)
+        if service is None: return
+      lb = self.balancers.get(service.key)
+      if lb is not None: lb._handle_tcp(event, h)
+      return
+
+    lbs = self._by_dpid.get(event.dpid)
+    if not lbs: return
+    arpp = event.parsed.find('arp')
+    if arpp:
+      if arpp.opcode == arpp.REPLY:
+        for lb in lbs:
+          if lb.service_ip == arpp.protodst: lb._handle_PacketIn(event)
+    elif event.ofp.buffer_id is not None:
+      # Not TCP and not ARP on a balancing switch; kill the buffer
+      event.connection.send(of.ofp_packet_out(data = event.ofp))
+
+  def _handle_FlowRemoved (self, event):
+    m = event.ofp.match
+    service = self.registry.lookup(event.dpid, m.nw_dst, m.tp_dst)
+    if service is None:
+      service = self.registry.lookup_server(event.dpid, m.nw_src, m.tp_src)
+      if service is None: return
+    lb = self.balancers.get(service.key)
+    if lb is not None: lb._handle_FlowRemoved(event)
+
+
+'''
+config = JSON (or YAML) file of services to balance; see
+         pox.lib.lb.registry.  It's reloaded when it changes.
+ip, servers, switch_dpid, port = one more service (overriding any from
+         the config file for the same switch, IP and port)
+selector = default server selector for services which don't set one
+fin_timeout = see lbcode
+'''
+def launch (config=None, ip=None, servers=None, switch_dpid=None, port=None,
+            selector=None, fin_timeout=None):
+  if fin_timeout is not None: fin_timeout = int(fin_timeout)
+
+  overrides = []
+  if ip is not None:
+    if servers is None or switch_dpid is None:
+      raise RuntimeError("--ip needs --servers and --switch_dpid")
+    servers = servers.replace(",", " ").split()
+    overrides.append(Service(switch_dpid, ip, port, servers))
+
+  if config is not None:
+    registry = ServiceRegistry(config, overrides)
+  else:
+    registry = ServiceRegistry(overrides = overrides)
+    if not overrides:
+      registry.set_services(parse_services(DEFAULT_CONFIG))
+
+  # Boot up ARP Responder (the balancer adds the VIPs to it)
+  arp_responder.launch(eat_packets=False)
+  logging.getLogger("proto.arp_responder").setLevel(logging.WARN)
+
+  core.register("lb_services", registry)
+  core.registerNew(MultiBalancer, registry, selector, fin_timeout)
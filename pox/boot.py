@@ -353,6 +353,8 @@ Notable POX options include:
   --no-openflow   Don't automatically load the OpenFlow module
   --log-config=F  Load a Python log configuration file (if you include the
                   option without specifying F, it defaults to logging.cfg)
+  --select-loop   Wait for I/O in the scheduler's thread instead of a
+                  separate one (see pox.lib.recoco.loop)
 
 C1, C2, etc. are component names (e.g., Python modules).  Options they
 support are up to the module.  As an example, you can load a learning
@@ -371,6 +373,7 @@ class POXOptions (Options):
     self.verbose = False
     self.enable_openflow = True
     self.log_config = None
+    self.select_loop = False
 
   def _set_h (self, given_name, name, value):
     self._set_help(given_name, name, value)
@@ -387,6 +390,9 @@ class POXOptions (Options):
   def _set_no_openflow (self, given_name, name, value):
     self.enable_openflow = not str_to_bool(value)
 
+  def _set_select_loop (self, given_name, name, value):
+    self.select_loop = str_to_bool(value)
+
 #  def _set_no_cli (self, given_name, name, value):
 #    self.cli = not str_to_bool(value)
 
@@ -423,6 +429,10 @@ def _pre_startup ():
   if _options.verbose:
     logging.getLogger().setLevel(logging.DEBUG)
 
+  if _options.select_loop:
+    from pox.lib.recoco.loop import SelectLoop
+    core.set_scheduler(SelectLoop(daemon=True, isDefaultScheduler=True))
+
   if _options.enable_openflow:
     pox.openflow.launch() # Default OpenFlow launch
 
@@ -199,6 +199,17 @@ class POXCore (EventMixin):
 
     self._waiters = [] # List of waiting components
 
+  def set_scheduler (self, scheduler):
+    """
+    Replaces the recoco scheduler
+
+    This is only for use at startup, before anything has used the old one.
+    """
+    old = self.scheduler
+    self.scheduler = scheduler
+    old.quit()
+    old._event.set()
+
   @property
   def banner (self):
     return "{0} / Copyright 2011-2013 James McCauley, et al.".format(
@@ -81,6 +81,9 @@ class LearningSwitch (object):
     # Our table
     self.macToPort = {}
 
+    # Flow_mods for each output port, all packed but for the match
+    self._templates = {}
+
     # We want to hear PacketIn messages, so we listen
     # to the connection
     connection.addListeners(self)
@@ -165,13 +168,13 @@ class LearningSwitch (object):
         # 6
         log.debug("installing flow for %s.%i -> %s.%i" %
                   (packet.src, event.port, packet.dst, port))
-        msg = of.ofp_flow_mod()
-        msg.match = of.ofp_match.from_packet(packet, event.port)
-        msg.idle_timeout = 10
-        msg.hard_timeout = 30
-        msg.actions.append(of.ofp_action_output(port = port))
-        msg.data = event.ofp # 6a
-        self.connection.send(msg)
+        template = self._templates.get(port)
+        if template is None:
+          template = of.FlowModTemplate(idle_timeout = 10, hard_timeout = 30,
+              action = of.ofp_action_output(port = port))
+          self._templates[port] = template
+        match = of.ofp_match.from_packet(packet, event.port)
+        self.connection.send(template.pack(match, data = event.ofp)) # 6a
 
 
 class l2_learning (object):
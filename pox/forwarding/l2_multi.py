@@ -30,7 +30,6 @@ Works with openflow.spanning_tree
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 from pox.lib.revent import *
-from pox.lib.recoco import Timer
 from collections import defaultdict
 from pox.openflow.discovery import Discovery
 from pox.lib.util import dpid_to_str
@@ -50,9 +49,6 @@ mac_map = {}
 # [sw1][sw2] -> (distance, intermediate)
 path_map = defaultdict(lambda:defaultdict(lambda:(None,None)))
 
-# Waiting path.  (dpid,xid)->WaitingPath
-waiting_paths = {}
-
 # Time to not flood in seconds
 FLOOD_HOLDDOWN = 5
 
@@ -167,33 +163,36 @@ class WaitingPath (object):
   """
   def __init__ (self, path, packet):
     """
-    xids is a sequence of (dpid,xid)
     first_switch is the DPID where the packet came from
     packet is something that can be sent in a packet_out
     """
-    self.expires_at = time.time() + PATH_SETUP_TIME
     self.path = path
     self.first_switch = path[0][0].dpid
-    self.xids = set()
+    self.requests = set()
+    self.failed = False
     self.packet = packet
 
-    if len(waiting_paths) > 1000:
-      WaitingPath.expire_waiting_paths()
-
-  def add_xid (self, dpid, xid):
-    self.xids.add((dpid,xid))
-    waiting_paths[(dpid,xid)] = self
-
-  @property
-  def is_expired (self):
-    return time.time() >= self.expires_at
+  def add_barrier (self, connection):
+    """
+    Sends a barrier on connection and waits for it
+    """
+    r = connection.request(of.ofp_barrier_request(),
+                           timeout = PATH_SETUP_TIME)
+    self.requests.add(r)
+    r.add_callback(self.notify)
 
-  def notify (self, event):
+  def notify (self, request):
     """
-    Called when a barrier has been received
+    Called when a barrier has been answered (or has failed)
     """
-    self.xids.discard((event.dpid,event.xid))
-    if len(self.xids) == 0:
+    self.requests.discard(request)
+    if self.failed: return
+    if not request.ok:
+      self.failed = True
+      log.error("Path failed to install (%s on %s)", request.status,
+                dpid_to_str(request.connection.dpid))
+      return
+    if len(self.requests) == 0:
       # Done!
       if self.packet:
         log.debug("Sending delayed packet out %s"
@@ -205,19 +204,6 @@ class WaitingPath (object):
       core.l2_multi.raiseEvent(PathInstalled(self.path))
 
 
-  @staticmethod
-  def expire_waiting_paths ():
-    packets = set(waiting_paths.values())
-    killed = 0
-    for p in packets:
-      if p.is_expired:
-        killed += 1
-        for entry in p.xids:
-          waiting_paths.pop(entry, None)
-    if killed:
-      log.error("%i paths failed to install" % (killed,))
-
-
 class PathInstalled (Event):
   """
   Fired when a path is installed
@@ -252,9 +238,7 @@ class Switch (EventMixin):
     wp = WaitingPath(p, packet_in)
     for sw,in_port,out_port in p:
       self._install(sw, in_port, out_port, match)
-      msg = of.ofp_barrier_request()
-      sw.connection.send(msg)
-      wp.add_xid(sw.dpid,msg.xid)
+      wp.add_barrier(sw.connection)
 
   def install_path (self, dst_sw, last_port, match, event):
     """
@@ -493,17 +477,6 @@ class l2_multi (EventMixin):
     else:
       sw.connect(event.connection)
 
-  def _handle_BarrierIn (self, event):
-    wp = waiting_paths.pop((event.dpid,event.xid), None)
-    if not wp:
-      #log.info("No waiting packet %s,%s", event.dpid, event.xid)
-      return
-    #log.debug("Notify waiting packet %s,%s", event.dpid, event.xid)
-    wp.notify(event)
-
 
 def launch ():
   core.registerNew(l2_multi)
-
-  timeout = min(max(PATH_SETUP_TIME, 5) * 2, 15)
-  Timer(timeout, WaitingPath.expire_waiting_paths, recurring=True)
@@ -114,3 +114,88 @@ class EpollSelect(object):
 
   def close(self):
     self.epoll.close()
+
+
+_EPOLL_READ = getattr(select, 'EPOLLIN', 0) | getattr(select, 'EPOLLPRI', 0)
+_EPOLL_ERR = getattr(select, 'EPOLLERR', 0) | getattr(select, 'EPOLLHUP', 0)
+_EPOLL_WRITE = getattr(select, 'EPOLLOUT', 0)
+
+class EpollPoller (object):
+  """ Persistent epoll registrations for a set of things to read from.
+
+      Unlike EpollSelect, which works out what changed from the lists passed
+      to every select() call, things are registered once with add() and stay
+      registered until remove().  A wakeup then only costs something for the
+      things which are actually ready, no matter how many are registered.
+
+      The poller has a fileno() of its own, so a recoco Task can Select() on
+      just the poller and then call poll() to see what's ready.
+
+      Things are only watched for writability while want_write() says so,
+      since a socket with room in its send buffer is almost always writable.
+  """
+
+  def __init__(self):
+    self.epoll = select.epoll()
+    self._objs = {} # fd -> obj
+    self._fds = {}  # obj -> fd
+
+  def fileno(self):
+    return self.epoll.fileno()
+
+  def __len__(self):
+    return len(self._objs)
+
+  def __contains__(self, obj):
+    return obj in self._fds
+
+  def add(self, obj):
+    """ register a socket-like object (or raw fd) for reading """
+    fd = obj.fileno() if hasattr(obj, "fileno") else obj
+    self.epoll.register(fd, _EPOLL_READ)
+    self._objs[fd] = obj
+    self._fds[obj] = fd
+
+  def want_write(self, obj, want=True):
+    """ start (or stop) watching a registered obj for writability """
+    fd = self._fds[obj]
+    self.epoll.modify(fd, _EPOLL_READ | (_EPOLL_WRITE if want else 0))
+
+  def remove(self, obj):
+    """ unregister obj.  call this *before* closing it. """
+    fd = self._fds.pop(obj, None)
+    if fd is None: return
+    del self._objs[fd]
+    try:
+      self.epoll.unregister(fd)
+    except (IOError, OSError, ValueError):
+      # already closed (which takes it out of the epoll set)
+      pass
+
+  def poll(self, timeout=0):
+    """ returns (readable, writable, errored) lists of registered objects.
+
+        Something which is both readable and errored (e.g., the other side
+        sent data and then hung up) is only returned as readable; reading
+        from it will find the error.
+    """
+    rl = []
+    wl = []
+    xl = []
+    objs = self._objs
+    for (fd, event) in self.epoll.poll(timeout):
+      obj = objs.get(fd)
+      if obj is None: continue
+      if event & _EPOLL_READ:
+        rl.append(obj)
+      elif event & _EPOLL_ERR:
+        xl.append(obj)
+        continue
+      if event & _EPOLL_WRITE:
+        wl.append(obj)
+    return (rl, wl, xl)
+
+  def close(self):
+    self.epoll.close()
+    self._objs.clear()
+    self._fds.clear()
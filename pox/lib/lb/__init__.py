@@ -0,0 +1,58 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Building blocks for load balancing components
+
+These are shared by the IP load balancers (see pox.misc.ip_loadbalancer
+and the iplb variants in mylb/), which differ mostly in how they're
+launched.
+"""
+
+from pox.lib.revent import Event
+import pox.openflow.libopenflow_01 as of
+
+
+class ServerDrained (Event):
+  """
+  Raised by a load balancer when a server being drained has no flows left
+  """
+  def __init__ (self, balancer, server):
+    Event.__init__(self)
+    self.balancer = balancer
+    self.server = server
+
+
+def servers_with_flows (flow_stats, service_ip):
+  """
+  Returns the set of servers which still have per-flow rules for a service
+
+  flow_stats is a list of ofp_flow_stats (e.g., the body of a flow stats
+  reply).  Rules toward a server match the service IP and rewrite the
+  destination to the server; rules back from it match the server and
+  rewrite the source to the service IP.  Rules without an idle timeout
+  (e.g., proactive wildcard rules) don't count.
+  """
+  servers = set()
+  for f in flow_stats:
+    if not f.idle_timeout: continue
+    dst = src = None
+    for a in f.actions:
+      if a.type == of.OFPAT_SET_NW_DST:
+        dst = a.nw_addr
+      elif a.type == of.OFPAT_SET_NW_SRC:
+        src = a.nw_addr
+    if dst is not None and f.match.nw_dst == service_ip:
+      servers.add(dst)
+    elif src == service_ip and f.match.nw_src is not None:
+      servers.add(f.match.nw_src)
+  return servers
@@ -0,0 +1,119 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Fast header peeking for load balancer PacketIns
+
+Parsing a packet with pox.lib.packet builds an object for every layer
+(and find() then walks them), but a load balancer only needs a handful of
+header fields to decide what to do with a TCP packet.  peek_tcp() reads
+them straight out of the raw data with precompiled structs.  Anything it
+doesn't recognize is left to the full parser.
+"""
+
+import struct
+
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import IPAddr, EthAddr
+
+_ETH = struct.Struct("!6s6sH")
+_VLAN = struct.Struct("!HH")
+_IP = struct.Struct("!BB4xHxB2x4s4s") # vhl, tos, frag, proto, src, dst
+_PORTS = struct.Struct("!HH8xB") # srcport, dstport, data offset
+
+_VLAN_TYPE = 0x8100
+_IP_TYPE = 0x0800
+_TCP_PROTOCOL = 6
+_ETH_LEN = _ETH.size
+_VLAN_LEN = _VLAN.size
+_IP_LEN = 20
+_TCP_LEN = 20
+
+
+class TCPHeaders (object):
+  """
+  The header fields of a TCP/IPv4 packet which matter for balancing
+
+  nw_src and nw_dst are IPAddrs; the Ethernet addresses are kept raw
+  until match() needs them.
+  """
+  __slots__ = ('dl_src', 'dl_dst', 'dl_vlan', 'dl_vlan_pcp', 'nw_tos',
+               'nw_src', 'nw_dst', 'tp_src', 'tp_dst')
+
+  def match (self, in_port = None):
+    """
+    Returns an exact match for the packet
+
+    This is the same as ofp_match.from_packet() would give.
+    """
+    return of.ofp_match(in_port = in_port,
+                        dl_src = EthAddr(self.dl_src),
+                        dl_dst = EthAddr(self.dl_dst),
+                        dl_vlan = self.dl_vlan,
+                        dl_vlan_pcp = self.dl_vlan_pcp,
+                        dl_type = _IP_TYPE,
+                        nw_tos = self.nw_tos,
+                        nw_proto = _TCP_PROTOCOL,
+                        nw_src = self.nw_src,
+                        nw_dst = self.nw_dst,
+                        tp_src = self.tp_src,
+                        tp_dst = self.tp_dst)
+
+  def __repr__ (self):
+    return "<TCPHeaders %s:%s->%s:%s>" % (self.nw_src, self.tp_src,
+                                          self.nw_dst, self.tp_dst)
+
+
+def peek_tcp (data):
+  """
+  Returns TCPHeaders if data is an Ethernet TCP/IPv4 packet, else None
+
+  Packets with truncated headers get None, as do unusual encapsulations
+  (e.g., LLC/SNAP) which the full parser would understand.  So do IP
+  fragments other than the first, which don't have a TCP header.
+  """
+  dlen = len(data)
+  if dlen < _ETH_LEN + _IP_LEN + _TCP_LEN: return None
+  dst,src,dl_type = _ETH.unpack_from(data)
+  offset = _ETH_LEN
+  vlan = of.OFP_VLAN_NONE
+  pcp = 0
+  if dl_type == _VLAN_TYPE:
+    tci,dl_type = _VLAN.unpack_from(data, offset)
+    vlan = tci & 0x0fff
+    pcp = tci >> 13
+    offset += _VLAN_LEN
+  if dl_type != _IP_TYPE: return None
+
+  if dlen < offset + _IP_LEN: return None
+  vhl,tos,frag,proto,nw_src,nw_dst = _IP.unpack_from(data, offset)
+  if proto != _TCP_PROTOCOL or (vhl >> 4) != 4: return None
+  if frag & 0x1fff: return None
+  hl = (vhl & 0x0f) * 4
+  if hl < _IP_LEN: return None
+  offset += hl
+
+  if dlen < offset + _TCP_LEN: return None
+  tp_src,tp_dst,off = _PORTS.unpack_from(data, offset)
+  if (off >> 4) < 5: return None
+
+  h = TCPHeaders()
+  h.dl_src = src
+  h.dl_dst = dst
+  h.dl_vlan = vlan
+  h.dl_vlan_pcp = pcp
+  h.nw_tos = tos
+  h.nw_src = IPAddr(nw_src)
+  h.nw_dst = IPAddr(nw_dst)
+  h.tp_src = tp_src
+  h.tp_dst = tp_dst
+  return h
@@ -0,0 +1,221 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Active health checks for load balanced servers
+
+A server can answer ARPs just fine while the service on it is hung.  The
+HealthChecker here actually connects to the service (and optionally does
+an HTTP request) from the controller, so the controller must be able to
+reach the servers.
+"""
+
+import socket
+import errno
+import time
+
+from pox.core import core
+from pox.lib.recoco import Task, Select, Sleep, PRIORITY_LOW
+
+log = core.getLogger()
+
+
+def parse_check (spec):
+  """
+  Parses a health check spec like "tcp:80" or "http:8080/status"
+
+  Returns (mode, port, path).
+  """
+  mode,_,rest = spec.partition(':')
+  mode = mode.lower()
+  if mode not in ('tcp', 'http'):
+    raise RuntimeError("Unknown health check type '%s'" % (mode,))
+  port,slash,path = rest.partition('/')
+  port = int(port) if port else 80
+  return mode,port,slash+path if slash else '/'
+
+
+class HealthTracker (object):
+  """
+  Applies rise/fall hysteresis to health check results
+
+  A healthy server has to fail fall checks in a row to be considered
+  unhealthy, and an unhealthy one has to pass rise checks in a row to be
+  considered healthy again.  Servers start out healthy.
+  """
+  def __init__ (self, rise = 2, fall = 3):
+    self.rise = rise
+    self.fall = fall
+    self._healthy = {} # server -> bool
+    self._streak = {} # server -> results in a row disagreeing with state
+
+  def is_healthy (self, server):
+    return self._healthy.get(server, True)
+
+  def report (self, server, ok):
+    """
+    Takes a check result
+
+    Returns the server's new state if it changed, or None if not.
+    """
+    state = self._healthy.get(server, True)
+    if ok == state:
+      self._streak[server] = 0
+      return None
+    n = self._streak.get(server, 0) + 1
+    if n < (self.rise if ok else self.fall):
+      self._streak[server] = n
+      return None
+    self._healthy[server] = ok
+    self._streak[server] = 0
+    return ok
+
+
+class _Probe (object):
+  __slots__ = ('server', 'sock', 'connected', 'data')
+
+  def __init__ (self, server, sock):
+    self.server = server
+    self.sock = sock
+    self.connected = False
+    self.data = b''
+
+
+class HealthChecker (Task):
+  """
+  Checks a set of servers every interval seconds
+
+  All servers are checked at once by this one Task: we start non-blocking
+  connects to all of them and then Select on the lot until they've all
+  answered or timeout passes.  In "tcp" mode, a completed connect is a
+  pass.  In "http" mode, we send a GET for path and need a 2xx or 3xx
+  status back.
+
+  servers is a list which is read at the start of every round, so the
+  owner can change it.  callback(server, healthy) is called only when a
+  server's state changes (after hysteresis).
+  """
+  priority = PRIORITY_LOW
+
+  def __init__ (self, servers, callback, port = 80, mode = 'tcp',
+                path = '/', interval = 2, timeout = 1, rise = 2, fall = 3):
+    Task.__init__(self)
+    self.servers = servers
+    self.callback = callback
+    self.port = port
+    self.mode = mode
+    self.path = path
+    self.interval = interval
+    self.timeout = timeout
+    self.tracker = HealthTracker(rise, fall)
+    self.running = True
+    self.start()
+
+  def stop (self):
+    self.running = False
+
+  def is_healthy (self, server):
+    return self.tracker.is_healthy(server)
+
+  def _report (self, server, ok):
+    changed = self.tracker.report(server, ok)
+    if changed is not None:
+      log.info("Server %s is now %s", server,
+               "healthy" if changed else "unhealthy")
+      self.callback(server, changed)
+
+  def _result (self, probe, ok):
+    probe.sock.close()
+    self._report(probe.server, ok)
+
+  def _open (self, server):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setblocking(0)
+    err = s.connect_ex((str(server), self.port))
+    if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+      s.close()
+      return None
+    return s
+
+  def _connected (self, probe):
+    """
+    Handles a probe's socket becoming writable
+
+    Returns True if the probe is finished.
+    """
+    err = probe.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    if err:
+      self._result(probe, False)
+      return True
+    if self.mode == 'tcp':
+      self._result(probe, True)
+      return True
+    probe.connected = True
+    req = "GET %s HTTP/1.0\r\nHost: %s\r\nConnection: close\r\n\r\n"
+    try:
+      probe.sock.send(req % (self.path, probe.server))
+    except socket.error:
+      self._result(probe, False)
+      return True
+    return False
+
+  def _readable (self, probe):
+    """
+    Handles data arriving on an HTTP probe
+
+    Returns True if the probe is finished.
+    """
+    try:
+      d = probe.sock.recv(1024)
+    except socket.error:
+      d = b''
+    probe.data += d
+    if d and b'\n' not in probe.data and len(probe.data) < 1024:
+      return False # Wait for the rest of the status line
+    status = probe.data.split(None, 2)
+    ok = (len(status) >= 2 and status[0].startswith(b'HTTP/')
+          and status[1][:1] in (b'2', b'3'))
+    self._result(probe, ok)
+    return True
+
+  def run (self):
+    while self.running and core.running:
+      start = time.time()
+      deadline = start + self.timeout
+      pending = {} # socket -> _Probe
+      for server in list(self.servers):
+        sock = self._open(server)
+        if sock is None:
+          self._report(server, False)
+          continue
+        pending[sock] = _Probe(server, sock)
+
+      while pending:
+        now = time.time()
+        if now >= deadline: break
+        rlist = [s for s,p in pending.iteritems() if p.connected]
+        wlist = [s for s,p in pending.iteritems() if not p.connected]
+        rl,wl,xl = yield Select(rlist, wlist, pending.keys(), deadline - now)
+        for s in xl:
+          p = pending.pop(s, None)
+          if p: self._result(p, False)
+        for s in wl:
+          p = pending.get(s)
+          if p and self._connected(p): del pending[s]
+        for s in rl:
+          p = pending.get(s)
+          if p and self._readable(p): del pending[s]
+
+      for p in pending.values():
+        self._result(p, False) # Timed out
+
+      yield Sleep(max(0, start + self.interval - time.time()))
@@ -0,0 +1,203 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Flow memory for load balancers
+
+A load balancer remembers which server it sent each connection to so that
+it can keep sending it there.  There may be a great many of these, so
+entries are kept small and expiry only looks at entries which are due.
+"""
+
+import time
+
+
+class MemoryEntry (object):
+  """
+  Record for flows we are balancing
+
+  Table entries in the switch "remember" flows for a period of time, but
+  rather than set their expirations to some long value (potentially leading
+  to lots of rules for dead connections), we let them expire from the
+  switch relatively quickly and remember them here in the controller for
+  longer.
+
+  On Open vSwitch, iplb can also use the Nicira fin_timeout action to have
+  a connection's rules removed soon after it closes, and then forgets the
+  entry shortly afterwards (see FlowMemory.linger()).
+
+  We only keep the client side of the connection (all balanced flows are
+  TCP), the server, the client's switch port, when we expire, and whether
+  we're lingering.
+  """
+  __slots__ = ('srcip', 'dstip', 'srcport', 'dstport', 'server',
+               'client_port', 'timeout', 'lingering')
+
+  def __init__ (self, server, key, client_port, timeout = 0):
+    self.srcip,self.dstip,self.srcport,self.dstport = key
+    self.server = server
+    self.client_port = client_port
+    self.timeout = timeout
+    self.lingering = False
+
+  @property
+  def is_expired (self):
+    return time.time() > self.timeout
+
+  @property
+  def key1 (self):
+    """
+    Key for packets from the client
+    """
+    return self.srcip,self.dstip,self.srcport,self.dstport
+
+  @property
+  def key2 (self):
+    """
+    Key for packets from the server
+    """
+    return self.server,self.srcip,self.dstport,self.srcport
+
+  def __repr__ (self):
+    return "<MemoryEntry %s:%s->%s:%s via %s>" % (self.srcip, self.srcport,
+        self.server, self.dstport, self.client_port)
+
+
+class FlowMemory (object):
+  """
+  Remembers MemoryEntrys by both of their keys and expires them
+
+  Entries are put into buckets of granularity seconds according to their
+  expiration time, and expire() only opens the buckets whose time has
+  passed.  Refreshing an entry just moves its timeout; if it's still alive
+  when its old bucket comes up, it's moved to the right bucket then.  This
+  means entries can outlive their timeout by up to granularity seconds.
+
+  server_counts maps each server to the number of flows remembered for it.
+  """
+  def __init__ (self, timeout = 60 * 5, granularity = 1):
+    self.timeout = timeout
+    self.granularity = float(granularity)
+    self._table = {} # key -> MemoryEntry
+    self._buckets = {} # tick -> [MemoryEntry]
+    self._tick = self._tick_for(time.time())
+    self._count = 0
+    self.server_counts = {}
+
+  def _tick_for (self, t):
+    return int(t // self.granularity)
+
+  def _schedule (self, entry):
+    tick = max(self._tick_for(entry.timeout), self._tick)
+    bucket = self._buckets.get(tick)
+    if bucket is None:
+      self._buckets[tick] = [entry]
+    else:
+      bucket.append(entry)
+
+  def __len__ (self):
+    """
+    Number of flows remembered (each is stored under two keys)
+    """
+    return self._count
+
+  def __contains__ (self, key):
+    return key in self._table
+
+  def get (self, key, default = None):
+    return self._table.get(key, default)
+
+  def add (self, entry):
+    """
+    Remember an entry (replacing any existing one for the same flow)
+    """
+    old = self._table.get(entry.key1)
+    if old is not None: self.remove(old)
+    self._table[entry.key1] = entry
+    self._table[entry.key2] = entry
+    self._count += 1
+    self.server_counts[entry.server] = self.server_counts.get(entry.server,0)+1
+    self.refresh(entry)
+    self._schedule(entry)
+
+  def refresh (self, entry, now = None):
+    """
+    Push back an entry's expiration
+
+    The entry stays in whatever bucket it's in; expire() sorts it out.
+    Entries which are lingering aren't pushed back, since the stragglers
+    of a closed connection shouldn't keep it around.
+    """
+    if entry.lingering: return
+    if now is None: now = time.time()
+    entry.timeout = now + self.timeout
+
+  def linger (self, entry, seconds, now = None):
+    """
+    Forget an entry after a short while (e.g., when its connection closed)
+
+    This only ever brings the expiration closer.  We keep the entry around
+    for a bit rather than removing it so that stragglers (e.g., the last
+    ACK) still go to the right server.
+    """
+    if now is None: now = time.time()
+    entry.lingering = True
+    timeout = now + seconds
+    if timeout >= entry.timeout: return
+    entry.timeout = timeout
+    self._schedule(entry)
+
+  def remove (self, entry):
+    """
+    Forget an entry
+
+    Returns False if it wasn't remembered (anymore).
+    """
+    if self._table.get(entry.key1) is not entry: return False
+    del self._table[entry.key1]
+    if self._table.get(entry.key2) is entry:
+      del self._table[entry.key2]
+    self._count -= 1
+    c = self.server_counts[entry.server] - 1
+    if c:
+      self.server_counts[entry.server] = c
+    else:
+      del self.server_counts[entry.server]
+    return True
+
+  def expire (self, now = None):
+    """
+    Forget entries whose time has come
+
+    Returns the number of entries expired.
+    """
+    if now is None: now = time.time()
+    tick = self._tick_for(now)
+    if tick - self._tick > len(self._buckets):
+      # We haven't been called in a while; don't walk all the empty ticks
+      ticks = sorted(t for t in self._buckets if t < tick)
+    else:
+      ticks = xrange(self._tick, tick)
+    self._tick = tick
+
+    expired = 0
+    for t in ticks:
+      bucket = self._buckets.pop(t, None)
+      if not bucket: continue
+      for entry in bucket:
+        if entry.timeout > now:
+          # Was refreshed since it was put here
+          if self._table.get(entry.key1) is entry:
+            self._schedule(entry)
+        elif self.remove(entry):
+          expired += 1
+    return expired
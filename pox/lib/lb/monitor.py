@@ -0,0 +1,162 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Estimates server load from a load balancing switch's statistics
+"""
+
+import time
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.packet.ethernet import ethernet
+from pox.lib.packet.ipv4 import ipv4
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+
+class LoadMonitor (object):
+  """
+  Polls a load balancer's switch for flow and port stats
+
+  Every interval seconds, we send one flow stats request (for all TCP
+  flows) and one port stats request (for all ports).  A new request isn't
+  sent while the last one of that kind is still outstanding, unless it's
+  been more than reply_timeout seconds; this keeps us from piling up
+  requests on a switch which is slow to answer.
+
+  Flow stats are attributed to servers: forward flows by the address they
+  rewrite to and reverse flows by their source.  Port stats are used for
+  servers which have a switch port to themselves, since they also see
+  traffic which we aren't balancing.
+
+  lb is the load balancer; we use its con and live_servers attributes.
+  The result is rates (server -> bytes/sec), which is updated in place.
+  """
+  def __init__ (self, lb, interval = 5, reply_timeout = None):
+    self.lb = lb
+    self.interval = interval
+    if reply_timeout is None: reply_timeout = interval * 3
+    self.reply_timeout = reply_timeout
+
+    self.rates = {} # server -> bytes/sec
+    self.flow_rates = {} # server -> bytes/sec
+    self.port_rates = {} # port -> bytes/sec
+
+    self._flow_bytes = {} # flow -> byte count at last reply
+    self._port_bytes = {} # port -> byte count at last reply
+    self._last_reply = {} # 'flow'/'port' -> time
+    self._outstanding = {} # 'flow'/'port' -> time of request
+
+    self._listeners = core.openflow.addListeners(self)
+    self._timer = Timer(interval, self._poll, recurring = True)
+
+  def stop (self):
+    self._timer.cancel()
+    core.openflow.removeListeners(self._listeners)
+
+  def _may_send (self, kind, now):
+    sent = self._outstanding.get(kind)
+    return sent is None or now - sent > self.reply_timeout
+
+  def _poll (self):
+    con = self.lb.con
+    if con is None or con.disconnected: return
+    now = time.time()
+
+    if self._may_send('flow', now):
+      match = of.ofp_match(dl_type = ethernet.IP_TYPE,
+                           nw_proto = ipv4.TCP_PROTOCOL)
+      body = of.ofp_flow_stats_request(match = match)
+      con.send(of.ofp_stats_request(body = body))
+      self._outstanding['flow'] = now
+
+    if self._may_send('port', now):
+      con.send(of.ofp_stats_request(body = of.ofp_port_stats_request()))
+      self._outstanding['port'] = now
+
+  def _elapsed (self, kind, now):
+    """
+    Time since the last reply of this kind (None if this is the first)
+    """
+    self._outstanding.pop(kind, None)
+    last = self._last_reply.get(kind)
+    self._last_reply[kind] = now
+    if last is None or now <= last: return None
+    return now - last
+
+  def _server_for_flow (self, stats):
+    match = stats.match
+    live = self.lb.live_servers
+    if match.nw_src in live:
+      return match.nw_src
+    if match.nw_dst == self.lb.service_ip:
+      for a in stats.actions:
+        if a.type == of.OFPAT_SET_NW_DST:
+          return a.nw_addr
+    return None
+
+  def _handle_FlowStatsReceived (self, event):
+    if event.connection is not self.lb.con: return
+    now = time.time()
+    dt = self._elapsed('flow', now)
+
+    old = self._flow_bytes
+    new = {}
+    totals = {}
+    for stats in event.stats:
+      server = self._server_for_flow(stats)
+      if server is None: continue
+      m = stats.match
+      flow = (m.in_port, m.nw_src, m.nw_dst, m.tp_src, m.tp_dst)
+      new[flow] = stats.byte_count
+      delta = stats.byte_count - old.get(flow, 0)
+      if delta < 0: delta = stats.byte_count # Must be a new flow
+      totals[server] = totals.get(server, 0) + delta
+    self._flow_bytes = new
+
+    if dt is None: return
+    self.flow_rates = dict((s, b / dt) for s,b in totals.iteritems())
+    self._update_rates()
+
+  def _handle_PortStatsReceived (self, event):
+    if event.connection is not self.lb.con: return
+    now = time.time()
+    dt = self._elapsed('port', now)
+
+    old = self._port_bytes
+    new = {}
+    rates = {}
+    for stats in event.stats:
+      b = stats.rx_bytes + stats.tx_bytes
+      new[stats.port_no] = b
+      if dt is not None and stats.port_no in old:
+        rates[stats.port_no] = max(0, b - old[stats.port_no]) / dt
+    self._port_bytes = new
+
+    if dt is None: return
+    self.port_rates = rates
+    self._update_rates()
+
+  def _update_rates (self):
+    live = self.lb.live_servers
+    servers_on_port = {}
+    for mac,port in live.itervalues():
+      servers_on_port[port] = servers_on_port.get(port, 0) + 1
+
+    self.rates.clear()
+    for server,(mac,port) in live.iteritems():
+      if servers_on_port[port] == 1 and port in self.port_rates:
+        self.rates[server] = self.port_rates[port]
+      else:
+        self.rates[server] = self.flow_rates.get(server, 0)
@@ -0,0 +1,105 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Proactive (wildcard rule) load balancing support
+
+Rather than having the controller pick a server for every new connection,
+the client address space is cut into equal-sized prefixes ("buckets"), and
+each bucket is given to a server.  A load balancer can then install one
+wildcard rule per bucket, and the switch does the rest.
+"""
+
+from pox.lib.addresses import IPAddr, parse_cidr
+
+
+class PrefixBuckets (object):
+  """
+  Splits a client network into 2**bits prefixes and assigns them to servers
+
+  The number of buckets a server gets is proportional to its weight.  When
+  the servers or weights change, rebalance() moves as few buckets as it
+  can: buckets stay with their server unless the server is gone or has
+  more than its share now.
+  """
+  def __init__ (self, network = "0.0.0.0/0", bits = 4):
+    net,netbits = parse_cidr(network, infer = False)
+    self.prefix_len = netbits + bits
+    if self.prefix_len > 32:
+      raise RuntimeError("Can't split /%s into 2**%s buckets"
+                         % (netbits, bits))
+    base = net.toUnsigned()
+    shift = 32 - self.prefix_len
+    self.prefixes = [IPAddr(base | (i << shift)) for i in xrange(1 << bits)]
+    self.assignment = [None] * len(self.prefixes) # bucket -> server
+
+  def __len__ (self):
+    return len(self.prefixes)
+
+  def prefix (self, bucket):
+    """
+    Returns the (address, prefix length) for a bucket
+    """
+    return self.prefixes[bucket],self.prefix_len
+
+  def _targets (self, servers, weights):
+    """
+    Works out how many buckets each server should have
+
+    Uses largest remainders so that the total always comes out right.
+    """
+    weights = dict((s, weights.get(s, 1)) for s in servers)
+    weights = dict((s, w) for s,w in weights.iteritems() if w > 0)
+    total = sum(weights.itervalues())
+    if total == 0: return {}
+    n = len(self.prefixes)
+    targets = {}
+    remainders = []
+    for s,w in weights.iteritems():
+      share = n * w
+      targets[s] = share // total
+      remainders.append((-(share % total), s))
+    remainders.sort()
+    for _,s in remainders[:n - sum(targets.itervalues())]:
+      targets[s] += 1
+    return targets
+
+  def rebalance (self, servers, weights = {}):
+    """
+    Reassigns buckets for the given servers and weights
+
+    weights is a server->weight dict; servers without one get weight 1.
+    Returns a list of the buckets whose server changed.
+    """
+    targets = self._targets(servers, weights)
+    counts = dict((s, 0) for s in targets)
+    free = []
+    for i,s in enumerate(self.assignment):
+      if s in counts and counts[s] < targets[s]:
+        counts[s] += 1
+      else:
+        free.append(i)
+
+    changed = []
+    needy = [s for s in sorted(targets) if counts[s] < targets[s]]
+    for i in free:
+      s = None
+      while needy:
+        if counts[needy[0]] < targets[needy[0]]:
+          s = needy[0]
+          counts[s] += 1
+          break
+        needy.pop(0)
+      if self.assignment[i] != s:
+        self.assignment[i] = s
+        changed.append(i)
+    return changed
@@ -0,0 +1,242 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A registry of load balanced services
+
+A service is a virtual IP (and optionally a TCP port) on a particular
+switch along with the pool of servers behind it.  Services are usually
+read from a JSON (or, if PyYAML is installed, YAML) file like:
+
+  {
+    "services" : [
+      {
+        "dpid" : "00-00-00-00-00-03",
+        "vip" : "10.0.1.1",
+        "port" : 80,
+        "servers" : ["10.0.0.1", "10.0.0.2"],
+        "selector" : "leastconn"
+      },
+      {
+        "dpid" : ["4", "5"],
+        "vip" : "10.0.1.2",
+        "servers" : ["10.0.0.4", "10.0.0.5"]
+      }
+    ]
+  }
+
+"dpid" may be a list, in which case the service is on each of those
+switches.  Leaving out "port" balances all TCP ports on the VIP.  The
+optional "selector" and "health_check" are as for iplb.
+"""
+
+import os
+import json
+
+from pox.core import core
+from pox.lib.addresses import IPAddr
+from pox.lib.util import str_to_dpid, dpid_to_str
+from pox.lib.revent import EventMixin, Event
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+
+class Service (object):
+  """
+  One balanced VIP (and port) on one switch
+  """
+  def __init__ (self, dpid, vip, port = None, servers = [], selector = None,
+                health_check = None):
+    if not isinstance(dpid, (int, long)): dpid = str_to_dpid(str(dpid))
+    self.dpid = dpid
+    self.vip = IPAddr(vip)
+    self.port = int(port) if port else None
+    self.servers = tuple(IPAddr(s) for s in servers)
+    self.selector = selector
+    self.health_check = health_check
+    if not self.servers:
+      raise RuntimeError("Service %s has no servers" % (self,))
+
+  @property
+  def key (self):
+    return self.dpid,self.vip,self.port
+
+  @property
+  def name (self):
+    """
+    Name for registering a balancer for this service on core
+    """
+    n = "iplb_%s_%s" % (self.dpid, str(self.vip).replace(".", "_"))
+    if self.port: n += "_%s" % (self.port,)
+    return n
+
+  def _config (self):
+    return (self.key, self.servers, self.selector, self.health_check)
+
+  def __eq__ (self, other):
+    if not isinstance(other, Service): return False
+    return self._config() == other._config()
+
+  def __ne__ (self, other):
+    return not self.__eq__(other)
+
+  def __hash__ (self):
+    return hash(self.key)
+
+  def __str__ (self):
+    port = ":%s" % (self.port,) if self.port else ""
+    return "%s%s@%s" % (self.vip, port, dpid_to_str(self.dpid))
+
+
+def parse_services (config):
+  """
+  Makes a list of Services from parsed config data (see module docstring)
+  """
+  services = []
+  for s in config.get("services", []):
+    dpids = s["dpid"]
+    if not isinstance(dpids, list): dpids = [dpids]
+    for dpid in dpids:
+      services.append(Service(dpid, s["vip"], s.get("port"), s["servers"],
+                              s.get("selector"), s.get("health_check")))
+  return services
+
+
+def load_services (filename):
+  """
+  Reads Services from a JSON or YAML file
+  """
+  with open(filename) as f:
+    if filename.endswith((".yaml", ".yml")):
+      try:
+        import yaml
+      except ImportError:
+        raise RuntimeError("Reading %s requires PyYAML" % (filename,))
+      config = yaml.safe_load(f)
+    else:
+      config = json.load(f)
+  return parse_services(config or {})
+
+
+class ServicesChanged (Event):
+  """
+  Raised when the registry's services change
+
+  removed and added are lists of Services.  A service whose settings
+  changed shows up in both (the old one in removed).
+  """
+  def __init__ (self, removed, added):
+    super(ServicesChanged,self).__init__()
+    self.removed = removed
+    self.added = added
+
+
+class ServiceRegistry (EventMixin):
+  """
+  Keeps the current set of services and indexes them for fast lookup
+
+  lookup() finds the service for traffic to a VIP, and lookup_server()
+  the service for traffic from one of its servers.  Both are a dict lookup
+  or two, so they're fine to call for every packet.  The indexes are
+  rebuilt and swapped in whole whenever the services change.
+
+  If filename is given, the file is loaded, and it's checked every
+  poll_interval seconds and reloaded if it has changed.  If the new file
+  is broken, we complain and keep the old services.  overrides is a list
+  of Services which replace any from the file with the same key.
+  """
+  _eventMixin_events = set([ServicesChanged])
+
+  def __init__ (self, filename = None, overrides = [], poll_interval = 2):
+    self.filename = filename
+    self.overrides = list(overrides)
+    self.services = {} # key -> Service
+    self._vips = {} # (dpid, vip, port) -> Service
+    self._servers = {} # (dpid, server, port) -> Service
+    self._by_dpid = {} # dpid -> [Service]
+    self._mtime = None
+    self._timer = None
+
+    if filename is None:
+      self.set_services([])
+    else:
+      self.load()
+      if poll_interval:
+        self._timer = Timer(poll_interval, self._check_file, recurring=True)
+
+  def stop (self):
+    if self._timer: self._timer.cancel()
+
+  def lookup (self, dpid, vip, port):
+    s = self._vips.get((dpid, vip, port))
+    if s is None: s = self._vips.get((dpid, vip, None))
+    return s
+
+  def lookup_server (self, dpid, server, port):
+    s = self._servers.get((dpid, server, port))
+    if s is None: s = self._servers.get((dpid, server, None))
+    return s
+
+  def services_for (self, dpid):
+    return self._by_dpid.get(dpid, ())
+
+  def load (self):
+    """
+    (Re)loads services from our file
+    """
+    self._mtime = os.stat(self.filename).st_mtime
+    self.set_services(load_services(self.filename))
+
+  def _check_file (self):
+    try:
+      mtime = os.stat(self.filename).st_mtime
+      if mtime == self._mtime: return
+      log.info("Reloading services from %s", self.filename)
+      self.load()
+    except Exception as e:
+      log.error("Couldn't load services from %s: %s", self.filename, e)
+
+  def set_services (self, services):
+    """
+    Replaces all services (overrides still apply)
+
+    Raises RuntimeError if two services claim the same VIP or server.
+    """
+    new = {}
+    for s in list(services) + self.overrides:
+      new[s.key] = s
+
+    vips = {}
+    servers = {}
+    by_dpid = {}
+    for s in new.itervalues():
+      vips[s.key] = s
+      by_dpid.setdefault(s.dpid, []).append(s)
+      for server in s.servers:
+        k = (s.dpid, server, s.port)
+        if k in servers:
+          raise RuntimeError("Server %s is in both %s and %s"
+                             % (server, servers[k], s))
+        servers[k] = s
+
+    old = self.services
+    removed = [s for k,s in old.iteritems() if new.get(k) != s]
+    added = [s for k,s in new.iteritems() if old.get(k) != s]
+
+    self.services = new
+    self._vips = vips
+    self._servers = servers
+    self._by_dpid = by_dpid
+
+    if removed or added:
+      self.raiseEvent(ServicesChanged, removed, added)
@@ -0,0 +1,320 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Server selection policies for load balancers
+
+A selector is told which servers are currently usable via set_servers()
+(which is the only time it does any real work) and is then asked to
+pick() one for each new flow.  Flows are identified by a key of the form
+(srcip, dstip, srcport, dstport), which is what iplb uses for its
+flow memory.
+"""
+
+import struct
+import random
+import zlib
+import hashlib
+
+from pox.lib.addresses import IPAddr
+
+
+_flow_struct = struct.Struct("!4s4sHHB")
+
+def flow_hash (key, proto = 6):
+  """
+  Returns a stable 32 bit hash of a flow key
+
+  Unlike hash(), this is the same across runs of the controller, so it
+  can be used to get the same answer for a flow after a restart.
+  """
+  srcip,dstip,srcport,dstport = key
+  data = _flow_struct.pack(IPAddr(srcip).raw, IPAddr(dstip).raw,
+                           srcport, dstport, proto)
+  return zlib.crc32(data) & 0xffFFffFF
+
+
+class ServerSelector (object):
+  """
+  Base class for server selection policies
+
+  Subclasses generally override _rebuild() to precompute whatever they
+  need when the server set changes, and pick() to choose a server for a
+  new flow.  pick() returns None if there are no servers.
+
+  Selectors which want to know about load set needs_connections and/or
+  needs_rates, and the load balancer then keeps their connections
+  (server -> active flow count) and rates (server -> bytes/sec) dicts
+  up to date.
+  """
+  needs_connections = False
+  needs_rates = False
+
+  def __init__ (self):
+    self.servers = ()
+
+  def set_servers (self, servers):
+    """
+    Sets the servers which may be picked
+
+    servers is any iterable of server addresses (e.g., iplb's live_servers
+    dict).  We sort it so that the result doesn't depend on dict order.
+    """
+    self.servers = tuple(sorted(servers))
+    self._rebuild()
+
+  def _rebuild (self):
+    pass
+
+  def set_weights (self, weights):
+    """
+    Updates server weights from a server->weight dict
+    """
+    raise RuntimeError("%s does not support weights"
+                       % (type(self).__name__,))
+
+  def set_weight (self, server, weight):
+    self.set_weights({server:weight})
+
+  def pick (self, key, inport = None):
+    raise NotImplementedError()
+
+
+class RoundRobinSelector (ServerSelector):
+  """
+  Hands out servers in turn
+  """
+  def __init__ (self):
+    super(RoundRobinSelector,self).__init__()
+    self._index = 0
+
+  def pick (self, key, inport = None):
+    if not self.servers: return None
+    if self._index >= len(self.servers): self._index = 0
+    r = self.servers[self._index]
+    self._index += 1
+    return r
+
+
+class RandomSelector (ServerSelector):
+  """
+  Picks a server at random
+  """
+  def pick (self, key, inport = None):
+    if not self.servers: return None
+    return random.choice(self.servers)
+
+
+class _WeightedSelector (ServerSelector):
+  """
+  Base for selectors which take server weights
+
+  Servers without a weight get default_weight.  A weight of zero means
+  the server gets no new flows, which is useful for draining it.
+  """
+  def __init__ (self, weights = None, default_weight = 1):
+    super(_WeightedSelector,self).__init__()
+    self.weights = {}
+    self.default_weight = default_weight
+    if weights: self.set_weights(weights)
+
+  def set_weights (self, weights):
+    for server,weight in weights.iteritems():
+      weight = int(weight)
+      if weight < 0:
+        raise RuntimeError("Weight for %s must not be negative" % (server,))
+      self.weights[IPAddr(server)] = weight
+    self._rebuild()
+
+  def _weighted_servers (self):
+    """
+    Returns lists of servers with nonzero weight and their weights
+    """
+    servers = []
+    weights = []
+    for s in self.servers:
+      w = self.weights.get(s, self.default_weight)
+      if w > 0:
+        servers.append(s)
+        weights.append(w)
+    return servers,weights
+
+
+class WeightedRoundRobinSelector (_WeightedSelector):
+  """
+  Smooth weighted round-robin
+
+  Servers are handed out in proportion to their weights, interleaved
+  (nginx-style) rather than in runs.  Each pick() does one step of the
+  schedule: every server's current weight goes up by its weight, and the
+  one with the highest is picked and has the total taken off.  That's
+  O(servers) per pick, however big the weights are.
+  """
+  def __init__ (self, weights = None, default_weight = 1):
+    self._servers = ()
+    self._weights = ()
+    self._current = []
+    self._total = 0
+    super(WeightedRoundRobinSelector,self).__init__(weights, default_weight)
+
+  def _rebuild (self):
+    servers,weights = self._weighted_servers()
+    self._servers = tuple(servers)
+    self._weights = tuple(weights)
+    self._current = [0] * len(servers)
+    self._total = sum(weights)
+
+  def pick (self, key, inport = None):
+    if not self._servers: return None
+    current = self._current
+    best = 0
+    for i,w in enumerate(self._weights):
+      current[i] += w
+      if current[i] > current[best]: best = i
+    current[best] -= self._total
+    return self._servers[best]
+
+
+class LeastConnectionsSelector (_WeightedSelector):
+  """
+  Picks the server with the fewest active connections for its weight
+  """
+  needs_connections = True
+
+  def __init__ (self, weights = None, default_weight = 1):
+    self.connections = {}
+    self._candidates = ()
+    super(LeastConnectionsSelector,self).__init__(weights, default_weight)
+
+  def _rebuild (self):
+    servers,weights = self._weighted_servers()
+    self._candidates = tuple((s, float(w)) for s,w in zip(servers, weights))
+
+  def _load_function (self):
+    """
+    Returns a function which gives a server's current load
+    """
+    conns = self.connections
+    return lambda server: conns.get(server, 0)
+
+  def pick (self, key, inport = None):
+    load = self._load_function()
+    best = None
+    best_score = None
+    for s,w in self._candidates:
+      score = load(s) / w
+      if best is None or score < best_score:
+        best = s
+        best_score = score
+    return best
+
+
+class LeastLoadSelector (LeastConnectionsSelector):
+  """
+  Picks the server carrying the least traffic for its weight
+
+  Traffic rates are only measured every so often, so on their own they'd
+  send every new flow between measurements to the same server.  To avoid
+  this, each active connection also counts for the average rate of a
+  connection.
+  """
+  needs_rates = True
+
+  def __init__ (self, weights = None, default_weight = 1):
+    self.rates = {}
+    super(LeastLoadSelector,self).__init__(weights, default_weight)
+
+  def _load_function (self):
+    conns = self.connections
+    rates = self.rates
+    total = sum(conns.itervalues())
+    cost = sum(rates.itervalues()) / float(total) if total else 0
+    cost = max(cost, 1)
+    return lambda server: rates.get(server, 0) + conns.get(server, 0) * cost
+
+
+class MaglevSelector (ServerSelector):
+  """
+  Consistent hashing using a Maglev-style lookup table
+
+  Each server gets a pseudo-random permutation of the table slots, and
+  servers take turns claiming their next free preferred slot until the
+  table is full.  Picking is then a single table lookup on the flow hash.
+
+  When a server comes or goes, only around 1/N of the slots change
+  owner, so most existing flows keep mapping to the same server.  And
+  since the mapping depends only on the flow and the server set, a
+  restarted controller will send flows it has forgotten about to the
+  same server they were using before.
+
+  table_size should be prime and much larger than the number of servers
+  (the Maglev paper suggests at least 100 times larger).
+  """
+  def __init__ (self, table_size = 65537):
+    super(MaglevSelector,self).__init__()
+    self.table_size = table_size
+    self._table = ()
+
+  @staticmethod
+  def _permutation (server, size):
+    h = hashlib.md5(str(server)).digest()
+    offset,skip = struct.unpack("!II", h[:8])
+    return offset % size, skip % (size - 1) + 1
+
+  def _rebuild (self):
+    size = self.table_size
+    servers = self.servers
+    if not servers:
+      self._table = ()
+      return
+
+    perms = [self._permutation(s, size) for s in servers]
+    nexts = [0] * len(servers)
+    table = [None] * size
+    filled = 0
+    while True:
+      for i,(offset,skip) in enumerate(perms):
+        c = (offset + nexts[i] * skip) % size
+        while table[c] is not None:
+          nexts[i] += 1
+          c = (offset + nexts[i] * skip) % size
+        table[c] = servers[i]
+        nexts[i] += 1
+        filled += 1
+        if filled == size:
+          self._table = tuple(table)
+          return
+
+  def pick (self, key, inport = None):
+    if not self._table: return None
+    return self._table[flow_hash(key) % self.table_size]
+
+
+selectors = {
+  'rr' : RoundRobinSelector,
+  'wrr' : WeightedRoundRobinSelector,
+  'random' : RandomSelector,
+  'leastconn' : LeastConnectionsSelector,
+  'leastload' : LeastLoadSelector,
+  'hash' : MaglevSelector,
+}
+
+def make_selector (name, **kw):
+  """
+  Creates a selector by its short name (e.g., from the commandline)
+  """
+  try:
+    cls = selectors[name.lower()]
+  except KeyError:
+    raise RuntimeError("Unknown server selector '%s' (try one of: %s)"
+                       % (name, ", ".join(sorted(selectors))))
+  return cls(**kw)
@@ -0,0 +1,301 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A recoco Scheduler which waits for I/O in its own thread
+
+The normal Scheduler hands Select()s (and so Recv()s and Send()s) to a
+SelectHub, which waits on them in a thread of its own and hands the
+results back through a queue, a pinger and a threading.Event, so every
+I/O wakeup is a trip through two threads.  SelectLoop is an event loop
+in the style of asyncio's: it gives each ready Task a slice, runs any
+due timers, and then waits for I/O (with epoll where there is one),
+all in one thread.  Sleep() and Timers use the same TimerQueue as
+always.  Existing Tasks work unchanged, and Coroutines can be used too.
+
+Other threads can still use callLater(), schedule() and so on; they
+wake the loop with a pinger.
+
+POX uses it for core.scheduler if you give the --select-loop option.
+"""
+
+import select
+import errno
+import os
+import time
+import thread
+
+import pox.lib.util
+from pox.lib.recoco.recoco import Scheduler, CYCLE_MAXIMUM
+
+_EPOLL_IN = getattr(select, 'EPOLLIN', 0) | getattr(select, 'EPOLLPRI', 0)
+_EPOLL_OUT = getattr(select, 'EPOLLOUT', 0)
+_EPOLL_ERR = getattr(select, 'EPOLLERR', 0) | getattr(select, 'EPOLLHUP', 0)
+
+
+class _Waker (object):
+  """
+  Stands in for the Scheduler's threading.Event
+  """
+  def __init__ (self, hub):
+    self.set = hub.wake
+
+
+class LoopSelectHub (object):
+  """
+  Does the Select()s for a SelectLoop
+
+  Each Select() adds its descriptors to tables of what to wait for (any
+  number of Tasks can wait on the same one), and a timeout is a timer in
+  the scheduler's TimerQueue.  When using epoll,
+  registrations are only changed at the next poll(), so a Task that
+  selects on the same sockets every time around doesn't cost any
+  epoll_ctl() calls.
+  """
+  def __init__ (self, scheduler, useEpoll = True):
+    self._scheduler = scheduler
+    self._pinger = pox.lib.util.makePinger()
+    self._pinged = False
+    self.ident = None # Thread the loop runs in
+
+    self._readers = {} # fd -> {task:obj}
+    self._writers = {}
+    self._errors = {}
+    self._waiting = {} # task -> (fds, timer entry)
+
+    self._epoll = None
+    if useEpoll and hasattr(select, 'epoll'):
+      self._epoll = select.epoll()
+      self._epoll.register(self._pinger.fileno(), _EPOLL_IN)
+    self._registered = {} # fd -> epoll mask
+    self._dirty = set() # fds whose registration may need changing
+
+  def wake (self):
+    """
+    Wakes the loop up if it's waiting (for calling from other threads)
+    """
+    if self._pinged or thread.get_ident() == self.ident: return
+    self._pinged = True
+    self._pinger.ping()
+
+  _cycle = wake
+
+  def registerSelect (self, task, rlist = None, wlist = None, xlist = None,
+                      timeout = None, timeIsAbsolute = False):
+    fds = []
+    for objs,table in ((rlist, self._readers), (wlist, self._writers),
+                       (xlist, self._errors)):
+      if not objs: continue
+      for obj in objs:
+        fd = obj if isinstance(obj, (int, long)) else obj.fileno()
+        waiters = table.get(fd)
+        if waiters is None:
+          table[fd] = {task:obj}
+        else:
+          waiters[task] = obj
+        fds.append(fd)
+    self._dirty.update(fds)
+
+    entry = None
+    if timeout is not None:
+      if not timeIsAbsolute: timeout += time.time()
+      entry = self._scheduler.timers.add(timeout, self._timeout, (task,))
+    self._waiting[task] = (fds, entry)
+
+  def _timeout (self, task):
+    if task in self._waiting:
+      self._return(task, ([],[],[]))
+
+  def _return (self, task, rv):
+    fds,entry = self._waiting.pop(task)
+    if entry is not None:
+      self._scheduler.timers.cancel(entry)
+    for table in (self._readers, self._writers, self._errors):
+      for fd in fds:
+        waiters = table.get(fd)
+        if waiters is not None and task in waiters:
+          del waiters[task]
+          if not waiters: del table[fd]
+    self._dirty.update(fds)
+    task.rv = rv
+    self._scheduler.fast_schedule(task)
+
+  def _pong (self):
+    self._pinged = False
+    self._pinger.pongAll()
+
+  def poll (self, timeout):
+    """
+    Waits up to timeout seconds for I/O, and wakes the Tasks it's for
+    """
+    if self._epoll:
+      ready = self._poll_epoll(timeout)
+    else:
+      ready = self._poll_select(timeout)
+
+    rets = {}
+    tables = (self._readers, self._writers, self._errors)
+    for fd,which in ready:
+      waiters = tables[which].get(fd)
+      if waiters is None: continue
+      for task,obj in waiters.iteritems():
+        rv = rets.get(task)
+        if rv is None:
+          rv = rets[task] = ([],[],[])
+        rv[which].append(obj)
+    for task,rv in rets.iteritems():
+      self._return(task, rv)
+
+  def _broken (self, fd):
+    """
+    Says who to tell about an error on fd
+    """
+    if fd in self._errors: return [(fd, 2)]
+    # Nobody asked about errors; let readers and writers find them
+    return [(fd, 0), (fd, 1)]
+
+  def _poll_epoll (self, timeout):
+    epoll = self._epoll
+    registered = self._registered
+    ready = []
+    for fd in self._dirty:
+      mask = 0
+      if fd in self._readers: mask |= _EPOLL_IN
+      if fd in self._writers: mask |= _EPOLL_OUT
+      if not mask and fd not in self._errors:
+        if registered.pop(fd, None) is not None:
+          try:
+            epoll.unregister(fd)
+          except (IOError, OSError, ValueError):
+            pass # Already closed
+        continue
+      if registered.get(fd) == mask: continue
+      try:
+        if fd in registered:
+          try:
+            epoll.modify(fd, mask)
+          except IOError as e:
+            # It was closed (and maybe the number was reused)
+            if e.errno != errno.ENOENT: raise
+            epoll.register(fd, mask)
+        else:
+          epoll.register(fd, mask)
+        registered[fd] = mask
+      except (IOError, OSError, ValueError):
+        registered.pop(fd, None)
+        ready.extend(self._broken(fd))
+    self._dirty.clear()
+    if ready: timeout = 0
+
+    try:
+      events = epoll.poll(-1 if timeout is None else timeout)
+    except IOError as e:
+      if e.errno != errno.EINTR: raise
+      return ready
+    pinger = self._pinger.fileno()
+    for fd,event in events:
+      if fd == pinger:
+        self._pong()
+        continue
+      if event & _EPOLL_ERR:
+        if fd in self._errors:
+          ready.append((fd, 2))
+        else:
+          event |= _EPOLL_IN | _EPOLL_OUT
+      if event & _EPOLL_IN: ready.append((fd, 0))
+      if event & _EPOLL_OUT: ready.append((fd, 1))
+    return ready
+
+  def _poll_select (self, timeout):
+    pinger = self._pinger.fileno()
+    rl = self._readers.keys()
+    rl.append(pinger)
+    wl = self._writers.keys()
+    xl = self._errors.keys()
+    try:
+      ro,wo,xo = select.select(rl, wl, xl, timeout)
+    except select.error as e:
+      if e.args[0] == errno.EINTR: return []
+      if e.args[0] != errno.EBADF: raise
+      # Something was closed; blame it
+      ready = []
+      for fd in set(rl + wl + xl):
+        if not _is_open(fd): ready.extend(self._broken(fd))
+      return ready
+    ready = []
+    for fd in ro:
+      if fd == pinger:
+        self._pong()
+      else:
+        ready.append((fd, 0))
+    ready.extend((fd, 1) for fd in wo)
+    ready.extend((fd, 2) for fd in xo)
+    return ready
+
+  def close (self):
+    if self._epoll:
+      self._epoll.close()
+
+
+def _is_open (fd):
+  try:
+    os.fstat(fd)
+    return True
+  except OSError:
+    return False
+
+
+class SelectLoop (Scheduler):
+  """
+  A Scheduler that waits for I/O and timers in the same thread it runs
+  Tasks in (see the module docstring)
+  """
+  def __init__ (self, isDefaultScheduler = None, startInThread = True,
+                daemon = False, useEpoll = True):
+    self._useEpoll = useEpoll
+    Scheduler.__init__(self, isDefaultScheduler = isDefaultScheduler,
+                       startInThread = False, daemon = daemon)
+    self._event = _Waker(self._selectHub)
+    if startInThread:
+      self.runThreaded(daemon)
+
+  def _new_select_hub (self, useEpoll):
+    return LoopSelectHub(self, useEpoll = self._useEpoll)
+
+  def quit (self):
+    Scheduler.quit(self)
+    self._selectHub.wake()
+
+  def run (self):
+    hub = self._selectHub
+    hub.ident = thread.get_ident()
+    ready = self._ready
+    timers = self.timers
+    try:
+      while not self._hasQuit:
+        # Give everything that's ready a slice, then check for I/O
+        for i in xrange(len(ready)):
+          self.cycle()
+        if timers._heap: timers.run()
+
+        if ready or self._hasQuit:
+          timeout = 0
+        else:
+          timeout = CYCLE_MAXIMUM
+          when = timers.next_time()
+          if when is not None:
+            timeout = max(0, min(timeout, when - time.time()))
+        hub.poll(timeout)
+    finally:
+      self._hasQuit = True
+      hub.close()
+      self._allDone = True
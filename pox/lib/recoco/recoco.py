@@ -18,17 +18,28 @@ from Queue import PriorityQueue
 from Queue import Queue
 import time
 import threading
+import atexit
 from threading import Thread
 import select
 import traceback
+import sys
+import types
+import heapq
+import math
 import os
 import socket
 import pox.lib.util
-import random
 from pox.lib.epoll_select import EpollSelect
 
 CYCLE_MAXIMUM = 2
 
+# Task priorities.  Ready Tasks are run strictly by level (with aging so
+# lower levels aren't starved; see ReadyQueue).  Tasks doing OpenFlow I/O
+# are HIGH; bulk work (health checks, web requests) is LOW.
+PRIORITY_HIGH = 2
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 0
+
 # A ReturnFunction can return this to skip a scheduled slice at the last
 # moment.
 ABORT = object()
@@ -44,7 +55,9 @@ def generateTaskID ():
 class BaseTask  (object):
   id = None
   #running = False
-  priority = 1
+  priority = PRIORITY_NORMAL
+  cpu_time = 0.0 # Seconds spent executing this task's slices
+  slices = 0     # Number of slices it has run
 
   @classmethod
   def new (cls, *args, **kw):
@@ -128,13 +141,254 @@ class Task (BaseTask):
     return "<" + self.__class__.__name__ + "/tid" + str(self.name) + ">"
 
 
+class Return (StopIteration):
+  """
+  Raise this to return a value from a generator called by a Coroutine
+  """
+  def __init__ (self, value = None):
+    StopIteration.__init__(self, value)
+    self.value = value
+
+
+class Coroutine (BaseTask):
+  """
+  A Task made from a generator, which can call other generators
+
+  Besides the usual things a Task yields (BlockingOperations and sleep
+  times), the generator can yield another generator.  That runs it (and
+  anything it yields in turn) until it finishes, and the yield evaluates
+  to what it returned with Return.  Exceptions propagate back up to the
+  caller.  For example:
+
+    def read_line (sock):
+      data = b''
+      while not data.endswith(b'\\n'):
+        d = yield Recv(sock)
+        if not d: raise EOFError()
+        data += d
+      raise Return(data)
+
+    def greeter (sock):
+      name = yield read_line(sock)
+      yield Send(sock, b'Hello ' + name)
+
+    Coroutine.new(greeter(sock))
+  """
+  def __init__ (self, gen, name = None):
+    BaseTask.__init__(self, gen)
+    self.name = name or getattr(gen, '__name__', str(self.id))
+
+  def run (self, gen):
+    stack = [] # Callers of gen
+    value = None
+    exc = None
+    while True:
+      try:
+        if exc is not None:
+          e,exc = exc,None
+          r = gen.throw(*e)
+        else:
+          r = gen.send(value)
+      except StopIteration as e:
+        if not stack: return
+        value = getattr(e, 'value', None)
+        gen = stack.pop()
+        continue
+      except:
+        if not stack: raise
+        exc = sys.exc_info()
+        gen = stack.pop()
+        continue
+      if isinstance(r, types.GeneratorType):
+        stack.append(gen)
+        gen = r
+        value = None
+        continue
+      value = yield r
+
+  def __str__ (self):
+    return "<" + self.__class__.__name__ + "/" + str(self.name) + ">"
+
+
+class TimerQueue (object):
+  """
+  The timers for a Scheduler
+
+  Pending calls are kept in a heap ordered by when they're due, so adding
+  one is O(log n).  Cancelling just marks the entry (the heap gets cleaned
+  up when it's mostly cancelled entries).  The scheduler calls run() as
+  it cycles.  When it's idle, it sleeps until the end of the RESOLUTION
+  second tick the next call is due in, so everything due in the same
+  tick is run together after a single wakeup (never early, and at most
+  a tick late).
+
+  Calls are made from the scheduler's thread, but add() and cancel() can
+  be used from any thread.
+  """
+  RESOLUTION = 0.01
+
+  def __init__ (self, scheduler):
+    self._scheduler = scheduler
+    self._heap = [] # [when, seq, callback, args, kw]
+    self._seq = 0
+    self._cancelled = 0
+    self._lock = threading.Lock()
+
+  def __len__ (self):
+    return len(self._heap) - self._cancelled
+
+  def add (self, when, callback, args = (), kw = {}):
+    """
+    Calls callback(*args, **kw) at time when (as from time.time())
+
+    Returns an entry which can be passed to cancel().
+    """
+    with self._lock:
+      self._seq += 1
+      entry = [when, self._seq, callback, args, kw]
+      heapq.heappush(self._heap, entry)
+      first = self._heap[0] is entry
+    if first:
+      # Make sure the scheduler doesn't sleep past it
+      self._scheduler._event.set()
+    return entry
+
+  def cancel (self, entry):
+    """
+    Cancels an entry returned by add() (if it hasn't been called yet)
+    """
+    with self._lock:
+      if entry[2] is None: return
+      entry[2] = entry[3] = entry[4] = None
+      if entry[1] is None: return # Already taken off the heap by run()
+      self._cancelled += 1
+      heap = self._heap
+      if self._cancelled > 64 and self._cancelled > len(heap) // 2:
+        heap[:] = [e for e in heap if e[2] is not None]
+        heapq.heapify(heap)
+        self._cancelled = 0
+
+  def next_time (self):
+    """
+    Returns when to wake up for the next call (or None if there are none)
+
+    This is the end of the tick it's due in.
+    """
+    heap = self._heap
+    with self._lock:
+      while heap and heap[0][2] is None:
+        heapq.heappop(heap)
+        self._cancelled -= 1
+      if not heap: return None
+      return math.ceil(heap[0][0] / self.RESOLUTION) * self.RESOLUTION
+
+  def run (self, now = None):
+    """
+    Makes the calls which are due
+
+    Returns the number of calls made.
+    """
+    heap = self._heap
+    if not heap: return 0
+    if now is None: now = time.time()
+    if heap[0][0] > now: return 0
+    due = []
+    with self._lock:
+      while heap and heap[0][0] <= now:
+        entry = heapq.heappop(heap)
+        if entry[2] is None:
+          self._cancelled -= 1
+        else:
+          entry[1] = None
+          due.append(entry)
+    for entry in due:
+      callback,args,kw = entry[2:]
+      if callback is None: continue # Cancelled by an earlier call
+      entry[2] = entry[3] = entry[4] = None
+      try:
+        callback(*args, **kw)
+      except:
+        import logging
+        logging.getLogger("recoco").exception("Exception in timer %s",
+                                              callback)
+    return len(due)
+
+
+class ReadyQueue (object):
+  """
+  The ready Tasks of a Scheduler
+
+  There's a FIFO for each level of priority (priorities at or above
+  PRIORITY_HIGH, at or above PRIORITY_NORMAL, and everything else), and
+  popleft() takes from the highest level that has something in it.  So
+  that a busy level can't starve the ones below it forever, each waiting
+  level counts how many times it's been passed over, and gets the next
+  turn once that reaches AGE_LIMIT.  Everything is O(1).
+
+  It has the bits of the deque interface that the Scheduler used to use.
+  As with the deque it replaces, append() is safe from other threads.
+  """
+  AGE_LIMIT = 8
+
+  def __init__ (self):
+    self._levels = (deque(), deque(), deque())
+    self._skipped = [0, 0, 0]
+
+  @staticmethod
+  def level (priority):
+    if priority >= PRIORITY_HIGH: return 0
+    if priority >= PRIORITY_NORMAL: return 1
+    return 2
+
+  def __len__ (self):
+    l = self._levels
+    return len(l[0]) + len(l[1]) + len(l[2])
+
+  def __nonzero__ (self):
+    # No builtins here; the scheduler thread may check us during shutdown
+    l = self._levels
+    return not (not l[0] and not l[1] and not l[2])
+
+  def __contains__ (self, task):
+    # Check every level in case the priority changed since it was added
+    return any(task in q for q in self._levels)
+
+  def append (self, task):
+    self._levels[self.level(task.priority)].append(task)
+
+  def appendleft (self, task):
+    self._levels[self.level(task.priority)].appendleft(task)
+
+  def popleft (self):
+    levels = self._levels
+    skipped = self._skipped
+    if levels[0]:
+      level = 0
+    elif levels[1]:
+      level = 1
+    elif levels[2]:
+      skipped[2] = 0
+      return levels[2].popleft()
+    else:
+      raise IndexError("pop from an empty ReadyQueue")
+    for lower in range(level + 1, 3):
+      if not levels[lower]: continue
+      skipped[lower] += 1
+      if skipped[lower] >= self.AGE_LIMIT:
+        level = lower
+        break
+    skipped[level] = 0
+    return levels[level].popleft()
+
+
 class Scheduler (object):
   """ Scheduler for Tasks """
   def __init__ (self, isDefaultScheduler = None, startInThread = True,
                 daemon = False, useEpoll=False):
-    self._ready = deque()
+    self._ready = ReadyQueue()
     self._hasQuit = False
-    self._selectHub = SelectHub(self, useEpoll=useEpoll)
+    self.timers = TimerQueue(self)
+    self._selectHub = self._new_select_hub(useEpoll)
     self._thread = None
     self._event = threading.Event()
 
@@ -154,6 +408,9 @@ class Scheduler (object):
     self._hasQuit = True
     super(Scheduler, self).__del__()
 
+  def _new_select_hub (self, useEpoll):
+    return SelectHub(self, useEpoll=useEpoll)
+
   def callLater (self, func, *args, **kw):
     """
     Calls func with the given arguments at some later point, within this
@@ -164,7 +421,7 @@ class Scheduler (object):
     with self._lock:
       if self._callLaterTask is None:
         self._callLaterTask = CallLaterTask()
-        self._callLaterTask.start()
+        self._callLaterTask.start(scheduler = self)
 
     self._callLaterTask.callLater(func, *args, **kw)
 
@@ -172,6 +429,17 @@ class Scheduler (object):
     self._thread = Thread(target = self.run)
     self._thread.daemon = daemon
     self._thread.start()
+    if daemon:
+      # A daemon thread keeps running while the interpreter tears down
+      # modules under it, so stop it before that starts.
+      atexit.register(self._quitAtExit)
+
+  def _quitAtExit (self):
+    self.quit()
+    self._event.set()
+    if self._thread is not threading.current_thread():
+      self._thread.join(1)
+    self._selectHub._thread.join(1)
 
   def synchronized (self):
     return Synchronizer(self)
@@ -201,7 +469,7 @@ class Scheduler (object):
       return True
 
     st = ScheduleTask(self, task)
-    st.start(fast=True)
+    st.start(scheduler = self, fast = True)
 
   def fast_schedule (self, task, first = False):
     """
@@ -240,8 +508,13 @@ class Scheduler (object):
   def run (self):
     try:
       while self._hasQuit == False:
-        if len(self._ready) == 0:
-          self._event.wait(CYCLE_MAXIMUM) # Wait for a while
+        if not self._ready:
+          timeout = CYCLE_MAXIMUM
+          when = self.timers.next_time()
+          if when is not None:
+            timeout = min(timeout, when - time.time())
+          if timeout > 0:
+            self._event.wait(timeout) # Wait for a while
           self._event.clear()
           if self._hasQuit: break
         r = self.cycle()
@@ -252,23 +525,13 @@ class Scheduler (object):
       self._allDone = True
 
   def cycle (self):
-    #if len(self._ready) == 0: return False
-
-    # Patented hilarious priority system
-    #TODO: Replace it with something better
-    t = None
-    try:
-      while True:
-        t = self._ready.popleft()
-        if t.priority >= 1: break
-        if len(self._ready) == 0: break
-        if t.priority >= random.random(): break
-        self._ready.append(t)
-    except IndexError:
-      return False
+    if self.timers._heap: self.timers.run()
 
-    #print(len(self._ready), "tasks")
+    # Only we take things off it, so it can't become empty after this
+    if not self._ready: return False
+    t = self._ready.popleft()
 
+    start = time.time()
     try:
       rv = t.execute()
     except StopIteration:
@@ -280,6 +543,9 @@ class Scheduler (object):
       except:
         pass
       return True
+    finally:
+      t.cpu_time += time.time() - start
+      t.slices += 1
 
     if isinstance(rv, BlockingOperation):
       try:
@@ -298,12 +564,19 @@ class Scheduler (object):
         #print "sleep 0"
         self._ready.append(t)
       else:
-        self._selectHub.registerTimer(t, rv)
+        self.timers.add(time.time() + rv, self._wake, (t,))
     elif rv == None:
       raise RuntimeError("Must yield a value!")
 
     return True
 
+  def _wake (self, task):
+    """
+    Wakes a task which was sleeping
+    """
+    task.rv = ([],[],[]) # As if from a Select() which timed out
+    self.fast_schedule(task)
+
 
 #TODO: Read() and Write() BlockingOperations that use nonblocking sockets with
 #      SelectHub and do post-processing of the return value.
@@ -328,7 +601,8 @@ class BlockingOperation (object):
 class CallBlocking (BlockingOperation):
   """
   Syscall that calls an actual blocking operation (like a real .recv()).
-  In order to keep from blocking, it calls it on another thread.
+  In order to keep from blocking, it calls it on another thread (from
+  pox.lib.threadpool.default_pool()).
   The return value is (ret_val, exc_info), one of which is always None.
   """
   @classmethod
@@ -336,7 +610,6 @@ class CallBlocking (BlockingOperation):
     return _cls(_func, *_args, **_kw)
 
   def __init__ (self, func, args=(), kw={}):
-    self.t = None
     self.scheduler = None
     self.task = None
 
@@ -357,12 +630,8 @@ class CallBlocking (BlockingOperation):
     self.task = task
     self.scheduler = scheduler
 
-    #NOTE: It might be nice to use a pool here
-    self.t = threading.Thread(target=self._proc)
-    #pool.add(self._proc)
-
-    self.t.daemon = True
-    self.t.start()
+    from pox.lib.threadpool import default_pool
+    default_pool().submit(self._proc)
 
 
 class Exit (BlockingOperation):
@@ -394,7 +663,7 @@ class Sleep (BlockingOperation):
       # Just reschedule
       scheduler.fast_schedule(task)
       return
-    scheduler._selectHub.registerTimer(task, self._t, True) # A bit ugly
+    scheduler.timers.add(self._t, scheduler._wake, (task,))
 
 
 class Select (BlockingOperation):
@@ -455,21 +724,18 @@ class Send (BlockingOperation):
 
   def _sendReturnFunc (self, task):
     # Select() will have placed file descriptors in rv
-    sock = task.rv[1]
-    if len(task.rv[2]) != 0:
+    if len(task.rv[2]) != 0 or len(task.rv[1]) == 0:
       # Socket error
       task.rv = None
       return self._sent
+    sock = task.rv[1][0]
     task.rv = None
     try:
-      if len(self._data) > 1024:
-        data = self._data[:1024]
-        self._data = self._data[1024:]
-      l = sock.send(data, flags = socket.MSG_DONTWAIT)
+      l = sock.send(self._data[:1024], socket.MSG_DONTWAIT)
       self._sent += l
-      if l == len(data) and len(self._data) == 0:
+      self._data = self._data[l:]
+      if len(self._data) == 0:
         return self._sent
-      self._data = data[l:] + self._data
     except:
       pass
 
@@ -653,6 +919,7 @@ class ScheduleTask (BaseTask):
     BaseTask.__init__(self)
     self._scheduler = scheduler
     self._task = task
+    self.priority = task.priority
 
   def run (self):
     #TODO: Refactor the following, since it is copy/pasted from schedule().
@@ -669,6 +936,9 @@ class ScheduleTask (BaseTask):
 
 
 class SyncTask (BaseTask):
+  # These are mostly web and messenger requests; don't hold up I/O for them
+  priority = PRIORITY_LOW
+
   def __init__ (self, *args, **kw):
     BaseTask.__init__(self)
     self.inlock = threading.Lock()
@@ -703,7 +973,7 @@ class Synchronizer (object):
       self.syncer.outlock.release()
 
 
-class Timer (Task):
+class Timer (object):
   """
   A simple timer.
 
@@ -715,13 +985,15 @@ class Timer (Task):
   scheduler      The recoco scheduler to use (None means default scheduler)
   started        If False, requires you to call .start() to begin timer
   selfStoppable  If True, the callback can return False to cancel the timer
+
+  Timers live in their scheduler's TimerQueue (they used to be Tasks of
+  their own).  If the callback raises an exception, the timer stops.
   """
   def __init__ (self, timeToWake, callback, absoluteTime = False,
                 recurring = False, args = (), kw = {}, scheduler = None,
                 started = True, selfStoppable = True):
     if absoluteTime and recurring:
       raise RuntimeError("Can't have a recurring timer for an absolute time!")
-    Task.__init__(self)
     self._self_stoppable = selfStoppable
     self._next = timeToWake
     self._interval = timeToWake if recurring else 0
@@ -735,20 +1007,30 @@ class Timer (Task):
     self._args = args
     self._kw = kw
 
+    self._timers = None
+    self._entry = None
+
     if started: self.start(scheduler)
 
+  def start (self, scheduler = None):
+    if scheduler is None: scheduler = defaultScheduler
+    self._timers = scheduler.timers
+    self._entry = self._timers.add(self._next, self._fire)
+
   def cancel (self):
     self._cancelled = True
-
-  def run (self):
-    while not self._cancelled:
-      yield Sleep(timeToWake=self._next, absoluteTime=True)
-      if self._cancelled: break
-      self._next = time.time() + self._interval
-      rv = self._callback(*self._args,**self._kw)
-      if self._self_stoppable and (rv is False): break
-      if not self._recurring: break
-    yield False # Quit
+    if self._entry is not None:
+      self._timers.cancel(self._entry)
+      self._entry = None
+
+  def _fire (self):
+    self._entry = None
+    if self._cancelled: return
+    self._next = time.time() + self._interval
+    rv = self._callback(*self._args,**self._kw)
+    if self._self_stoppable and (rv is False): return
+    if not self._recurring or self._cancelled: return
+    self._entry = self._timers.add(self._next, self._fire)
 
 
 class CallLaterTask (BaseTask):
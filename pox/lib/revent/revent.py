@@ -155,6 +155,8 @@ class Event (object):
   def _invoke (self, handler, *args, **kw):
     return handler(self, *args, **kw)
 
+_default_invoke = Event.__dict__['_invoke']
+
 def handleEventException (source, event, args, kw, exc_info):
   """
   Called when an exception is raised by an event handler when the event
@@ -218,6 +220,8 @@ class EventMixin (object):
       setattr(self, "_eventMixin_events", True)
     if not hasattr(self, "_eventMixin_handlers"):
       setattr(self, "_eventMixin_handlers", {})
+    if not hasattr(self, "_eventMixin_plans"):
+      setattr(self, "_eventMixin_plans", {}) # eventType -> dispatch plan
 
   def raiseEventNoErrors (self, event, *args, **kw):
     """
@@ -242,63 +246,100 @@ class EventMixin (object):
     but only if there are actually listeners.
     Returns the event object, unless it was never created (because there
     were no listeners) in which case returns None.
+
+    The handlers for each event type are looked up through a cached
+    dispatch plan (see _eventMixin_plan()), so there's very little to do
+    when nobody is listening.
     """
-    self._eventMixin_init()
+    try:
+      plan = self._eventMixin_plans.get(event)
+    except AttributeError:
+      self._eventMixin_init()
+      plan = None
+
+    if plan is None:
+      if isinstance(event, Event):
+        eventType = event.__class__
+        plan = self._eventMixin_plans.get(eventType)
+        if plan is None: plan = self._eventMixin_plan(eventType)
+        if not plan[1] and (self._eventMixin_events is not True
+                            and eventType not in self._eventMixin_events):
+          raise RuntimeError("Event %s not defined on object of type %s"
+                             % (eventType, type(self)))
+        if event.source is None: event.source = self
+        return self._eventMixin_dispatch(plan, event, args, kw)
+      plan = self._eventMixin_plan(event)
+
+    if not plan[1]:
+      # Early-out: nobody's listening, so don't even make the event
+      return None
+    event = event(*args, **kw)
+    if event.source is None:
+      event.source = self
+    return self._eventMixin_dispatch(plan, event, (), {})
+
+  def _eventMixin_plan (self, eventType):
+    """
+    Builds and caches the dispatch plan for eventType
 
-    classCall = False
-    if isinstance(event, Event):
-      eventType = event.__class__
-      classCall = True
-      if event.source is None: event.source = self
-    elif issubclass(event, Event):
-      # Check for early-out
-      if event not in self._eventMixin_handlers:
-        return None
-      if len(self._eventMixin_handlers[event]) == 0:
-        return None
-
-      classCall = True
-      eventType = event
-      event = eventType(*args, **kw)
-      args = ()
-      kw = {}
-      if event.source is None:
-        event.source = self
-    #print("raise",event,eventType)
-    if (self._eventMixin_events is not True
-        and eventType not in self._eventMixin_events):
-      raise RuntimeError("Event %s not defined on object of type %s"
-                         % (eventType, type(self)))
-
-    # Create a copy so that it can be modified freely during event
-    # processing.  It might make sense to change this.
-    handlers = self._eventMixin_handlers.get(eventType, [])
-    for (priority, handler, once, eid) in handlers:
-      if classCall:
-        rv = event._invoke(handler, *args, **kw)
-      else:
-        rv = handler(event, *args, **kw)
-      if once: self.removeListener(eid)
-      if rv is None: continue
-      if rv is False:
-        self.removeListener(eid)
-      if rv is True:
-        if classCall: event.halt = True
-        break
-      if type(rv) == tuple:
-        if len(rv) >= 2 and rv[1] == True:
-          self.removeListener(eid)
-        if len(rv) >= 1 and rv[0]:
-          if classCall: event.halt = True
-          break
-        if len(rv) == 0:
-          if classCall: event.halt = True
-          break
-      #if classCall and hasattr(event, "halt") and event.halt:
-      if classCall and event.halt:
-        break
+    A plan is (direct, handlers), where handlers is a snapshot of the
+    handler entries (so they can be added and removed while an event is
+    being handled) and direct says that the event type doesn't override
+    _invoke(), so handlers can just be called.  Adding or removing
+    listeners throws the cached plans away.
+    """
+    if not issubclass(eventType, Event):
+      raise TypeError("%s is not an Event" % (eventType,))
+    handlers = tuple(self._eventMixin_handlers.get(eventType, ()))
+    direct = getattr(eventType._invoke, 'im_func', None) is _default_invoke
+    plan = (direct, handlers)
+    self._eventMixin_plans[eventType] = plan
+    return plan
+
+  def _eventMixin_dispatch (self, plan, event, args, kw):
+    """
+    Calls the handlers in a plan
+    """
+    direct,handlers = plan
+    if direct and not args and not kw:
+      for entry in handlers:
+        rv = entry[1](event)
+        # Most handlers return None and aren't "once"
+        if rv is None and not entry[2]: continue
+        if self._eventMixin_result(entry, rv, event): break
+    else:
+      invoke = event._invoke
+      for entry in handlers:
+        rv = invoke(entry[1], *args, **kw)
+        if rv is None and not entry[2]: continue
+        if self._eventMixin_result(entry, rv, event): break
     return event
 
+  def _eventMixin_result (self, entry, rv, event):
+    """
+    Deals with a handler's return value
+
+    Returns True if no more handlers should be called.
+    """
+    priority,handler,once,eid = entry
+    if once: self.removeListener(eid)
+    if rv is None: return False
+    if rv is False:
+      self.removeListener(eid)
+    if rv is True:
+      event.halt = True
+      return True
+    if type(rv) == tuple:
+      if len(rv) >= 2 and rv[1] == True:
+        self.removeListener(eid)
+      if len(rv) >= 1 and rv[0]:
+        event.halt = True
+        return True
+      if len(rv) == 0:
+        event.halt = True
+        return True
+    return event.halt
+
   def removeListeners (self, listeners):
     altered = False
     for l in listeners:
@@ -342,11 +383,11 @@ class EventMixin (object):
                                               if x[3] != handler]
           altered = altered or l != len(self._eventMixin_handlers[event])
       else:
-        l = len(handlers)
         handlers = self._eventMixin_handlers[eventType]
+        l = len(handlers)
         self._eventMixin_handlers[eventType] = [x for x in handlers
                                                 if x[3] != handler]
-        altered = altered or l != len(self._eventMixin_handlers[event])
+        altered = altered or l != len(self._eventMixin_handlers[eventType])
     else:
       if eventType == None:
         for event in self._eventMixin_handlers:
@@ -362,6 +403,8 @@ class EventMixin (object):
                                                 if x[1] != handler]
         altered = altered or l != len(self._eventMixin_handlers[eventType])
 
+    if altered:
+      self._eventMixin_plans.clear()
     return altered
 
   def addListenerByName (self, *args, **kw):
@@ -435,6 +478,7 @@ class EventMixin (object):
     if priority is not None:
       # If priority is specified, sort the event handlers
       handlers.sort(reverse = True, key = operator.itemgetter(0))
+    self._eventMixin_plans.pop(eventType, None)
 
     return (eventType,eid)
 
@@ -465,6 +509,7 @@ class EventMixin (object):
     Remove all handlers from this object
     """
     self._eventMixin_handlers = {}
+    self._eventMixin_plans = {}
 
 
 def autoBindEvents (sink, source, prefix='', weak=False, priority=None):
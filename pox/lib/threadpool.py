@@ -13,19 +13,198 @@
 # limitations under the License.
 
 """
-Totally untested thread pool class.
-Tries to not get more than "maximum" (but this is not a hard limit).
-Kills off up to around half of its workers when more than half are idle.
+A thread pool for getting work off of the recoco thread
+
+Something CPU-heavy (crunching stats, computing paths, encoding big JSON
+replies) holds up everything else while it runs in a Task.  Instead, a
+Task can hand it to a ThreadPool and wait for it:
+
+  pool = ThreadPool(max_workers = 4)
+  ...
+  class Cruncher (Task):
+    def run (self):
+      ...
+      f = yield pool.submit(crunch, table)
+      result = f.result() # Returns the result or raises its exception
+
+submit() returns a Future, which is much like a concurrent.futures one.
+Yielding it wakes the Task up (on the scheduler thread, with the Future)
+once it's done, and add_done_callback() callbacks are called on the
+scheduler thread too.  Don't call result() from a Task before the Future
+is done, though; it'd block the whole scheduler.
+
+Work waits in a queue of at most max_queue items (submit() raises PoolFull
+if it's full).  Workers are started as needed up to max_workers.  Every
+idle_time seconds (checked when work is submitted), workers which have
+been idle all that time are stopped, down to min_workers.  stats() has
+counts and timings.
+
+Remember that Python threads share the GIL, so this keeps the scheduler
+responsive rather than making pure-Python work any faster.
 """
 
 from __future__ import print_function
 from __future__ import with_statement
-from threading import Thread, RLock
-from Queue import Queue
+import sys
+import time
+import threading
+from threading import Thread, Lock
+from Queue import Queue, Full
+
+from pox.lib.recoco.recoco import BlockingOperation
+import pox.lib.recoco.recoco as recoco
 
 
 CYCLE_TIME = 3
 
+PENDING = 'pending'
+RUNNING = 'running'
+FINISHED = 'finished'
+CANCELLED = 'cancelled'
+
+
+class PoolFull (RuntimeError):
+  """
+  Raised by submit() when a ThreadPool's queue is full
+  """
+  pass
+
+
+class CancelledError (RuntimeError):
+  pass
+
+
+class TimeoutError (RuntimeError):
+  pass
+
+
+class Future (BlockingOperation):
+  """
+  The pending result of some work given to a ThreadPool
+
+  A Task can yield one to wait for it to be done; the yield gives back the
+  Future.
+  """
+  def __init__ (self, pool, func, args, kw):
+    self._pool = pool
+    self._func = func
+    self._args = args
+    self._kw = kw
+    self._state = PENDING
+    self._result = None
+    self._exc_info = None
+    self._callbacks = []
+    self._waiters = [] # (task, scheduler)
+    self._lock = Lock()
+    self._done = threading.Event()
+    self.submitted = time.time()
+
+  def __repr__ (self):
+    return "<%s %s %s>" % (type(self).__name__, self._state,
+                           getattr(self._func, '__name__', self._func))
+
+  def cancel (self):
+    """
+    Cancels the work if it hasn't started yet
+
+    Returns True if it's cancelled.
+    """
+    with self._lock:
+      if self._state == RUNNING or self._state == FINISHED: return False
+      if self._state == CANCELLED: return True
+      self._state = CANCELLED
+    self._pool._count('cancelled')
+    self._finish()
+    return True
+
+  def cancelled (self):
+    return self._state == CANCELLED
+
+  def running (self):
+    return self._state == RUNNING
+
+  def done (self):
+    return self._state == CANCELLED or self._state == FINISHED
+
+  def result (self, timeout = None):
+    """
+    Returns the result, raising the work's exception if it had one
+
+    This waits for it to be done.  Don't do that on the scheduler thread.
+    """
+    self._wait(timeout)
+    if self._exc_info is not None:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+  def exception (self, timeout = None):
+    """
+    Returns the exception the work raised (or None)
+    """
+    self._wait(timeout)
+    if self._exc_info is None: return None
+    return self._exc_info[1]
+
+  def _wait (self, timeout):
+    if not self._done.wait(timeout):
+      raise TimeoutError()
+    if self._state == CANCELLED:
+      raise CancelledError()
+
+  def add_done_callback (self, callback):
+    """
+    Calls callback(future) on the scheduler thread when it's done
+
+    If it's already done, it's called right away.
+    """
+    with self._lock:
+      if not self.done():
+        self._callbacks.append(callback)
+        return
+    callback(self)
+
+  def execute (self, task, scheduler):
+    with self._lock:
+      if not self.done():
+        self._waiters.append((task, scheduler))
+        return
+    task.rv = self
+    scheduler.fast_schedule(task)
+
+  def _run (self):
+    with self._lock:
+      if self._state != PENDING: return False # Cancelled
+      self._state = RUNNING
+    start = time.time()
+    try:
+      self._result = self._func(*self._args, **self._kw)
+    except:
+      self._exc_info = sys.exc_info()
+    self._func = self._args = self._kw = None
+    self._pool._finished(start - self.submitted, time.time() - start,
+                         self._exc_info is None)
+    with self._lock:
+      self._state = FINISHED
+    self._finish()
+    return True
+
+  def _finish (self):
+    self._done.set()
+    with self._lock:
+      waiters,self._waiters = self._waiters,[]
+      callbacks,self._callbacks = self._callbacks,[]
+    for task,scheduler in waiters:
+      # Only we can wake the task up, so this is safe from here
+      task.rv = self
+      scheduler.fast_schedule(task)
+    if callbacks:
+      scheduler = self._pool.scheduler or recoco.defaultScheduler
+      for callback in callbacks:
+        if scheduler is None:
+          callback(self)
+        else:
+          scheduler.callLater(callback, self)
+
 
 class WorkerThread (Thread):
   def __init__ (self, pool):
@@ -35,73 +214,173 @@ class WorkerThread (Thread):
     self.start()
 
   def run (self):
-    with self._pool._lock:
-      self._pool._total += 1
-
-    while self._pool.running:
-      with self._pool._lock:
-        self._pool._available += 1
-      try:
-        func, args, kw = self._pool._tasks.get(True, CYCLE_TIME)
-        if func is None: return
-      except:
-        continue
-      finally:
-        with self._pool._lock:
-          self._pool._available -= 1
-          assert self._pool._available >= 0
+    pool = self._pool
+    while True:
+      # (A timed get() would poll in Python 2, adding lots of latency)
+      future = pool._tasks.get()
+      if future is None:
+        with pool._lock:
+          pool._total -= 1
+          pool._idle -= 1
+        pool._tasks.task_done()
+        return
 
+      with pool._lock:
+        pool._idle -= 1
+        if pool._idle < pool._low_idle: pool._low_idle = pool._idle
       try:
-        func(*args, **kw)
+        ran = future._run() # This counts us as idle again if it runs it
       except Exception as e:
         print("Worker thread exception", e)
-      self._pool._tasks.task_done()
-
-    with self._pool._lock:
-      self._pool._total -= 1
-      assert self._pool._total >= 0
+        ran = False
+      if not ran:
+        with pool._lock:
+          pool._idle += 1
+      pool._tasks.task_done()
 
 
 class ThreadPool (object):
-  #NOTE: Assumes only one thread manipulates the pool
-  #      (Add some locks to fix)
-  def __init__ (self, initial = 0, maximum = None):
-    self._available = 0
-    self._total = 0
-    self._tasks = Queue()
-    self.maximum = maximum
-    self._lock = RLock()
-    for i in xrange(initial):
-      self._new_worker
+  """
+  Runs work on a set of worker threads (see the module docstring)
+
+  max_workers can be None for no limit.  max_queue is the most work that
+  can wait for a worker (0 for no limit).  If scheduler isn't given, done
+  callbacks are called on the default scheduler.
+  """
+  def __init__ (self, max_workers = 4, min_workers = 0, max_queue = 1000,
+                idle_time = CYCLE_TIME, scheduler = None):
+    self.max_workers = max_workers
+    self.min_workers = min_workers
+    self.max_queue = max_queue
+    self.idle_time = idle_time
+    self.scheduler = scheduler
+    self.running = True
+    self._tasks = Queue(max_queue)
+    self._lock = Lock()
+    self._total = 0 # Worker threads
+    self._idle = 0  # ...which are waiting for work
+    self._low_idle = 0 # Fewest idle since _trim_time
+    self._trim_time = time.time()
+
+    self._counts = dict(submitted=0, completed=0, failed=0, rejected=0,
+                        cancelled=0)
+    self._wait_time = 0.0
+    self._max_wait = 0.0
+    self._run_time = 0.0
+
+    for i in xrange(min_workers):
+      self._new_worker()
 
   def _new_worker (self):
     with self._lock:
-      if self.maximum is not None:
-        if self._total >= self.maximum:
-          # Too many!
-          return False
+      if self.max_workers is not None and self._total >= self.max_workers:
+        return False
+      self._total += 1
+      self._idle += 1
     WorkerThread(self)
     return True
 
-  def add (_self, _func, *_args, **_kwargs):
-    self.add_task(_func, args=_args, kwargs=_kwargs)
+  def _count (self, what):
+    with self._lock:
+      self._counts[what] += 1
 
-  def add_task (self, func, args=(), kwargs={}):
-    while True:
-      self._lock.acquire()
-      if self._available == 0:
-         self._lock.release()
-         self._new_worker()
-      else:
-        break
+  def _finished (self, wait, run, ok):
+    with self._lock:
+      # The worker is done with it, so it's available again (counting it
+      # before the Future is done keeps us from starting extra workers)
+      self._idle += 1
+      self._counts['completed' if ok else 'failed'] += 1
+      self._wait_time += wait
+      self._run_time += run
+      if wait > self._max_wait: self._max_wait = wait
 
-    self._tasks.put((func, args, kwargs))
+  def submit (self, func, *args, **kw):
+    """
+    Arranges for func(*args, **kw) to be called on a worker
 
-    if self.available > self._total / 2 and self.total > 8:
-      for i in xrange(self._total / 2 - 1):
-        self._tasks.put((None,None,None))
+    Returns a Future.  Raises PoolFull if the queue is full.
+    """
+    if not self.running:
+      raise RuntimeError("ThreadPool has been shut down")
+    future = Future(self, func, args, kw)
+    try:
+      self._tasks.put_nowait(future)
+    except Full:
+      self._count('rejected')
+      raise PoolFull("ThreadPool queue is full")
+    self._count('submitted')
+    if self._idle < self._tasks.qsize():
+      self._new_worker()
+    elif future.submitted - self._trim_time > self.idle_time:
+      self._trim()
+    return future
 
-    self._lock.release()
+  def _trim (self):
+    """
+    Stops workers which have been idle since the last time we looked
+    """
+    with self._lock:
+      excess = min(self._low_idle, self._total - self.min_workers)
+      self._low_idle = self._idle
+      self._trim_time = time.time()
+    for i in xrange(excess):
+      try:
+        self._tasks.put_nowait(None)
+      except Full:
+        break
+
+  def add (_self, _func, *_args, **_kwargs):
+    return _self.submit(_func, *_args, **_kwargs)
+
+  def add_task (self, func, args=(), kwargs={}):
+    return self.submit(func, *args, **kwargs)
 
   def join (self):
+    """
+    Waits until all the work that's been submitted is done
+    """
     self._tasks.join()
+
+  def shutdown (self, wait = True):
+    """
+    Stops the workers once they've done the work that's already queued
+    """
+    self.running = False
+    with self._lock:
+      count = self._total
+    for i in xrange(count):
+      self._tasks.put(None)
+    if wait:
+      self.join()
+
+  def stats (self):
+    """
+    Returns a dict of counts and timings
+
+    wait_time and run_time are totals (in seconds) of the time work spent
+    queued and running.
+    """
+    with self._lock:
+      s = dict(self._counts)
+      s.update(workers = self._total, idle = self._idle,
+               queued = self._tasks.qsize(),
+               wait_time = self._wait_time, max_wait = self._max_wait,
+               run_time = self._run_time)
+    return s
+
+
+_default_pool = None
+_default_pool_lock = Lock()
+
+def default_pool ():
+  """
+  Returns a shared ThreadPool which starts workers as needed
+
+  It's used for CallBlocking (and so BlockingTask), which may block for a
+  long time, so it has no limit on workers; idle ones still get reused.
+  """
+  global _default_pool
+  with _default_pool_lock:
+    if _default_pool is None:
+      _default_pool = ThreadPool(max_workers = None, max_queue = 0)
+    return _default_pool
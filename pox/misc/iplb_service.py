@@ -0,0 +1,159 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Remote control of iplb load balancers
+
+Lets you drain and undrain servers and look at their status over the
+messenger and/or the web server (whichever are running).
+
+On messenger, join the "iplb" channel and send, e.g.:
+  {"CHANNEL":"iplb", "cmd":"drain", "server":"10.0.0.1"}
+  {"CHANNEL":"iplb", "cmd":"list_servers"}
+Members of the channel are also sent a "drained" message when a draining
+server has no flows left.
+
+On the web server, POST JSON-RPC requests for the methods drain, undrain
+and list_servers to /iplb/.
+
+All commands take an optional dpid, which is required if there's more than
+one load balancer running.  If there's more than one on a switch (e.g.,
+with lbcode_multi), give the balancer's name instead.
+"""
+
+from pox.core import core
+from pox.lib.util import strToDPID, dpid_to_str
+from pox.lib.lb import ServerDrained
+from pox.messenger import ChannelBot
+from pox.web.jsonrpc import JSONRPCHandler, make_error
+
+log = core.getLogger()
+
+
+def _is_balancer_name (name):
+  return name == "iplb" or name.startswith("iplb_")
+
+def _balancers ():
+  return [c for n,c in core.components.items() if _is_balancer_name(n)]
+
+def find_balancer (dpid = None, name = None):
+  """
+  Finds a load balancer by its name on core or the DPID of its switch
+
+  If neither is given and there's only one balancer, returns that one.
+  Raises RuntimeError if there's no such balancer.
+  """
+  if name is not None:
+    if _is_balancer_name(name) and name in core.components:
+      return core.components[name]
+    raise RuntimeError("No load balancer named " + name)
+  lbs = _balancers()
+  if dpid is None:
+    if len(lbs) == 1: return lbs[0]
+    if not lbs: raise RuntimeError("No load balancers")
+    raise RuntimeError("More than one load balancer; specify a dpid")
+  if not isinstance(dpid, (int, long)): dpid = strToDPID(dpid)
+  lbs = [lb for lb in lbs if lb.con is not None and lb.con.dpid == dpid]
+  if len(lbs) == 1: return lbs[0]
+  if lbs: raise RuntimeError("More than one load balancer; specify a name")
+  raise RuntimeError("No load balancer on " + dpid_to_str(dpid))
+
+def _drain (server, dpid = None, name = None):
+  find_balancer(dpid, name).drain_server(server)
+  return True
+
+def _undrain (server, dpid = None, name = None):
+  find_balancer(dpid, name).undrain_server(server)
+  return True
+
+def _list_servers (dpid = None, name = None):
+  r = find_balancer(dpid, name).server_status()
+  for d in r:
+    d['server'] = str(d['server'])
+  return r
+
+
+class IPLBBot (ChannelBot):
+  """
+  Messenger bot for the "iplb" channel
+  """
+  def _init (self, extra):
+    self._watched = set()
+    for lb in _balancers():
+      self._watch(lb)
+    core.addListenerByName("ComponentRegistered", self._handle_core_reg)
+
+  def _handle_core_reg (self, event):
+    if _is_balancer_name(event.name):
+      self._watch(event.component)
+
+  def _watch (self, lb):
+    if lb in self._watched: return
+    self._watched.add(lb)
+    lb.addListener(ServerDrained, self._handle_ServerDrained)
+
+  def _handle_ServerDrained (self, event):
+    con = event.balancer.con
+    self.send(drained = str(event.server),
+              dpid = dpid_to_str(con.dpid) if con is not None else None)
+
+  def _do (self, event, f, *args):
+    msg = event.msg
+    try:
+      self.reply(event, result = f(*args, dpid = msg.get('dpid'),
+                                   name = msg.get('name')))
+    except Exception as e:
+      self.reply(event, error = str(e))
+
+  def _exec_cmd_drain (self, event):
+    self._do(event, _drain, event.msg.get('server'))
+
+  def _exec_cmd_undrain (self, event):
+    self._do(event, _undrain, event.msg.get('server'))
+
+  def _exec_cmd_list_servers (self, event):
+    self._do(event, _list_servers)
+
+
+class IPLBRequestHandler (JSONRPCHandler):
+  """
+  JSON-RPC interface for iplb
+  """
+  def _call (self, f, *args, **kw):
+    try:
+      with core.scheduler.synchronized():
+        return {'result':f(*args, **kw)}
+    except Exception as e:
+      return make_error(str(e))
+
+  def _exec_drain (self, server, dpid = None, name = None):
+    return self._call(_drain, server, dpid = dpid, name = name)
+
+  def _exec_undrain (self, server, dpid = None, name = None):
+    return self._call(_undrain, server, dpid = dpid, name = name)
+
+  def _exec_list_servers (self, dpid = None, name = None):
+    return self._call(_list_servers, dpid = dpid, name = name)
+
+
+def launch (username = '', password = ''):
+  def start_bot ():
+    IPLBBot(core.MessengerNexus.get_channel("iplb"))
+
+  def start_web ():
+    cfg = {}
+    if len(username) and len(password):
+      cfg['auth'] = lambda u, p: (u == username) and (p == password)
+    core.WebServer.set_handler("/iplb/", IPLBRequestHandler, cfg, True)
+
+  core.call_when_ready(start_bot, "MessengerNexus", name = "iplb_service.bot")
+  core.call_when_ready(start_web, "WebServer", name = "iplb_service.web")
@@ -244,7 +244,6 @@ class NAT (object):
         event.connection.send(fm)
         return
       log.debug("%s reinstalled", record)
-      record.incoming_fm.data = event.ofp # Hacky!
     else:
       record = self._record_by_outgoing.get(match)
       if record is None:
@@ -283,11 +282,10 @@ class NAT (object):
         fm.actions.append(of.ofp_action_output(port = event.port))
 
         record.incoming_match = self.strip_match(fm.match)
-        record.incoming_fm = fm
+        record.incoming_fm = of.FlowModTemplate(fm)
 
         # Inside heading out
         fm = of.ofp_flow_mod()
-        fm.data = event.ofp
         fm.flags |= of.OFPFF_SEND_FLOW_REM
         fm.hard_timeout = FLOW_TIMEOUT
         fm.match = match.clone()
@@ -302,7 +300,7 @@ class NAT (object):
         fm.actions.append(of.ofp_action_output(port = self._outside_portno))
 
         record.outgoing_match = self.strip_match(fm.match)
-        record.outgoing_fm = fm
+        record.outgoing_fm = of.FlowModTemplate(fm)
 
         self._record_by_incoming[record.incoming_match] = record
         self._record_by_outgoing[record.outgoing_match] = record
@@ -310,22 +308,19 @@ class NAT (object):
         log.debug("%s installed", record)
       else:
         log.debug("%s reinstalled", record)
-        record.outgoing_fm.data = event.ofp # Hacky!
 
     record.touch()
 
-    # Send/resend the flow mods
+    # Send/resend the flow mods (the one in this packet's direction gets
+    # the packet)
     if incoming:
-      data = record.outgoing_fm.pack() + record.incoming_fm.pack()
+      data = (record.outgoing_fm.pack() +
+              record.incoming_fm.pack(data = event.ofp))
     else:
-      data = record.incoming_fm.pack() + record.outgoing_fm.pack()
+      data = (record.incoming_fm.pack() +
+              record.outgoing_fm.pack(data = event.ofp))
     self._connection.send(data)
 
-    # We may have set one of the data fields, but they should be reset since
-    # they won't be valid in the future.  Kind of hacky.
-    record.outgoing_fm.data = None
-    record.incoming_fm.data = None
-
   def __handle_dpid_ConnectionUp (self, event):
     if event.dpid != self.dpid:
       return
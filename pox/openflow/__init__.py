@@ -71,6 +71,51 @@ class ConnectionDown (Event):
     self.connection = connection
     self.dpid = connection.dpid
 
+class WriteQueueHigh (Event):
+  """
+  Raised when a connection's queue of unsent data passes its high
+  watermark
+
+  Apps sending lots of messages should hold off until WriteQueueLow.
+  queued is the number of bytes waiting.
+  """
+  def __init__ (self, connection, queued):
+    Event.__init__(self)
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.queued = queued
+
+class WriteQueueLow (Event):
+  """
+  Raised when a connection's queue of unsent data drains back below its
+  low watermark after a WriteQueueHigh
+  """
+  def __init__ (self, connection, queued):
+    Event.__init__(self)
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.queued = queued
+
+class PacketInFlood (Event):
+  """
+  Raised when packet_ins from a switch port go over their budget and are
+  temporarily being dropped by the switch (see of_01's packet_in_rate)
+
+  traffic_class is "tcp" or "other", dl_type is the EtherType being
+  dropped, nw_proto is the IP protocol (or None if it's not IPv4), and
+  duration is how long for (in seconds).
+  """
+  def __init__ (self, connection, port, traffic_class, dl_type, duration,
+                nw_proto = None):
+    Event.__init__(self)
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.port = port
+    self.traffic_class = traffic_class
+    self.dl_type = dl_type
+    self.nw_proto = nw_proto
+    self.duration = duration
+
 class PortStatus (Event):
   """
   Fired in response to port status changes.
@@ -129,12 +174,29 @@ class RawStatsReply (Event):
     return self.connection.dpid
 
 class StatsReply (Event):
-  """ Abstract superclass for all stats replies """
+  """
+  Abstract superclass for all stats replies
+
+  If the replies' bodies were left packed (see ofp_stats_reply.raw_types),
+  stats is only unpacked when someone asks for it.
+  """
   def __init__ (self, connection, ofp, stats):
     Event.__init__(self)
     self.connection = connection
     self.ofp = ofp     # Raw ofp message(s)
-    self.stats = stats # Processed
+    self._stats = stats # Processed
+
+  @property
+  def stats (self):
+    if self._stats is None:
+      self._stats = []
+      for part in self.ofp:
+        self._stats.extend(part.unpack_body())
+    return self._stats
+
+  @stats.setter
+  def stats (self, value):
+    self._stats = value
 
   @property
   def dpid (self):
@@ -144,7 +206,13 @@ class SwitchDescReceived (StatsReply):
   pass
 
 class FlowStatsReceived (StatsReply):
-  pass
+  @property
+  def table (self):
+    """
+    The flow stats as a NumPy array (see pox.openflow.stats_table)
+    """
+    from pox.openflow.stats_table import flow_stats_table
+    return flow_stats_table(self.ofp)
 
 class AggregateFlowStatsReceived (StatsReply):
   pass
@@ -153,7 +221,13 @@ class TableStatsReceived (StatsReply):
   pass
 
 class PortStatsReceived (StatsReply):
-  pass
+  @property
+  def table (self):
+    """
+    The port stats as a NumPy array (see pox.openflow.stats_table)
+    """
+    from pox.openflow.stats_table import port_stats_table
+    return port_stats_table(self.ofp)
 
 class QueueStatsReceived (StatsReply):
   pass
@@ -170,10 +244,16 @@ class PacketIn (Event):
     self.connection = connection
     self.ofp = ofp
     self.port = ofp.in_port
-    self.data = ofp.data
     self._parsed = None
     self.dpid = connection.dpid
 
+  @property
+  def data (self):
+    """
+    The raw packet data
+    """
+    return self.ofp.data
+
   def parse (self):
     if self._parsed is None:
       self._parsed = ethernet(self.data)
@@ -320,6 +400,9 @@ class OpenFlowNexus (EventMixin):
     PortStatsReceived,
     QueueStatsReceived,
     FlowRemoved,
+    WriteQueueHigh,
+    WriteQueueLow,
+    PacketInFlood,
   ])
 
   # Bytes to send to controller when a packet misses all flows
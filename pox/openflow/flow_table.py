@@ -53,6 +53,24 @@ class TableEntry (object):
     self.actions = actions
     self.buffer_id = buffer_id
 
+  @property
+  def match (self):
+    return self._match
+
+  @match.setter
+  def match (self, match):
+    self._match = match
+    self._compiled_match = None
+
+  @property
+  def compiled_match (self):
+    """
+    The match as a CompiledMatch (made the first time it's needed)
+    """
+    if self._compiled_match is None:
+      self._compiled_match = CompiledMatch(self._match)
+    return self._compiled_match
+
   @staticmethod
   def from_flow_mod (flow_mod):
     return TableEntry(priority=flow_mod.priority,
@@ -91,14 +109,20 @@ class TableEntry (object):
     If out_port is any value besides None, the the flow entry must contain an
     output action to the specified port.
     """
-    match_a = lambda a: isinstance(a, ofp_action_output) and a.port == out_port
-    port_matches = (out_port is None) or any(match_a(a) for a in self.actions)
+    port_matches = (out_port is None) or self._outputs_to(out_port)
 
     if strict:
       return port_matches and self.match == match and self.priority == priority
     else:
       return port_matches and match.matches_with_wildcards(self.match)
 
+  def _outputs_to (self, out_port):
+    """
+    Tests whether this entry has an output action to out_port
+    """
+    return any(isinstance(a, ofp_action_output) and a.port == out_port
+               for a in self.actions)
+
   def touch_packet (self, byte_count, now=None):
     """
     Updates information of this entry based on encountering a packet.
@@ -208,11 +232,14 @@ class FlowTable (EventMixin):
     # Table is a list of TableEntry sorted by descending effective_priority.
     self._table = []
 
+    # (mask, key, entry) for each entry in _table, for entry_for_packet()
+    self._lookup = None
+
   def _dirty (self):
     """
     Call when table changes
     """
-    pass
+    self._lookup = None
 
   @property
   def entries (self):
@@ -253,8 +280,17 @@ class FlowTable (EventMixin):
     self.raiseEvent(FlowTableModification(removed=[entry], reason=reason))
 
   def matching_entries (self, match, priority=0, strict=False, out_port=None):
-    entry_match = lambda e: e.is_matched_by(match, priority, strict, out_port)
-    return [ entry for entry in self._table if entry_match(entry) ]
+    if strict:
+      entry_match = lambda e: e.is_matched_by(match, priority, strict,
+                                              out_port)
+      return [ entry for entry in self._table if entry_match(entry) ]
+
+    # Non-strict: compile the match once and compare it with each entry's
+    compiled = CompiledMatch(match)
+    covers = compiled.matches_with_wildcards
+    return [ entry for entry in self._table
+             if covers(entry.compiled_match)
+             and (out_port is None or entry._outputs_to(out_port)) ]
 
   def flow_stats (self, match, out_port=None, now=None):
     mc_es = self.matching_entries(match=match, strict=False, out_port=out_port)
@@ -317,11 +353,20 @@ class FlowTable (EventMixin):
     Returns the highest priority flow table entry that matches the given packet
     on the given in_port, or None if no matching entry is found.
     """
-    packet_match = ofp_match.from_packet(packet, in_port, spec_frags = True)
-
-    for entry in self._table:
-      if entry.match.matches_with_wildcards(packet_match,
-                                            consider_other_wildcards=False):
+    lookup = self._lookup
+    if lookup is None:
+      lookup = [(e.compiled_match.mask, e.compiled_match.key, e)
+                for e in self._table]
+      self._lookup = lookup
+
+    packet_match = CompiledMatch.from_packet(packet, in_port,
+                                             spec_frags = True)
+    value = packet_match.value
+    # Bits the packet doesn't have (e.g., no nw_src if it's not IP)
+    missing = ~packet_match.mask
+
+    for mask,key,entry in lookup:
+      if value & mask == key and not mask & missing:
         return entry
 
     return None
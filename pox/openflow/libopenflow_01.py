@@ -20,7 +20,8 @@ from __future__ import print_function
 
 import struct
 import operator
-from itertools import chain, repeat
+from binascii import hexlify, unhexlify
+from itertools import chain, repeat, izip
 import sys
 from pox.lib.packet.packet_base import packet_base
 from pox.lib.packet.ethernet import ethernet
@@ -91,6 +92,14 @@ _PAD3 = _PAD*3
 _PAD4 = _PAD*4
 _PAD6 = _PAD*6
 
+# Precompiled layouts for the most common messages and structures
+_HEADER = struct.Struct("!BBHL")
+_MATCH = struct.Struct("!LH6s6sHBxHBBxxLLHH")
+_FLOW_MOD = struct.Struct("!QHHHHLHH") # After the match
+_PACKET_IN = struct.Struct("!BBHLLHHBx") # Including the header
+_PACKET_OUT = struct.Struct("!LHH")
+_ACTION_OUTPUT = struct.Struct("!HHHH")
+
 class UnderrunError (RuntimeError):
   """
   Raised when one tries to unpack more data than is available
@@ -103,10 +112,14 @@ def _read (data, offset, length):
                         % (length, len(data)-offset))
   return (offset+length, data[offset:offset+length])
 
+_structs = {} # Format string -> compiled Struct
+
 def _unpack (fmt, data, offset):
-  size = struct.calcsize(fmt)
-  if (len(data)-offset) < size: raise UnderrunError()
-  return (offset+size, struct.unpack_from(fmt, data, offset))
+  s = _structs.get(fmt)
+  if s is None:
+    s = _structs[fmt] = struct.Struct(fmt)
+  if (len(data)-offset) < s.size: raise UnderrunError()
+  return (offset+s.size, s.unpack_from(data, offset))
 
 def _skip (data, offset, num):
   offset += num
@@ -565,19 +578,18 @@ class ofp_header (ofp_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!BBHL", self.version, self.header_type,
-        len(self), self.xid)
-    return packed
+    return _HEADER.pack(self.version, self.header_type, len(self),
+                        self.xid)
 
   def unpack (self, raw, offset=0):
     offset,length = self._unpack_header(raw, offset)
     return offset,length
 
   def _unpack_header (self, raw, offset):
-    offset,(self.version, self.header_type, length, self.xid) = \
-        _unpack("!BBHL", raw, offset)
-    return offset,length
+    if (len(raw)-offset) < 8: raise UnderrunError()
+    (self.version, self.header_type, length, self.xid) = \
+        _HEADER.unpack_from(raw, offset)
+    return offset+8,length
 
   def __eq__ (self, other):
     if type(self) != type(other): return False
@@ -917,7 +929,20 @@ class ofp_queue_prop_min_rate (ofp_base):
 
 
 ##2.3 Flow Match Structures
+def _ip_to_unsigned (addr):
+  if addr is None: return 0
+  if type(addr) is int: return addr & 0xffFFffFF
+  if type(addr) is long: return addr & 0xffFFffFF
+  return addr.toUnsigned()
+
+
 class ofp_match (ofp_base):
+  """
+  An OpenFlow 1.0 match
+
+  Once a match has been hashed, it's locked and can't be changed.  Locked
+  matches remember their packed form, so reusing one is cheap.
+  """
   adjust_wildcards = True # Set to true to "fix" outgoing wildcards
 
   @classmethod
@@ -1014,12 +1039,9 @@ class ofp_match (ofp_base):
     return reversed
 
   def __init__ (self, **kw):
-    self._locked = False
-
-    for k,v in ofp_match_data.iteritems():
-      setattr(self, '_' + k, v[0])
-
-    self.wildcards = self._normalize_wildcards(OFPFW_ALL)
+    d = self.__dict__
+    d['_locked'] = False
+    d.update(_match_defaults)
 
     # This is basically initHelper(), but tweaked slightly since this
     # class does some magic of its own.
@@ -1162,50 +1184,56 @@ class ofp_match (ofp_base):
   def pack (self, flow_mod=False):
     assert self._assert()
 
-    packed = b""
-    if self.adjust_wildcards and flow_mod:
+    adjust = self.adjust_wildcards and flow_mod
+    if self._locked:
+      # Can't change, so we can reuse the packed form
+      packed = self.__dict__.get('_packed')
+      if packed is not None and packed[0] == adjust:
+        return packed[1]
+
+    if adjust:
       wc = self._wire_wildcards(self.wildcards)
       assert self._prereq_warning()
     else:
       wc = self.wildcards
-    packed += struct.pack("!LH", wc, self.in_port or 0)
-    if self.dl_src is None:
-      packed += EMPTY_ETH.toRaw()
-    elif type(self.dl_src) is bytes:
-      packed += self.dl_src
-    else:
-      packed += self.dl_src.toRaw()
-    if self.dl_dst is None:
-      packed += EMPTY_ETH.toRaw()
-    elif type(self.dl_dst) is bytes:
-      packed += self.dl_dst
+
+    # Wildcarded fields go out as zero (they read as None through
+    # __getattr__), as do fields whose prerequisites aren't met.
+    w = self.wildcards
+    dl_type = 0 if w & OFPFW_DL_TYPE else self._dl_type or 0
+    nw_proto = 0 if w & OFPFW_NW_PROTO else self._nw_proto or 0
+    is_ip = dl_type == 0x0800
+    is_ip_or_arp = is_ip or dl_type == 0x0806
+    is_tp = is_ip and nw_proto in (1,6,17)
+
+    dl_src = EMPTY_ETH if w & OFPFW_DL_SRC else self._dl_src
+    if type(dl_src) is not bytes: dl_src = dl_src.toRaw()
+    dl_dst = EMPTY_ETH if w & OFPFW_DL_DST else self._dl_dst
+    if type(dl_dst) is not bytes: dl_dst = dl_dst.toRaw()
+
+    nw_src = nw_dst = 0
+    if is_ip_or_arp:
+      if (w & OFPFW_NW_SRC_ALL) != OFPFW_NW_SRC_ALL:
+        nw_src = _ip_to_unsigned(self._nw_src)
+      if (w & OFPFW_NW_DST_ALL) != OFPFW_NW_DST_ALL:
+        nw_dst = _ip_to_unsigned(self._nw_dst)
     else:
-      packed += self.dl_dst.toRaw()
-
-    def check_ip(val):
-      return (val or 0) if self.dl_type == 0x0800 else 0
-    def check_ip_or_arp(val):
-      return (val or 0) if self.dl_type == 0x0800 \
-                           or self.dl_type == 0x0806 else 0
-    def check_tp(val):
-      return (val or 0) if self.dl_type == 0x0800 \
-                           and self.nw_proto in (1,6,17) else 0
-
-    packed += struct.pack("!HB", self.dl_vlan or 0, self.dl_vlan_pcp or 0)
-    packed += _PAD # Hardcode padding
-    packed += struct.pack("!HBB", self.dl_type or 0,
-        check_ip(self.nw_tos), check_ip_or_arp(self.nw_proto))
-    packed += _PAD2 # Hardcode padding
-    def fix (addr):
-      if addr is None: return 0
-      if type(addr) is int: return addr & 0xffFFffFF
-      if type(addr) is long: return addr & 0xffFFffFF
-      return addr.toUnsigned()
-
-    packed += struct.pack("!LLHH", check_ip_or_arp(fix(self.nw_src)),
-        check_ip_or_arp(fix(self.nw_dst)),
-        check_tp(self.tp_src), check_tp(self.tp_dst))
+      nw_proto = 0
+
+    packed = _MATCH.pack(wc,
+        0 if w & OFPFW_IN_PORT else self._in_port or 0,
+        dl_src, dl_dst,
+        0 if w & OFPFW_DL_VLAN else self._dl_vlan or 0,
+        0 if w & OFPFW_DL_VLAN_PCP else self._dl_vlan_pcp or 0,
+        dl_type,
+        0 if (w & OFPFW_NW_TOS or not is_ip) else self._nw_tos or 0,
+        nw_proto,
+        nw_src, nw_dst,
+        0 if (w & OFPFW_TP_SRC or not is_tp) else self._tp_src or 0,
+        0 if (w & OFPFW_TP_DST or not is_tp) else self._tp_dst or 0)
 
+    if self._locked:
+      self.__dict__['_packed'] = (adjust, packed)
     return packed
 
   def _normalize_wildcards (self, wildcards):
@@ -1324,26 +1352,31 @@ class ofp_match (ofp_base):
     return not self.is_wildcarded
 
   def unpack (self, raw, offset=0, flow_mod=False):
-    _offset = offset
-    offset,(wildcards, self._in_port) = _unpack("!LH",raw, offset)
-    offset,self._dl_src = _readether(raw, offset)
-    offset,self._dl_dst = _readether(raw, offset)
-    offset,(self._dl_vlan, self._dl_vlan_pcp) = \
-        _unpack("!HB", raw, offset)
-    offset = _skip(raw, offset, 1)
-    offset,(self._dl_type, self._nw_tos, self._nw_proto) = \
-        _unpack("!HBB", raw, offset)
-    offset = _skip(raw, offset, 2)
-    offset,self._nw_src = _readip(raw, offset)
-    offset,self._nw_dst = _readip(raw, offset)
-    offset,(self._tp_src, self._tp_dst) = _unpack("!HH", raw, offset)
+    if self._locked:
+      raise AttributeError('match object is locked')
+    if (len(raw)-offset) < 40: raise UnderrunError()
+    (wildcards, in_port, dl_src, dl_dst, dl_vlan, dl_vlan_pcp, dl_type,
+     nw_tos, nw_proto, nw_src, nw_dst, tp_src, tp_dst) = \
+        _MATCH.unpack_from(raw, offset)
+    d = self.__dict__
+    d['_in_port'] = in_port
+    d['_dl_src'] = EthAddr(dl_src)
+    d['_dl_dst'] = EthAddr(dl_dst)
+    d['_dl_vlan'] = dl_vlan
+    d['_dl_vlan_pcp'] = dl_vlan_pcp
+    d['_dl_type'] = dl_type
+    d['_nw_tos'] = nw_tos
+    d['_nw_proto'] = nw_proto
+    d['_nw_src'] = IPAddr(nw_src)
+    d['_nw_dst'] = IPAddr(nw_dst)
+    d['_tp_src'] = tp_src
+    d['_tp_dst'] = tp_dst
 
     # Only unwire wildcards for flow_mod
-    self.wildcards = self._normalize_wildcards(
+    d['wildcards'] = self._normalize_wildcards(
         self._unwire_wildcards(wildcards) if flow_mod else wildcards)
 
-    assert offset - _offset == len(self)
-    return offset
+    return offset + 40
 
   @staticmethod
   def __len__ ():
@@ -1502,6 +1535,129 @@ class ofp_match (ofp_base):
     return outstr
 
 
+# Where each field of an ofp_match is in a CompiledMatch value: the packed
+# match (as by _MATCH) without its wildcards, read as one big integer.
+# name -> (byte offset, size)
+_COMPILED_LAYOUT = {
+  'in_port' : (0, 2),
+  'dl_src' : (2, 6),
+  'dl_dst' : (8, 6),
+  'dl_vlan' : (14, 2),
+  'dl_vlan_pcp' : (16, 1),
+  'dl_type' : (18, 2),
+  'nw_tos' : (20, 1),
+  'nw_proto' : (21, 1),
+  'nw_src' : (24, 4),
+  'nw_dst' : (28, 4),
+  'tp_src' : (32, 2),
+  'tp_dst' : (34, 2),
+}
+_COMPILED_SIZE = 36
+
+_compiled_masks = {} # wildcards -> mask
+
+def _compiled_mask (wildcards):
+  """
+  Returns the mask of the bits a match with these wildcards looks at
+  """
+  mask = _compiled_masks.get(wildcards)
+  if mask is not None: return mask
+  mask = 0
+  for name,(offset,size) in _COMPILED_LAYOUT.iteritems():
+    shift = (_COMPILED_SIZE - offset - size) * 8
+    if name == 'nw_src':
+      bits = (wildcards & OFPFW_NW_SRC_MASK) >> OFPFW_NW_SRC_SHIFT
+    elif name == 'nw_dst':
+      bits = (wildcards & OFPFW_NW_DST_MASK) >> OFPFW_NW_DST_SHIFT
+    else:
+      if wildcards & ofp_match_data[name][1]: continue
+      mask |= ((1 << (size * 8)) - 1) << shift
+      continue
+    if bits < 32:
+      mask |= ((0xffFFffFF >> bits) << bits) << shift
+  _compiled_masks[wildcards] = mask
+  return mask
+
+
+class CompiledMatch (object):
+  """
+  An ofp_match boiled down to integers for fast matching
+
+  value holds all the fields (wildcarded ones are zero), mask has the
+  bits the match cares about, and key is value & mask.  So a packet (or
+  an exact match) with value v matches if v & mask == key.
+
+  It converts back to an ofp_match with to_match(), and two compiled
+  matches are equal if they match the same things.  Since it's made from
+  a snapshot of the match, changing the ofp_match later doesn't affect it.
+  """
+  __slots__ = ('wildcards', 'value', 'mask', 'key')
+
+  def __init__ (self, match):
+    w = match.wildcards
+    dl_src = match.dl_src
+    dl_src = EMPTY_ETH.toRaw() if dl_src is None else _eth_raw(dl_src)
+    dl_dst = match.dl_dst
+    dl_dst = EMPTY_ETH.toRaw() if dl_dst is None else _eth_raw(dl_dst)
+    packed = _MATCH.pack(0, match.in_port or 0, dl_src, dl_dst,
+                         match.dl_vlan or 0, match.dl_vlan_pcp or 0,
+                         match.dl_type or 0, match.nw_tos or 0,
+                         match.nw_proto or 0,
+                         _ip_to_unsigned(match.get_nw_src()[0]),
+                         _ip_to_unsigned(match.get_nw_dst()[0]),
+                         match.tp_src or 0, match.tp_dst or 0)
+    self.wildcards = w
+    self.value = int(hexlify(packed[4:]), 16)
+    self.mask = _compiled_mask(w)
+    self.key = self.value & self.mask
+
+  @classmethod
+  def from_packet (cls, packet, in_port = None, spec_frags = False):
+    """
+    Same as ofp_match.from_packet(), but compiled
+    """
+    return cls(ofp_match.from_packet(packet, in_port, spec_frags))
+
+  def to_match (self):
+    """
+    Returns an equivalent ofp_match
+    """
+    packed = struct.pack("!L", self.wildcards)
+    packed += unhexlify("%0*x" % (_COMPILED_SIZE * 2, self.value))
+    m = ofp_match()
+    m.unpack(packed)
+    return m
+
+  def matches_with_wildcards (self, other):
+    """
+    Tests whether this match completely encompasses the other one
+
+    Like ofp_match.matches_with_wildcards(), other must also be no wider
+    than we are.  other is a CompiledMatch.
+    """
+    return (other.value & self.mask == self.key
+            and not self.mask & ~other.mask)
+
+  def __eq__ (self, other):
+    if type(other) is not CompiledMatch: return False
+    return self.key == other.key and self.mask == other.mask
+
+  def __ne__ (self, other):
+    return not self.__eq__(other)
+
+  def __hash__ (self):
+    return hash((self.key, self.mask))
+
+  def __repr__ (self):
+    return "<CompiledMatch %0*x/%0*x>" % (_COMPILED_SIZE * 2, self.key,
+                                         _COMPILED_SIZE * 2, self.mask)
+
+
+def _eth_raw (addr):
+  if type(addr) is bytes: return addr
+  return addr.toRaw()
+
+
 class ofp_action_generic (ofp_action_base):
   _MIN_LENGTH = 8
   def __init__ (self, **kw):
@@ -1541,6 +1697,8 @@ class ofp_action_generic (ofp_action_base):
     return outstr
 
 
+_packed_outputs = {} # (port, max_len) -> packed ofp_action_output
+
 @openflow_action('OFPAT_OUTPUT', 0)
 class ofp_action_output (ofp_action_base):
   def __init__ (self, **kw):
@@ -1555,9 +1713,13 @@ class ofp_action_output (ofp_action_base):
 
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!HHHH", self.type, len(self), self.port,
-                          self.max_len)
+    # Most flow_mods and packet_outs use one of a few of these
+    key = (self.port, self.max_len)
+    packed = _packed_outputs.get(key)
+    if packed is None:
+      packed = _ACTION_OUTPUT.pack(self.type, 8, self.port, self.max_len)
+      if len(_packed_outputs) < 4096:
+        _packed_outputs[key] = packed
     return packed
 
   def unpack (self, raw, offset=0):
@@ -2311,20 +2473,19 @@ class ofp_flow_mod (ofp_header):
       buffer_id = NO_BUFFER
 
     assert self._assert()
-    packed = b""
-    packed += ofp_header.pack(self)
-    packed += self.match.pack(flow_mod=True)
-    packed += struct.pack("!QHHHHLHH", self.cookie, self.command,
-                          self.idle_timeout, self.hard_timeout,
-                          self.priority, buffer_id, self.out_port,
-                          self.flags)
-    for i in self.actions:
-      packed += i.pack()
+    parts = [None, self.match.pack(flow_mod=True),
+             _FLOW_MOD.pack(self.cookie, self.command, self.idle_timeout,
+                            self.hard_timeout, self.priority, buffer_id,
+                            self.out_port, self.flags)]
+    parts.extend(i.pack() for i in self.actions)
+    length = 32 + len(parts[1]) + sum(len(p) for p in parts[3:])
+    parts[0] = _HEADER.pack(self.version, self.header_type, length,
+                            self.xid)
 
     if po:
-      packed += ofp_barrier_request().pack()
-      packed += po.pack()
-    return packed
+      parts.append(ofp_barrier_request().pack())
+      parts.append(po.pack())
+    return b''.join(parts)
 
   def unpack (self, raw, offset=0):
     offset,length = self._unpack_header(raw, offset)
@@ -2332,7 +2493,7 @@ class ofp_flow_mod (ofp_header):
     offset,(self.cookie, self.command, self.idle_timeout,
             self.hard_timeout, self.priority, self._buffer_id,
             self.out_port, self.flags) = \
-            _unpack("!QHHHHLHH", raw, offset)
+            _unpack(_FLOW_MOD.format, raw, offset)
     offset,self.actions = _unpack_actions(raw,
         length-(32 + len(self.match)), offset)
     assert length == len(self)
@@ -2380,6 +2541,102 @@ class ofp_flow_mod (ofp_header):
     return outstr
 
 
+_TEMPLATE = struct.Struct("!4sL40s16sL") # See FlowModTemplate.pack()
+_FLOW_MOD_HEAD = struct.Struct("!QHHHH") # cookie through priority
+_FLOW_MOD_TAIL = struct.Struct("!HH") # out_port and flags
+
+class FlowModTemplate (object):
+  """
+  A flow_mod with everything but the match, buffer_id and xid pre-packed
+
+  Apps which install lots of flows that differ only in their matches can
+  make one of these (from an ofp_flow_mod, or from the same arguments
+  you'd give ofp_flow_mod) and then use pack() or pack_many() per flow
+  instead of building and packing a new flow_mod and actions each time.
+  The result can be passed straight to Connection.send().
+
+  The template is a snapshot; changing the flow_mod or its actions later
+  doesn't affect it.
+  """
+  def __init__ (self, flow_mod = None, **kw):
+    if flow_mod is None:
+      flow_mod = ofp_flow_mod(**kw)
+    elif kw:
+      raise TypeError("give a flow_mod or keyword arguments, not both")
+    if flow_mod.data:
+      raise ValueError("a template can't have data")
+    self.flow_mod = flow_mod
+    assert flow_mod._assert()
+
+    actions = b''.join([a.pack() for a in flow_mod.actions])
+    self.length = 72 + len(actions)
+    self._header = struct.pack("!BBH", flow_mod.version,
+                               flow_mod.header_type, self.length)
+    # These go before and after the buffer_id
+    self._body = _FLOW_MOD_HEAD.pack(flow_mod.cookie, flow_mod.command,
+                                     flow_mod.idle_timeout,
+                                     flow_mod.hard_timeout,
+                                     flow_mod.priority)
+    self._tail = _FLOW_MOD_TAIL.pack(flow_mod.out_port,
+                                     flow_mod.flags) + actions
+    self._match = flow_mod.match.pack(flow_mod=True)
+
+  def pack (self, match = None, buffer_id = None, xid = None, data = None):
+    """
+    Packs a flow_mod for the given match
+
+    match can be an ofp_match or one already packed for a flow_mod.  If
+    it's None, the template's own match is used.
+    data may be a packet_in to apply the flow to, as with ofp_flow_mod;
+    if the packet wasn't buffered, a barrier and packet_out are appended.
+    """
+    po = None
+    if data is not None:
+      if not data.is_complete:
+        _log(warn="flow_mod is trying to include incomplete data")
+      elif data.buffer_id is not None:
+        buffer_id = data.buffer_id
+      else:
+        po = ofp_packet_out(data = data,
+                            action = ofp_action_output(port = OFPP_TABLE))
+    if match is None:
+      match = self._match
+    elif type(match) is not bytes:
+      match = match.pack(flow_mod=True)
+    if buffer_id is None: buffer_id = NO_BUFFER
+    if xid is None: xid = generate_xid()
+    packed = _TEMPLATE.pack(self._header, xid, match, self._body,
+                            buffer_id) + self._tail
+    if po is not None:
+      packed += ofp_barrier_request().pack() + po.pack()
+    return packed
+
+  def pack_many (self, matches, buffer_ids = None):
+    """
+    Packs flow_mods for many matches at once
+
+    buffer_ids, if given, is a parallel sequence of buffer IDs (or Nones).
+    Returns all the packed flow_mods as one string.
+    """
+    tpack = _TEMPLATE.pack
+    header = self._header
+    body = self._body
+    tail = self._tail
+    parts = []
+    if buffer_ids is None:
+      buffer_ids = repeat(NO_BUFFER)
+    for match,buffer_id in izip(matches, buffer_ids):
+      if type(match) is not bytes:
+        match = match.pack(flow_mod=True)
+      if buffer_id is None: buffer_id = NO_BUFFER
+      parts.append(tpack(header, generate_xid(), match, body, buffer_id))
+      parts.append(tail)
+    return b''.join(parts)
+
+  def __len__ (self):
+    return self.length
+
+
 @openflow_c_message("OFPT_PORT_MOD", 15)
 class ofp_port_mod (ofp_header):
   def __init__ (self, **kw):
@@ -2646,6 +2903,12 @@ class ofp_stats_request (ofp_header):
     reply_to="ofp_stats_request")
 class ofp_stats_reply (ofp_header):
   _MIN_LENGTH = 12
+
+  # Stats types whose bodies unpack() leaves packed (as bytes) for
+  # someone else to decode (see pox.openflow.stats_table).  Use
+  # unpack_body() to get the objects anyway.
+  raw_types = set()
+
   def __init__ (self, **kw):
     ofp_header.__init__(self)
     self.type = None # Guess
@@ -2705,33 +2968,44 @@ class ofp_stats_reply (ofp_header):
   def unpack (self, raw, offset=0):
     offset,length = self._unpack_header(raw, offset)
     offset,(self.type, self.flags) = _unpack("!HH", raw, offset)
-    offset,packed = _read(raw, offset, length - 12)
     t = _stats_type_to_class_info.get(self.type)
-    if t is None:
+    if t is None or t.reply is None or self.type in self.raw_types:
       #FIXME: Put in a generic container?
-      self.body = packed
+      offset,self.body = _read(raw, offset, length - 12)
     else:
-      if t.reply is None:
-        #FIXME: Put in a generic container?
-        self.body = packed
-      else:
-        if not t.reply_is_list:
-          self.body = t.reply()
-          self.body.unpack(packed, 0, len(packed))
-        else:
-          prev_len = len(packed)
-          self.body = []
-          while len(packed):
-            part = t.reply()
-            off = part.unpack(packed, 0, len(packed))
-            packed = packed[off:]
-            assert len(packed) != prev_len
-            prev_len = len(packed)
-            self.body.append(part)
+      end = offset + length - 12
+      if len(raw) < end: raise UnderrunError()
+      self.body = self._unpack_body(t, raw, offset, end)
+      offset = end
 
     assert length == len(self)
     return offset,length
 
+  @staticmethod
+  def _unpack_body (t, raw, offset, end):
+    # Unpack the body parts in place rather than slicing them out
+    if not t.reply_is_list:
+      body = t.reply()
+      body.unpack(raw, offset, end - offset)
+      return body
+    body = []
+    while offset < end:
+      part = t.reply()
+      new_offset = part.unpack(raw, offset, end - offset)
+      assert new_offset > offset
+      offset = new_offset
+      body.append(part)
+    return body
+
+  def unpack_body (self):
+    """
+    Returns the body as objects, even if unpack() left it packed
+    """
+    if type(self.body) is not bytes: return self.body
+    t = _stats_type_to_class_info.get(self.type)
+    if t is None or t.reply is None: return self.body
+    return self._unpack_body(t, self.body, 0, len(self.body))
+
   def __len__ (self):
     if isinstance(self.body, list):
       return 12 + sum(len(part) for part in self.body)
@@ -3573,7 +3847,7 @@ class ofp_packet_out (ofp_header):
         #      Unfortunately, we currently have no logging in here, so we
         #      assert instead which is a either too drastic or too quiet.
         assert data.is_complete
-        self._data = data._data
+        self._data = data.data
       self.in_port = data.in_port
     elif isinstance(data, bytes):
       self._data = data
@@ -3587,17 +3861,15 @@ class ofp_packet_out (ofp_header):
   def pack (self):
     assert self._assert()
 
-    actions = b''.join((i.pack() for i in self.actions))
+    actions = b''.join([i.pack() for i in self.actions])
     actions_len = len(actions)
+    data = self.data or b''
 
-    if self.data is not None:
-      return b''.join((ofp_header.pack(self),
-        struct.pack("!LHH", self._buffer_id, self.in_port, actions_len),
-        actions, self.data))
-    else:
-      return b''.join((ofp_header.pack(self),
-      struct.pack("!LHH", self._buffer_id, self.in_port, actions_len),
-      actions))
+    return b''.join((
+      _HEADER.pack(self.version, self.header_type,
+                   16 + actions_len + len(data), self.xid),
+      _PACKET_OUT.pack(self._buffer_id, self.in_port, actions_len),
+      actions, data))
 
   def unpack (self, raw, offset=0):
     _offset = offset
@@ -3718,6 +3990,16 @@ class ofp_barrier_request (ofp_header):
 #4 Asynchronous Messages
 @openflow_s_message("OFPT_PACKET_IN", 10)
 class ofp_packet_in (ofp_header):
+  """
+  A packet_in
+
+  When unpacked, the packet data is left where it is until someone asks
+  for it, so handlers which only look at the header fields (or which
+  just hand the packet_in to a packet_out or flow_mod using its buffer)
+  don't pay for copying it.  Until then, though, the packet_in keeps the
+  whole buffer it was unpacked from alive, so whatever unpacked it should
+  call detach() once it's been handled.
+  """
   _MIN_LENGTH = 18
   def __init__ (self, **kw):
     ofp_header.__init__(self)
@@ -3725,6 +4007,7 @@ class ofp_packet_in (ofp_header):
     self.in_port = OFPP_NONE
     self._buffer_id = NO_BUFFER
     self.reason = 0
+    self._raw = None # (raw, start, end) of data not copied out yet
     self.data = None
     self._total_len = None
 
@@ -3758,10 +4041,12 @@ class ofp_packet_in (ofp_header):
 
   @property
   def data (self):
+    if self._raw is not None: self.detach()
     return self._data
   @data.setter
   def data (self, data):
     assert assert_type("data", data, (packet_base, str))
+    self._raw = None
     if data is None:
       self._data = ''
     elif isinstance(data, packet_base):
@@ -3769,16 +4054,48 @@ class ofp_packet_in (ofp_header):
     else:
       self._data = data
 
+  def detach (self):
+    """
+    Copies the data out of the buffer it was unpacked from (if it hasn't
+    been already)
+    """
+    if self._raw is not None:
+      raw,start,end = self._raw
+      self._data = raw[start:end]
+      self._raw = None
+
+  def peek (self, size):
+    """
+    Returns the first size bytes of data (without copying the rest)
+    """
+    if self._raw is not None:
+      raw,start,end = self._raw
+      return raw[start:min(end, start + size)]
+    return self._data[:size]
+
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += ofp_header.pack(self)
-    packed += struct.pack("!LHHBB", self._buffer_id, self.total_len,
-                          self.in_port, self.reason, 0)
-    packed += self.data
+    data = self.data
     #TODO: Padding?  See __len__
-    return packed
+    return _PACKET_IN.pack(self.version, self.header_type, 18 + len(data),
+                           self.xid, self._buffer_id, self.total_len,
+                           self.in_port, self.reason) + data
+
+  @classmethod
+  def unpack_new (cls, raw, offset=0):
+    """
+    Unpacks a packet_in without going through __init__()
+    """
+    if (len(raw)-offset) < 18: raise UnderrunError()
+    o = cls.__new__(cls)
+    (o.version, o.header_type, length, o._xid, o._buffer_id, o._total_len,
+     o.in_port, o.reason) = _PACKET_IN.unpack_from(raw, offset)
+    end = offset + length
+    if length < 18 or len(raw) < end: raise UnderrunError()
+    o._data = b''
+    o._raw = (raw, offset + 18, end)
+    return end,o
 
   @property
   def is_complete (self):
@@ -3789,15 +4106,19 @@ class ofp_packet_in (ofp_header):
     offset,length = self._unpack_header(raw, offset)
     offset,(self._buffer_id, self._total_len, self.in_port, self.reason,
             pad) = _unpack("!LHHBB", raw, offset)
-    offset,self.data = _read(raw, offset, length-18)
-    assert length == len(self)
-    return offset,length
+    if length < 18 or len(raw) < offset + length - 18:
+      raise UnderrunError()
+    self._data = b''
+    self._raw = (raw, offset, offset + length - 18)
+    return offset + length - 18,length
 
   def __len__ (self):
     #FIXME: This is probably wrong, but it's not clear from the
     #       spec what's supposed to be going on here.
     #if len(self.data) < 2:
     #  return 20 + len(self.data)
+    if self._raw is not None:
+      return 18 + self._raw[2] - self._raw[1]
     return 18 + len(self.data)
 
   def __eq__ (self, other):
@@ -4452,3 +4773,9 @@ ofp_match_data = {
   'tp_src' : (0, OFPFW_TP_SRC),
   'tp_dst' : (0, OFPFW_TP_DST),
 }
+
+# Initial contents of an ofp_match's __dict__ (everything wildcarded)
+_match_defaults = dict(('_' + k, v[0]) for k,v in ofp_match_data.iteritems())
+_match_defaults['wildcards'] = (OFPFW_ALL
+                                & ~(OFPFW_NW_SRC_MASK | OFPFW_NW_DST_MASK)
+                                | OFPFW_NW_SRC_ALL | OFPFW_NW_DST_ALL)
@@ -21,10 +21,14 @@ NOTE: This module is loaded automatically on startup unless POX is run
 from pox.core import core
 import pox
 import pox.lib.util
+from pox.lib.util import str_to_bool
+from pox.lib.epoll_select import EpollPoller
 from pox.lib.addresses import EthAddr
 from pox.lib.revent.revent import EventMixin
 import datetime
 import time
+import heapq
+from collections import deque
 from pox.lib.socketcapture import CaptureSocket
 import pox.openflow.debug
 from pox.openflow.util import make_type_to_unpacker_table
@@ -40,22 +44,11 @@ import select
 # type into a message object.
 unpackers = make_type_to_unpacker_table()
 
-try:
-  PIPE_BUF = select.PIPE_BUF
-except:
-  try:
-    # Try to get it from where PyPy (sometimes) has it
-    import IN
-    PIPE_BUF = IN.PIPE_BUF
-  except:
-    # (Hopefully) reasonable default
-    PIPE_BUF = 512
-
 import pox.openflow.libopenflow_01 as of
 
-import threading
 import os
 import sys
+import threading
 import exceptions
 from errno import EAGAIN, ECONNRESET, EADDRINUSE, EADDRNOTAVAIL
 
@@ -72,7 +65,7 @@ def handle_HELLO (con, msg): #S
 
 def handle_ECHO_REPLY (con, msg):
   #con.msg("Got echo reply")
-  pass
+  con._finish_request(msg)
 
 def handle_ECHO_REQUEST (con, msg): #S
   reply = msg
@@ -97,6 +90,7 @@ def handle_FEATURES_REPLY (con, msg):
     e = con.ofnexus.raiseEventNoErrors(FeaturesReceived, con, msg)
     if e is None or e.halt != True:
       con.raiseEventNoErrors(FeaturesReceived, con, msg)
+    con._finish_request(msg)
     return
 
   nexus = core.OpenFlowConnectionArbiter.getNexus(con)
@@ -176,6 +170,9 @@ def handle_PACKET_IN (con, msg): #A
   e = con.ofnexus.raiseEventNoErrors(PacketIn, con, msg)
   if e is None or e.halt != True:
     con.raiseEventNoErrors(PacketIn, con, msg)
+  # Handlers may hang onto it (e.g., l2_multi while it sets up a path), so
+  # don't let it keep the whole read buffer alive
+  msg.detach()
 
 def handle_ERROR_MSG (con, msg): #A
   err = ErrorIn(con, msg)
@@ -185,13 +182,31 @@ def handle_ERROR_MSG (con, msg): #A
   if err.should_log:
     log.error(str(con) + " OpenFlow Error:\n" +
               msg.show(str(con) + " Error: ").strip())
+  con._finish_request(msg)
 
 def handle_BARRIER (con, msg):
   e = con.ofnexus.raiseEventNoErrors(BarrierIn, con, msg)
   if e is None or e.halt != True:
     con.raiseEventNoErrors(BarrierIn, con, msg)
+  con._finish_request(msg)
+
+def handle_CONFIG_REPLY (con, msg):
+  # GET_CONFIG_REPLY and QUEUE_GET_CONFIG_REPLY only go to requesters
+  con._finish_request(msg)
 
 # handlers for stats replies
+def _stats_list (parts):
+  """
+  Joins the bodies of a multipart stats reply
+
+  Returns None if they were left packed (the event unpacks them if asked).
+  """
+  msg = []
+  for part in parts:
+    if type(part.body) is bytes: return None
+    msg.extend(part.body)
+  return msg
+
 def handle_OFPST_DESC (con, parts):
   msg = parts[0].body
   e = con.ofnexus.raiseEventNoErrors(SwitchDescReceived,con,parts[0],msg)
@@ -199,9 +214,7 @@ def handle_OFPST_DESC (con, parts):
     con.raiseEventNoErrors(SwitchDescReceived, con, parts[0], msg)
 
 def handle_OFPST_FLOW (con, parts):
-  msg = []
-  for part in parts:
-    msg.extend(part.body)
+  msg = _stats_list(parts)
   e = con.ofnexus.raiseEventNoErrors(FlowStatsReceived, con, parts, msg)
   if e is None or e.halt != True:
     con.raiseEventNoErrors(FlowStatsReceived, con, parts, msg)
@@ -214,25 +227,19 @@ def handle_OFPST_AGGREGATE (con, parts):
     con.raiseEventNoErrors(AggregateFlowStatsReceived, con, parts[0], msg)
 
 def handle_OFPST_TABLE (con, parts):
-  msg = []
-  for part in parts:
-    msg.extend(part.body)
+  msg = _stats_list(parts)
   e = con.ofnexus.raiseEventNoErrors(TableStatsReceived, con, parts, msg)
   if e is None or e.halt != True:
     con.raiseEventNoErrors(TableStatsReceived, con, parts, msg)
 
 def handle_OFPST_PORT (con, parts):
-  msg = []
-  for part in parts:
-    msg.extend(part.body)
+  msg = _stats_list(parts)
   e = con.ofnexus.raiseEventNoErrors(PortStatsReceived, con, parts, msg)
   if e is None or e.halt != True:
     con.raiseEventNoErrors(PortStatsReceived, con, parts, msg)
 
 def handle_OFPST_QUEUE (con, parts):
-  msg = []
-  for part in parts:
-    msg.extend(part.body)
+  msg = _stats_list(parts)
   e = con.ofnexus.raiseEventNoErrors(QueueStatsReceived, con, parts, msg)
   if e is None or e.halt != True:
     con.raiseEventNoErrors(QueueStatsReceived, con, parts, msg)
@@ -241,6 +248,193 @@ def handle_VENDOR (con, msg):
   log.info("Vendor msg: " + str(msg))
 
 
+# Traffic classes for packet_in admission control, most important first
+PI_CONTROL = 0 # LLDP, ARP, BDDP
+PI_OTHER = 1
+PI_TCP = 2
+_pi_class_names = ("control", "other", "tcp")
+
+_pi_control_types = set([b'\x88\xcc', b'\x08\x06', b'\x89\x42'])
+
+def _packet_in_class (msg):
+  """
+  Returns a packet_in's traffic class, EtherType and IP protocol (None if
+  it's not IPv4) from a peek at its data
+  """
+  head = msg.peek(28) # Enough for the IP protocol after a VLAN tag
+  dl_type = head[12:14]
+  l3 = 14
+  if dl_type == b'\x81\x00':
+    dl_type = head[16:18]
+    l3 = 18
+  nw_proto = None
+  if dl_type == b'\x08\x00' and len(head) > l3 + 9:
+    nw_proto = ord(head[l3+9])
+  if dl_type in _pi_control_types:
+    c = PI_CONTROL
+  elif nw_proto == 6:
+    c = PI_TCP
+  else:
+    c = PI_OTHER
+  return c,dl_type,nw_proto
+
+
+class _TokenBucket (object):
+  __slots__ = ('tokens', 'stamp', 'blocked_until')
+  def __init__ (self, tokens, now):
+    self.tokens = tokens
+    self.stamp = now
+    self.blocked_until = [0] * len(_pi_class_names)
+
+  def refill (self, now, rate, burst):
+    tokens = self.tokens + (now - self.stamp) * rate
+    self.tokens = tokens if tokens < burst else burst
+    self.stamp = now
+
+
+class PacketInAdmission (object):
+  """
+  Admission control for packet_ins
+
+  Each packet_in has to take a token from its switch's bucket (refilled
+  at rate per second, holding up to burst) and from its port's bucket
+  before it is handled -- that is, before it's parsed or any PacketIn
+  events are raised.  Ones that can't are dropped ("shed").  Either
+  limit can be None.
+
+  Packet_ins are put in a traffic class by peeking at their headers:
+  control (LLDP, ARP), TCP, or other.  Less important classes need more
+  tokens left in a bucket, so the last of a budget goes to more important
+  traffic: TCP needs tcp_reserve of the burst to be left, and control
+  packets can overdraw by a whole burst.  Since echo requests are
+  answered inline as they're read, keeping packet_in handling within
+  budget also keeps echo replies (and keepalive) timely.
+
+  When a port sheds TCP or other traffic, a drop rule for that port and
+  EtherType (and TCP) is sent to the switch with a hard timeout of
+  block_time seconds, and PacketInFlood is raised.  The rule has a low
+  priority, so it only catches packets which would have been packet_ins
+  anyway.  Set block_time to 0 to only shed.
+
+  admitted and shed count packet_ins by class, and blocks counts drop
+  rules sent; counters() has them by name.  Connections also count their
+  own shed packet_ins in packet_ins_shed.
+  """
+  # Priority of drop rules
+  block_priority = 1
+
+  def __init__ (self, rate = None, burst = None, port_rate = None,
+                port_burst = None, block_time = 5, tcp_reserve = 0.25):
+    self.rate = rate
+    self.burst = burst if burst is not None else rate
+    self.port_rate = port_rate
+    self.port_burst = port_burst if port_burst is not None else port_rate
+    self.block_time = int(block_time)
+    self._thresholds = self._make_thresholds(self.burst, tcp_reserve)
+    self._port_thresholds = self._make_thresholds(self.port_burst,
+                                                  tcp_reserve)
+    self.admitted = [0] * len(_pi_class_names)
+    self.shed = [0] * len(_pi_class_names)
+    self.blocks = 0
+
+  @staticmethod
+  def _make_thresholds (burst, tcp_reserve):
+    """
+    Returns the tokens each class needs left in a bucket
+    """
+    if not burst: return None
+    t = [0] * len(_pi_class_names)
+    t[PI_CONTROL] = 1 - burst
+    t[PI_OTHER] = 1
+    t[PI_TCP] = 1 + tcp_reserve * burst
+    return t
+
+  def admit (self, con, msg):
+    """
+    Returns True if the packet_in msg from con should be handled
+    """
+    c,dl_type,nw_proto = _packet_in_class(msg)
+    now = time.time()
+
+    sw = con._pi_bucket
+    if self.rate:
+      if sw is None:
+        sw = con._pi_bucket = _TokenBucket(self.burst, now)
+      else:
+        sw.refill(now, self.rate, self.burst)
+      if sw.tokens < self._thresholds[c]:
+        self._shed(con, c)
+        return False
+
+    port = None
+    if self.port_rate:
+      port = con._pi_port_buckets.get(msg.in_port)
+      if port is None:
+        port = _TokenBucket(self.port_burst, now)
+        con._pi_port_buckets[msg.in_port] = port
+      else:
+        port.refill(now, self.port_rate, self.port_burst)
+      if port.tokens < self._port_thresholds[c]:
+        self._shed(con, c)
+        if (c != PI_CONTROL and self.block_time
+            and port.blocked_until[c] <= now):
+          port.blocked_until[c] = now + self.block_time
+          self._block(con, msg, c, dl_type, nw_proto)
+        return False
+
+    if self.rate: sw.tokens -= 1
+    if port is not None: port.tokens -= 1
+    self.admitted[c] += 1
+    return True
+
+  def _shed (self, con, c):
+    self.shed[c] += 1
+    con.packet_ins_shed += 1
+
+  def _block (self, con, msg, c, dl_type, nw_proto):
+    """
+    Has the switch drop this kind of traffic from msg's port for a while
+
+    For IPv4, the rule matches the IP protocol too, so that (for example)
+    a UDP flood doesn't keep new TCP connections from being set up.
+    """
+    self.blocks += 1
+    dl_type = (ord(dl_type[0]) << 8) | ord(dl_type[1])
+    fm = of.ofp_flow_mod(priority = self.block_priority,
+                         hard_timeout = self.block_time,
+                         buffer_id = msg.buffer_id)
+    fm.match.in_port = msg.in_port
+    fm.match.dl_type = dl_type
+    if nw_proto is not None: fm.match.nw_proto = nw_proto
+    con.send(fm)
+
+    log.warning("%s: Too many packet_ins on port %s; dropping %s traffic "
+                "(type 0x%04x, protocol %s) for %s seconds", con,
+                msg.in_port, _pi_class_names[c], dl_type, nw_proto,
+                self.block_time)
+    args = (con, msg.in_port, _pi_class_names[c], dl_type, self.block_time,
+            nw_proto)
+    e = con.ofnexus.raiseEventNoErrors(PacketInFlood, *args)
+    if e is None or e.halt != True:
+      con.raiseEventNoErrors(PacketInFlood, *args)
+
+  def handle_PACKET_IN (self, con, msg):
+    """
+    Replacement for the usual PACKET_IN handler which checks admit() first
+    """
+    if self.admit(con, msg):
+      handle_PACKET_IN(con, msg)
+
+  def counters (self):
+    """
+    Returns the counts as a dict
+    """
+    d = {'blocks' : self.blocks}
+    for i,name in enumerate(_pi_class_names):
+      d[name] = {'admitted' : self.admitted[i], 'shed' : self.shed[i]}
+    return d
+
+
 # A list, where the index is an OFPT, and the value is a function to
 # call for that type
 # This is generated automatically based on handlerMap
@@ -258,6 +452,8 @@ handlerMap = {
   of.OFPT_BARRIER_REPLY : handle_BARRIER,
   of.OFPT_STATS_REPLY : handle_STATS_REPLY,
   of.OFPT_FLOW_REMOVED : handle_FLOW_REMOVED,
+  of.OFPT_GET_CONFIG_REPLY : handle_CONFIG_REPLY,
+  of.OFPT_QUEUE_GET_CONFIG_REPLY : handle_CONFIG_REPLY,
   of.OFPT_VENDOR : handle_VENDOR,
 }
 
@@ -270,112 +466,68 @@ statsHandlerMap = {
   of.OFPST_QUEUE : handle_OFPST_QUEUE,
 }
 
-# Deferred sending should be unusual, so don't worry too much about
-# efficiency
-class DeferredSender (threading.Thread):
+class SendQueues (object):
   """
-  Class that handles sending when a socket write didn't complete
-  """
-  def __init__ (self):
-    threading.Thread.__init__(self)
-    core.addListeners(self)
-    self._dataForConnection = {}
-    self._lock = threading.RLock()
-    self._waker = pox.lib.util.makePinger()
-    self.sending = False
+  Keeps track of Connections with data waiting to go out
 
-    self.start()
+  Connection.send() just queues data, and the OpenFlow task flushes all
+  the waiting connections once per trip around its loop, so lots of
+  small messages sent in a row go out in a single send().
 
-  def _handle_GoingDownEvent (self, event):
-    self._waker.ping()
+  If the task isn't in the middle of its loop, something else is
+  sending.  If it's on the scheduler thread (e.g., a Timer or some other
+  Task), the waiting connections are flushed with callLater(), which is
+  right after it's done (so everything it sends still goes out together)
+  without waiting for the task to wake up.  Otherwise, the task gets
+  woken up to do it.
 
-  def _sliceup (self, data):
+  Connections can be sent to from any thread, so lock holds off other
+  threads while the pending set or a connection's queue is changing.
+  """
+  def __init__ (self):
+    self.pending = set()
+    self.waker = None # Set by the task
+    self.scheduler = None # ...and the scheduler it's running on
+    self.busy = False # True while the task is running its loop
+    self.lock = threading.RLock()
+
+  def schedule (self, con):
+    with self.lock:
+      if not self.pending and not self.busy and self.waker is not None:
+        scheduler = self.scheduler
+        if (scheduler is not None
+            and threading.current_thread() is scheduler._thread):
+          scheduler.callLater(self._flush)
+        else:
+          self.waker.ping()
+      self.pending.add(con)
+
+  def _flush (self):
+    if self.busy or self.waker is None: return
+    unfinished = False
+    for con in self.take():
+      if con.disconnected: continue
+      if not con.flush():
+        # The task has to wait for it to be writable
+        with self.lock:
+          self.pending.add(con)
+        unfinished = True
+    if unfinished:
+      self.waker.ping()
+
+  def discard (self, con):
+    with self.lock:
+      self.pending.discard(con)
+
+  def take (self):
     """
-    Takes an array of data bytes, and slices into elements of
-    PIPE_BUF bytes each
+    Returns the waiting connections and forgets about them
     """
-    out = []
-    while len(data) > PIPE_BUF:
-      out.append(data[0:PIPE_BUF])
-      data = data[PIPE_BUF:]
-    if len(data) > 0:
-      out.append(data)
-    return out
-
-  def send (self, con, data):
-    with self._lock:
-      self.sending = True
-
-      data = self._sliceup(data)
-
-      if con not in self._dataForConnection:
-        self._dataForConnection[con] = data
-      else:
-        self._dataForConnection[con].extend(data)
-
-      self._waker.ping()
+    with self.lock:
+      pending = self.pending
+      self.pending = set()
+    return pending
 
-  def kill (self, con):
-    with self._lock:
-      try:
-        del self._dataForConnection[con]
-      except:
-        pass
-
-      self._waker.ping()
-
-  def run (self):
-    while core.running:
-
-      with self._lock:
-        cons = self._dataForConnection.keys()
-
-      rlist, wlist, elist = select.select([self._waker], cons, cons, 5)
-      if not core.running: break
-
-      with self._lock:
-        if len(rlist) > 0:
-          self._waker.pongAll()
-
-        for con in elist:
-          try:
-            del self._dataForConnection[con]
-          except:
-            pass
-
-        for con in wlist:
-          try:
-            alldata = self._dataForConnection[con]
-            while len(alldata):
-              data = alldata[0]
-              try:
-                l = con.sock.send(data)
-                if l != len(data):
-                  alldata[0] = data[l:]
-                  break
-                del alldata[0]
-              except socket.error as (errno, strerror):
-                if errno != EAGAIN:
-                  con.msg("DeferredSender/Socket error: " + strerror)
-                  con.disconnect()
-                  del self._dataForConnection[con]
-                break
-              except:
-                con.msg("Unknown error doing deferred sending")
-                break
-            if len(alldata) == 0:
-              try:
-                del self._dataForConnection[con]
-                if len(self._dataForConnection) == 0:
-                  self.sending = False
-                  break
-              except:
-                pass
-          except:
-            try:
-              del self._dataForConnection[con]
-            except:
-              pass
 
 class DummyOFNexus (object):
   def raiseEventNoErrors (self, event, *args, **kw):
@@ -562,6 +714,146 @@ class PortCollection (object):
     r._ports = set(self.values())
 
 
+# Connection.read() starts out reading this much at a time, and doubles it
+# (up to the max) whenever a read fills it.
+_READ_SIZE_MIN = 4096
+_READ_SIZE_MAX = 128 * 1024
+
+# Most we try to send in one go
+_SEND_SIZE_MAX = 256 * 1024
+
+
+# Requests which the switch answers with a reply of their own
+_reply_types = set([of.OFPT_ECHO_REQUEST, of.OFPT_FEATURES_REQUEST,
+                    of.OFPT_GET_CONFIG_REQUEST, of.OFPT_STATS_REQUEST,
+                    of.OFPT_BARRIER_REQUEST,
+                    of.OFPT_QUEUE_GET_CONFIG_REQUEST])
+
+# Stats types whose replies can come in several parts
+_multipart_stats = set([of.OFPST_FLOW, of.OFPST_TABLE, of.OFPST_PORT,
+                        of.OFPST_QUEUE])
+
+
+class PendingRequest (object):
+  """
+  A request sent with Connection.request() which we're waiting on
+
+  status is None until it finishes, and then one of:
+   "ok"           - reply is the reply message (for stats requests, it's
+                    the list of stats reply parts; see also .body)
+   "error"        - error is the ofp_error the switch sent back
+   "timeout"      - no answer in time
+   "disconnected" - the connection went away first
+   "cancelled"    - cancel() was called
+  """
+  def __init__ (self, connection, msg, timeout):
+    self.connection = connection
+    self.request = msg
+    self.xid = msg.xid
+    self.status = None
+    self.reply = None
+    self.error = None
+    self.expires_at = time.time() + timeout if timeout else None
+    self._callbacks = []
+
+  @property
+  def done (self):
+    return self.status is not None
+
+  @property
+  def ok (self):
+    return self.status == "ok"
+
+  @property
+  def body (self):
+    """
+    The body of a stats reply, joined up if it came in several parts
+    """
+    parts = self.reply
+    if type(parts) is not list: return None # Not stats
+    if parts[0].type not in _multipart_stats: return parts[0].body
+    body = []
+    for part in parts:
+      body.extend(part.unpack_body())
+    return body
+
+  def add_callback (self, callback):
+    """
+    Calls callback(request) when this request finishes
+
+    If it has already finished, the callback is called right away.
+    """
+    if self.status is None:
+      self._callbacks.append(callback)
+    else:
+      self._call(callback)
+
+  def cancel (self):
+    """
+    Stops waiting (callbacks are called with status "cancelled")
+    """
+    if self.status is None:
+      self.connection._forget_request(self)
+      self._finish("cancelled")
+
+  def _call (self, callback):
+    try:
+      callback(self)
+    except Exception:
+      log.exception("%s: Exception in callback for xid %s",
+                    self.connection, self.xid)
+
+  def _finish (self, status, reply = None, error = None):
+    if self.status is not None: return
+    self.status = status
+    self.reply = reply
+    self.error = error
+    callbacks = self._callbacks
+    self._callbacks = None
+    for callback in callbacks:
+      self._call(callback)
+
+  def __repr__ (self):
+    return "<%s xid:%s %s>" % (type(self.request).__name__, self.xid,
+                               self.status or "pending")
+
+
+# Requests which may time out, as a heap of (expires_at, seq, request)
+_request_timeouts = []
+_request_seq = 0
+_request_timer = None
+
+# How often we check for requests which have timed out
+_REQUEST_TIMER_INTERVAL = 0.25
+
+def _schedule_timeout (request):
+  global _request_seq, _request_timer
+  _request_seq += 1
+  heapq.heappush(_request_timeouts,
+                 (request.expires_at, _request_seq, request))
+  if _request_timer is None:
+    _request_timer = Timer(_REQUEST_TIMER_INTERVAL, _expire_requests,
+                           recurring = True, scheduler = core.scheduler)
+
+def _expire_requests (now = None):
+  """
+  Times out pending requests
+
+  Called by a Timer; stops it when there's nothing left to time out.
+  """
+  global _request_timer
+  if now is None: now = time.time()
+  heap = _request_timeouts
+  while heap and heap[0][0] <= now:
+    request = heapq.heappop(heap)[2]
+    if request.status is None:
+      request.connection._forget_request(request)
+      request._finish("timeout")
+  if not heap:
+    _request_timer = None
+    return False
+
+
 class Connection (EventMixin):
   """
   A Connection object represents a single TCP session with an
@@ -584,11 +876,22 @@ class Connection (EventMixin):
     PortStatsReceived,
     QueueStatsReceived,
     FlowRemoved,
+    WriteQueueHigh,
+    WriteQueueLow,
+    PacketInFlood,
   ])
 
   # Globally unique identifier for the Connection instance
   ID = 0
 
+  # When this many bytes are waiting to be sent, we raise WriteQueueHigh.
+  # When it gets back down to write_queue_low, we raise WriteQueueLow.
+  write_queue_high = 1024 * 1024
+  write_queue_low = 256 * 1024
+
+  # Seconds before a request() times out by default
+  request_timeout = 10
+
   def msg (self, m):
     #print str(self), m
     log.debug(str(self) + " " + str(m))
@@ -600,12 +903,32 @@ class Connection (EventMixin):
     #print str(self), m
     log.info(str(self) + " " + str(m))
 
-  def __init__ (self, sock):
-    self._previous_stats = []
+  def __init__ (self, sock, send_hello = True):
+    """
+    send_hello is False if the switch has already been sent a HELLO (e.g.,
+    by a shard front end which then handed us the socket)
+    """
+    self._partial_stats = {} # xid -> stats reply parts received so far
+    self._pending = {} # xid -> PendingRequest
+    self._unacked = deque() # PendingRequests only a barrier can finish
+    self._request_count = 0
+
+    # Token buckets used by PacketInAdmission
+    self._pi_bucket = None
+    self._pi_port_buckets = {}
+    self.packet_ins_shed = 0
 
     self.ofnexus = _dummyOFNexus
     self.sock = sock
-    self.buf = ''
+    # Received data lives in buf[_buf_start:_buf_end]
+    self.buf = bytearray(_READ_SIZE_MIN * 2)
+    self._view = memoryview(self.buf)
+    self._buf_start = 0
+    self._buf_end = 0
+    self._read_size = _READ_SIZE_MIN
+    self._send_queue = [] # Packed data waiting to go out
+    self._send_queued = 0 # Bytes in _send_queue
+    self.send_blocked = False # Between WriteQueueHigh and WriteQueueLow
     Connection.ID += 1
     self.ID = Connection.ID
     # TODO: dpid and features don't belong here; they should be eventually
@@ -617,7 +940,8 @@ class Connection (EventMixin):
     self.connect_time = None
     self.idle_time = time.time()
 
-    self.send(of.ofp_hello())
+    if send_hello:
+      self.send(of.ofp_hello())
 
     self.original_ports = PortCollection()
     self.ports = PortCollection()
@@ -661,11 +985,17 @@ class Connection (EventMixin):
         self.ofnexus.raiseEventNoErrors(ConnectionDown, self)
         self.raiseEventNoErrors(ConnectionDown, self)
 
-    try:
-      #deferredSender.kill(self)
-      pass
-    except:
-      pass
+    with sendQueues.lock:
+      del self._send_queue[:]
+      self._send_queued = 0
+      sendQueues.discard(self)
+
+    pending = self._pending
+    self._pending = {}
+    self._unacked.clear()
+    self._partial_stats.clear()
+    for r in pending.values():
+      r._finish("disconnected")
     try:
       self.sock.shutdown(socket.SHUT_RDWR)
     except:
@@ -682,6 +1012,11 @@ class Connection (EventMixin):
 
     Data should probably either be raw bytes in OpenFlow wire format, or
     an OpenFlow controller-to-switch message object from libopenflow.
+
+    The data is queued and goes out (along with anything else sent in
+    the meantime) the next time the OpenFlow task flushes the connection.
+    If more than write_queue_high bytes are waiting, WriteQueueHigh is
+    raised and send_blocked is set until the queue drains.
     """
     if self.disconnected: return
     if type(data) is not bytes:
@@ -691,66 +1026,260 @@ class Connection (EventMixin):
       assert isinstance(data, of.ofp_header)
       data = data.pack()
 
-    if deferredSender.sending:
-      log.debug("deferred sender is sending!")
-      deferredSender.send(self, data)
+    with sendQueues.lock:
+      queue = self._send_queue
+      if not queue:
+        sendQueues.schedule(self)
+      queue.append(data)
+      self._send_queued += len(data)
+      queued = self._send_queued
+      high = queued >= self.write_queue_high and not self.send_blocked
+      if high: self.send_blocked = True
+    if high:
+      self.msg("Write queue high (%s bytes)" % (queued,))
+      self.ofnexus.raiseEventNoErrors(WriteQueueHigh, self, queued)
+      self.raiseEventNoErrors(WriteQueueHigh, self, queued)
+
+  def request (self, msg, callback = None, timeout = None):
+    """
+    Sends a message and returns a PendingRequest which tracks its answer
+
+    Any number of requests can be outstanding at once; replies and errors
+    are matched up with them by xid.  If callback is given, it's called
+    with the PendingRequest when it finishes.  The request times out
+    after timeout seconds (request_timeout if None, never if 0).
+
+    Messages the switch doesn't reply to (e.g., flow_mods) finish
+    successfully when a barrier requested after them is answered, or
+    fail if the switch sends back an error.
+    """
+    assert isinstance(msg, of.ofp_header)
+    if timeout is None: timeout = self.request_timeout
+    r = PendingRequest(self, msg, timeout)
+    if callback is not None: r.add_callback(callback)
+    if self.disconnected:
+      r._finish("disconnected")
+      return r
+    if r.xid in self._pending:
+      raise RuntimeError("Already waiting on xid %s" % (r.xid,))
+    self._request_count += 1
+    r._order = self._request_count
+    self._pending[r.xid] = r
+    if msg.header_type not in _reply_types:
+      self._unacked.append(r)
+    if r.expires_at is not None:
+      _schedule_timeout(r)
+    self.send(msg)
+    return r
+
+  def _forget_request (self, request):
+    if self._pending.get(request.xid) is request:
+      del self._pending[request.xid]
+    self._partial_stats.pop(request.xid, None)
+    self._forget_unacked(request)
+
+  def _forget_unacked (self, request):
+    """
+    Removes a request which finished some other way from _unacked
+    """
+    if request.request.header_type in _reply_types: return
+    unacked = self._unacked
+    # It's in order, so if it's older than the first one, it's gone
+    if not unacked or request._order < unacked[0]._order: return
+    if unacked[0] is request:
+      unacked.popleft() # Usually the oldest one is the one timing out
+    else:
+      try:
+        unacked.remove(request)
+      except ValueError:
+        pass
+
+  def _finish_request (self, msg, reply = None):
+    """
+    Finishes the pending request (if any) which msg answers
+
+    msg may be a reply or an error.  For stats, reply is the list of parts.
+    """
+    r = self._pending.pop(msg.xid, None)
+    if r is None: return
+    if msg.header_type == of.OFPT_ERROR:
+      self._forget_unacked(r)
+      r._finish("error", error = msg)
       return
-    try:
-      l = self.sock.send(data)
-      if l != len(data):
-        self.msg("Didn't send complete buffer.")
-        data = data[l:]
-        deferredSender.send(self, data)
-    except socket.error as (errno, strerror):
-      if errno == EAGAIN:
-        self.msg("Out of send buffer space.  " +
-                 "Consider increasing SO_SNDBUF.")
-        deferredSender.send(self, data)
+    if msg.header_type == of.OFPT_BARRIER_REPLY:
+      # Everything requested before the barrier has been done
+      unacked = self._unacked
+      while unacked and unacked[0]._order < r._order:
+        u = unacked.popleft()
+        if u.status is None:
+          self._forget_request(u)
+          u._finish("ok")
+    r._finish("ok", reply = msg if reply is None else reply)
+
+  def flush (self):
+    """
+    Sends as much queued data as the socket will take
+
+    Generally this is just called by the main OpenFlow loop below (or by
+    SendQueues).
+    Returns True if the queue is now empty.
+    """
+    with sendQueues.lock:
+      queue = self._send_queue
+      if not queue: return True
+      if len(queue) == 1:
+        count = 1
+        data = queue[0]
       else:
-        self.msg("Socket error: " + strerror)
-        self.disconnect(defer_event=True)
+        size = 0
+        count = 0
+        for d in queue:
+          size += len(d)
+          count += 1
+          if size >= _SEND_SIZE_MAX: break
+        data = b''.join(queue[:count])
+
+      try:
+        l = self.sock.send(data)
+      except socket.error as (errno, strerror):
+        if errno != EAGAIN:
+          self.msg("Socket error: " + strerror)
+          self.disconnect(defer_event=True)
+          return True
+        l = 0
+
+      if l == len(data):
+        del queue[:count]
+      else:
+        queue[:count] = [data[l:]]
+      self._send_queued -= l
+      empty = not queue
+
+      queued = self._send_queued
+      low = self.send_blocked and queued <= self.write_queue_low
+      if low: self.send_blocked = False
+
+    if low:
+      self.msg("Write queue low (%s bytes)" % (queued,))
+      self.ofnexus.raiseEventNoErrors(WriteQueueLow, self, queued)
+      self.raiseEventNoErrors(WriteQueueLow, self, queued)
+
+    return empty
+
+  def _make_room (self, size):
+    """
+    Makes sure there are at least size free bytes at the end of buf
+
+    Any partial message left over from the last read is moved to the front
+    (it's never more than one message), and buf is grown if that isn't
+    enough.
+    """
+    buf = self.buf
+    start = self._buf_start
+    end = self._buf_end
+    if start:
+      end -= start
+      buf[:end] = buf[start:start+end]
+      self._buf_start = 0
+      self._buf_end = end
+    if len(buf) - end < size:
+      self._view = None # Can't resize while there's a view
+      buf.extend(bytearray(end + size - len(buf)))
+      self._view = memoryview(buf)
 
   def read (self):
     """
     Read data from this connection.  Generally this is just called by the
     main OpenFlow loop below.
 
+    Data is received straight into buf, and the read size grows (up to
+    _READ_SIZE_MAX) while the socket keeps filling it.  All the complete
+    messages are then copied out at once and unpacked in place.
+
     Note: This function will block if data is not available.
     """
+    size = self._read_size
+    if len(self.buf) - self._buf_end < size:
+      self._make_room(size)
+    buf = self.buf
+    end = self._buf_end
     try:
-      d = self.sock.recv(2048)
+      n = self.sock.recv_into(self._view[end:end+size], size)
     except:
       return False
-    if len(d) == 0:
+    if n == 0:
       return False
-    self.buf += d
-    buf_len = len(self.buf)
-
-
-    offset = 0
-    while buf_len - offset >= 8: # 8 bytes is minimum OF message size
-      # We pull the first four bytes of the OpenFlow header off by hand
-      # (using ord) to find the version/length/type so that we can
-      # correctly call libopenflow to unpack it.
-
-      ofp_type = ord(self.buf[offset+1])
+    self._buf_end = end + n
+    if n == size:
+      if size < _READ_SIZE_MAX: self._read_size = size * 2
+    elif n < size // 4 and size > _READ_SIZE_MIN:
+      self._read_size = size // 2
+    return self._process()
+
+  def feed (self, data):
+    """
+    Handles data as if it had been read from the socket
 
-      if ord(self.buf[offset]) != of.OFP_VERSION:
-        if ofp_type == of.OFPT_HELLO:
+    This is for data which someone else read from the socket before
+    handing it to us.  Returns False if the connection should be closed.
+    """
+    if not data: return True
+    n = len(data)
+    self._make_room(n)
+    end = self._buf_end
+    self.buf[end:end+n] = data
+    self._buf_end = end + n
+    return self._process()
+
+  def _process (self):
+    """
+    Unpacks and handles the complete messages in buf
+    """
+    buf = self.buf
+    end = self._buf_end
+
+    # Find the complete messages.  We pull the first four bytes of the
+    # OpenFlow header off by hand to find the version/length/type so that
+    # we can correctly call libopenflow to unpack them.
+    start = self._buf_start
+    offset = start
+    good = True
+    msgs = [] # (type, end offset) for each message
+    while end - offset >= 8: # 8 bytes is minimum OF message size
+      if buf[offset] != of.OFP_VERSION:
+        if buf[offset+1] == of.OFPT_HELLO:
           # We let this through and hope the other side switches down.
           pass
         else:
           log.warning("Bad OpenFlow version (0x%02x) on connection %s"
-                      % (ord(self.buf[offset]), self))
-          return False # Throw connection away
+                      % (buf[offset], self))
+          good = False # Throw connection away (after handling the rest)
+          break
+
+      msg_length = buf[offset+2] << 8 | buf[offset+3]
+      if msg_length < 8:
+        log.warning("Bad OpenFlow message length (%s) on connection %s"
+                    % (msg_length, self))
+        good = False
+        break
+
+      if end - offset < msg_length: break
+      offset += msg_length
+      msgs.append((buf[offset-msg_length+1], offset - start))
 
-      msg_length = ord(self.buf[offset+2]) << 8 | ord(self.buf[offset+3])
+    if offset == start:
+      return good
 
-      if buf_len - offset < msg_length: break
+    data = self._view[start:offset].tobytes()
+    if offset == end:
+      self._buf_start = self._buf_end = 0
+    else:
+      self._buf_start = offset
 
-      new_offset,msg = unpackers[ofp_type](self.buf, offset)
-      assert new_offset - offset == msg_length
-      offset = new_offset
+    offset = 0
+    for ofp_type,msg_end in msgs:
+      offset,msg = unpackers[ofp_type](data, offset)
+      assert offset == msg_end
 
       try:
         h = handlers[ofp_type]
@@ -761,45 +1290,41 @@ class Connection (EventMixin):
                       ("\n" + str(self) + " ").join(str(msg).split('\n')))
         continue
 
-    if offset != 0:
-      self.buf = self.buf[offset:]
-
-    return True
+    return good
 
   def _incoming_stats_reply (self, ofp):
-    # This assumes that you don't receive multiple stats replies
-    # to different requests out of order/interspersed.
-    if not ofp.is_last_reply:
-      if ofp.type not in [of.OFPST_FLOW, of.OFPST_TABLE,
-                                of.OFPST_PORT, of.OFPST_QUEUE]:
+    # Parts of replies to different requests are kept apart by xid, so
+    # several can be outstanding at once.
+    if ofp.is_last_reply:
+      s = self._partial_stats.pop(ofp.xid, None)
+      if s is None:
+        s = [ofp]
+      elif s[0].type == ofp.type:
+        s.append(ofp)
+      else:
+        log.error("%s: Got stats of type %i with xid %i, but was expecting "
+                  "type %i", self, ofp.type, ofp.xid, s[0].type)
+        s = [ofp]
+    else:
+      if ofp.type not in _multipart_stats:
         log.error("Don't know how to aggregate stats message of type " +
                   str(ofp.type))
-        self._previous_stats = []
+        self._partial_stats.pop(ofp.xid, None)
         return
+      s = self._partial_stats.setdefault(ofp.xid, [])
+      if s and s[0].type != ofp.type:
+        log.error("%s: Got stats of type %i with xid %i, but was expecting "
+                  "type %i", self, ofp.type, ofp.xid, s[0].type)
+        del s[:]
+      s.append(ofp)
+      return
 
-    if len(self._previous_stats) != 0:
-      if ((ofp.xid == self._previous_stats[0].xid) and
-          (ofp.type == self._previous_stats[0].type)):
-        self._previous_stats.append(ofp)
-      else:
-        log.error("Was expecting continued stats of type %i with xid %i, " +
-                  "but got type %i with xid %i" %
-                  (self._previous_stats_reply.xid,
-                    self._previous_stats_reply.type,
-                    ofp.xid, ofp.type))
-        self._previous_stats = [ofp]
+    handler = statsHandlerMap.get(ofp.type, None)
+    if handler is None:
+      log.warn("No handler for stats of type " + str(ofp.type))
     else:
-      self._previous_stats = [ofp]
-
-    if ofp.is_last_reply:
-      handler = statsHandlerMap.get(self._previous_stats[0].type, None)
-      s = self._previous_stats
-      self._previous_stats = []
-      if handler is None:
-        log.warn("No handler for stats of type " +
-                 str(self._previous_stats[0].type))
-        return
       handler(self, s)
+    self._finish_request(ofp, s)
 
   def __str__ (self):
     #return "[Con " + str(self.ID) + "/" + str(self.dpid) + "]"
@@ -830,12 +1355,31 @@ from pox.lib.recoco.recoco import *
 class OpenFlow_01_Task (Task):
   """
   The main recoco thread for listening to openflow messages
+
+  If use_epoll is set, sockets are registered with an EpollPoller when they
+  are opened and we just Select() on the poller, so each wakeup only costs
+  something for the connections with data waiting (and we aren't limited
+  to select()'s 1024 descriptors).  Otherwise, we Select() on all of them
+  every time around.
+
+  Data sent on connections is queued (see SendQueues), and we flush it all
+  at the end of each trip around the loop.  Connections that couldn't send
+  it all are watched for writability until they catch up.
+
+  If port is None, we don't listen at all, and connections only come from
+  adopt() (this is how shard workers get their switches).
+
+  It runs at PRIORITY_HIGH so switch I/O isn't held up by bulk work.
   """
-  def __init__ (self, port = 6633, address = '0.0.0.0'):
+  priority = PRIORITY_HIGH
+
+  def __init__ (self, port = 6633, address = '0.0.0.0', use_epoll = False):
     Task.__init__(self)
-    self.port = int(port)
+    self.port = int(port) if port is not None else None
     self.address = address
+    self._adopted = [] # (socket, data) to turn into Connections
     self.started = False
+    self.use_epoll = use_epoll
 
     core.addListener(pox.core.GoingUpEvent, self._handle_GoingUpEvent)
 
@@ -848,37 +1392,100 @@ class OpenFlow_01_Task (Task):
     self.started = True
     return super(OpenFlow_01_Task,self).start()
 
+  def adopt (self, sock, data = b''):
+    """
+    Takes over a switch connection which someone else accepted
+
+    The switch should already have been sent a HELLO.  data is whatever
+    was already read from it, minus the switch's HELLO.
+    """
+    self._adopted.append((sock, data))
+    if sendQueues.waker is not None and not sendQueues.busy:
+      sendQueues.waker.ping()
+
   def run (self):
     # List of open sockets/connections to select on
     sockets = []
 
-    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    try:
-      listener.bind((self.address, self.port))
-    except socket.error as (errno, strerror):
-      log.error("Error %i while binding socket: %s", errno, strerror)
-      if errno == EADDRNOTAVAIL:
-        log.error(" You may be specifying a local address which is "
-                  "not assigned to any interface.")
-      elif errno == EADDRINUSE:
-        log.error(" You may have another controller running.")
-        log.error(" Use openflow.of_01 --port=<port> to run POX on "
-                  "another port.")
-      return
+    listener = None
+    if self.port is not None:
+      listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+      try:
+        listener.bind((self.address, self.port))
+      except socket.error as (errno, strerror):
+        log.error("Error %i while binding socket: %s", errno, strerror)
+        if errno == EADDRNOTAVAIL:
+          log.error(" You may be specifying a local address which is "
+                    "not assigned to any interface.")
+        elif errno == EADDRINUSE:
+          log.error(" You may have another controller running.")
+          log.error(" Use openflow.of_01 --port=<port> to run POX on "
+                    "another port.")
+        return
+
+      listener.listen(16)
 
-    listener.listen(16)
-    sockets.append(listener)
+    poller = EpollPoller() if self.use_epoll else None
 
-    log.debug("Listening on %s:%s" %
-              (self.address, self.port))
+    def add (con):
+      if poller is not None:
+        poller.add(con)
+      else:
+        sockets.append(con)
+
+    def remove (con):
+      writers.discard(con)
+      sendQueues.discard(con)
+      if poller is not None:
+        poller.remove(con)
+      else:
+        try:
+          sockets.remove(con)
+        except:
+          pass
+
+    # Connections which couldn't send everything and are waiting to be
+    # writable
+    writers = set()
+
+    def want_write (con, want):
+      if want:
+        if con in writers: return
+        writers.add(con)
+      else:
+        if con not in writers: return
+        writers.discard(con)
+      if poller is not None:
+        poller.want_write(con, want)
+
+    if listener is not None:
+      add(listener)
+
+    waker = pox.lib.util.makePinger()
+    add(waker)
+    sendQueues.waker = waker
+    sendQueues.scheduler = core.scheduler
+
+    if listener is not None:
+      log.debug("Listening on %s:%s%s" %
+                (self.address, self.port, " (epoll)" if poller else ""))
 
     con = None
     while core.running:
       try:
         while True:
           con = None
-          rlist, wlist, elist = yield Select(sockets, [], sockets, 5)
+          sendQueues.busy = False
+          # Don't wait if there's queued data we haven't flushed yet
+          timeout = 0 if sendQueues.pending or self._adopted else 5
+          if poller is None:
+            rlist, wlist, elist = yield Select(sockets, list(writers),
+                                               sockets, timeout)
+          else:
+            rlist, wlist, elist = yield Select([poller], [], [], timeout)
+            if rlist: rlist, wlist, elist = poller.poll()
+          sendQueues.busy = True
           if len(rlist) == 0 and len(wlist) == 0 and len(elist) == 0:
             if not core.running: break
 
@@ -886,18 +1493,17 @@ class OpenFlow_01_Task (Task):
             if con is listener:
               raise RuntimeError("Error on listener socket")
             else:
+              remove(con)
               try:
                 con.close()
               except:
                 pass
-              try:
-                sockets.remove(con)
-              except:
-                pass
 
           timestamp = time.time()
           for con in rlist:
-            if con is listener:
+            if con is waker:
+              waker.pongAll()
+            elif con is listener:
               new_sock = listener.accept()[0]
               if pox.openflow.debug.pcap_traces:
                 new_sock = wrap_socket(new_sock)
@@ -905,13 +1511,29 @@ class OpenFlow_01_Task (Task):
               # Note that instantiating a Connection object fires a
               # ConnectionUp event (after negotation has completed)
               newcon = Connection(new_sock)
-              sockets.append( newcon )
+              add(newcon)
               #print str(newcon) + " connected"
             else:
               con.idle_time = timestamp
               if con.read() is False:
+                remove(con)
                 con.close()
-                sockets.remove(con)
+
+          while self._adopted:
+            sock,data = self._adopted.pop(0)
+            con = Connection(sock, send_hello = False)
+            add(con)
+            if con.feed(data) is False:
+              remove(con)
+              con.close()
+
+          # Send whatever got queued (and whatever we can for connections
+          # which were waiting to be writable)
+          pending = sendQueues.take()
+          pending.update(wlist)
+          for con in pending:
+            if con.disconnected: continue
+            want_write(con, not con.flush())
       except exceptions.KeyboardInterrupt:
         break
       except:
@@ -924,18 +1546,19 @@ class OpenFlow_01_Task (Task):
         if doTraceback:
           log.exception("Exception reading connection " + str(con))
 
-        if con is listener:
+        if con is listener and listener is not None:
           log.error("Exception on OpenFlow listener.  Aborting.")
           break
+        remove(con)
         try:
           con.close()
         except:
           pass
-        try:
-          sockets.remove(con)
-        except:
-          pass
 
+    sendQueues.waker = None
+    sendQueues.scheduler = None
+    sendQueues.busy = False
+    if poller is not None: poller.close()
     log.debug("No longer listening for connections")
 
     #pox.core.quit()
@@ -950,18 +1573,70 @@ _set_handlers()
 
 
 # Used by the Connection class
-deferredSender = None
+sendQueues = SendQueues()
+
+def launch (port = 6633, address = "0.0.0.0", epoll = None,
+            write_queue_high = None, write_queue_low = None,
+            workers = None, master_only = None,
+            shard = None, shard_fds = None,
+            packet_in_rate = None, port_packet_in_rate = None,
+            packet_in_block = 5):
+  """
+  epoll selects whether to use epoll for connections (default: if we can)
+
+  write_queue_high and write_queue_low are the watermarks (in bytes) for
+  WriteQueueHigh and WriteQueueLow.
+
+  workers shards switches across that many worker processes (see
+  pox.openflow.shard).  master_only is a comma-separated list of components
+  which only the front end should run.  shard and shard_fds are set by the
+  front end for its workers.
 
-def launch (port = 6633, address = "0.0.0.0"):
+  packet_in_rate and port_packet_in_rate turn on admission control for
+  packet_ins: each switch (or each switch port) gets to send that many
+  per second, with bursts of up to a second's worth.  Ports which go
+  over have their excess traffic dropped at the switch for
+  packet_in_block seconds.  See PacketInAdmission.
+  """
   if core.hasComponent('of_01'):
     return None
 
-  global deferredSender
-  deferredSender = DeferredSender()
+  if write_queue_high is not None:
+    Connection.write_queue_high = int(write_queue_high)
+  if write_queue_low is not None:
+    Connection.write_queue_low = int(write_queue_low)
+
+  if epoll is None:
+    epoll = hasattr(select, 'epoll')
+  else:
+    epoll = str_to_bool(epoll)
 
   if of._logger is None:
     of._logger = core.getLogger('libopenflow_01')
 
-  l = OpenFlow_01_Task(port = int(port), address = address)
+  if packet_in_rate is not None or port_packet_in_rate is not None:
+    a = PacketInAdmission(
+        rate = float(packet_in_rate) if packet_in_rate else None,
+        port_rate = float(port_packet_in_rate) if port_packet_in_rate
+                    else None,
+        block_time = int(packet_in_block))
+    handlers[of.OFPT_PACKET_IN] = a.handle_PACKET_IN
+    core.register("openflow_admission", a)
+
+  if workers is not None:
+    from pox.openflow.shard import launch_front_end
+    master_only = master_only.split(",") if master_only else []
+    return launch_front_end(port = int(port), address = address,
+                            workers = int(workers),
+                            master_only = master_only)
+
+  if shard is not None:
+    from pox.openflow.shard import launch_worker
+    l = OpenFlow_01_Task(port = None, use_epoll = epoll)
+    core.register("of_01", l)
+    launch_worker(int(shard), [int(x) for x in shard_fds.split(",")], l)
+    return l
+
+  l = OpenFlow_01_Task(port = int(port), address = address, use_epoll = epoll)
   core.register("of_01", l)
   return l
@@ -0,0 +1,690 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sharding OpenFlow switches across worker processes
+
+All switches normally share one recoco scheduler, so a controller can only
+use one core.  With "openflow.of_01 --workers=N", the POX you start becomes
+a front end.  It starts N workers (copies of itself, with the same
+components) and accepts switch connections.  It does just enough of the
+handshake to learn each switch's DPID, and then passes the socket to
+worker DPID % N.  Each worker is a complete POX with its own scheduler, and
+only sees its own switches.
+
+Workers talk to each other through the front end.  Messages published with
+core.openflow_shard.publish() on one worker are raised as ShardMessage
+events on all the others.  Link events from openflow.discovery and host
+events from host_tracker are shared this way automatically (if those
+components are running), so every worker sees the whole topology.
+
+Components which should only run once (e.g., ones which listen on a port)
+can be left out of the workers with --master_only, e.g.:
+
+  ./pox.py openflow.of_01 --workers=4 --master_only=web.webcore \\
+      web.webcore openflow.discovery forwarding.l2_multi
+
+This needs Unix (it passes sockets between processes).
+"""
+
+import os
+import sys
+import time
+import errno
+import socket
+import struct
+import subprocess
+import cPickle as pickle
+
+from pox.core import core
+import pox
+import pox.openflow.libopenflow_01 as of
+from pox.lib.revent import EventMixin, Event
+from pox.lib.recoco import Task, Select, Timer, PRIORITY_HIGH
+from pox.lib.util import dpid_to_str, make_pinger
+
+try:
+  from _multiprocessing import sendfd, recvfd
+except ImportError:
+  sendfd = recvfd = None
+
+log = core.getLogger()
+
+_HEADER = struct.Struct("!L")
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+# Most queued data to join up for one send()
+_SEND_SIZE_MAX = 256 * 1024
+
+# Options of of_01's which are for the front end and not the workers
+_FRONT_END_OPTIONS = set(["port", "address", "workers", "master_only"])
+
+
+def pack_message (*msg):
+  """
+  Frames a message for a shard channel
+  """
+  data = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+  return _HEADER.pack(len(data)) + data
+
+
+class MessageReader (object):
+  """
+  Splits the stream from a shard channel back into messages
+  """
+  def __init__ (self):
+    self.buf = b''
+
+  def feed (self, data):
+    """
+    Returns a list of the complete (still pickled) messages
+    """
+    self.buf += data
+    out = []
+    offset = 0
+    while len(self.buf) - offset >= _HEADER.size:
+      n = _HEADER.unpack_from(self.buf, offset)[0]
+      end = offset + _HEADER.size + n
+      if len(self.buf) < end: break
+      out.append(self.buf[offset+_HEADER.size:end])
+      offset = end
+    if offset: self.buf = self.buf[offset:]
+    return out
+
+
+class MessageWriter (object):
+  """
+  Queues framed messages for a non-blocking shard channel
+
+  write() sends what it can right away; if the channel is full, the rest
+  waits for flush(), which should be called when the channel is writable
+  (i.e., while pending is true).  Both raise socket.error if the channel
+  is broken.
+  """
+  def __init__ (self, sock):
+    self.sock = sock
+    self.queue = []
+
+  @property
+  def pending (self):
+    return len(self.queue) != 0
+
+  def write (self, frame):
+    """
+    Returns True if it's all been sent
+    """
+    self.queue.append(frame)
+    return self.flush()
+
+  def flush (self):
+    """
+    Returns True if everything queued has been sent
+    """
+    queue = self.queue
+    while queue:
+      size = 0
+      count = 0
+      for d in queue:
+        size += len(d)
+        count += 1
+        if size >= _SEND_SIZE_MAX: break
+      data = queue[0] if count == 1 else b''.join(queue[:count])
+      try:
+        l = self.sock.send(data)
+      except socket.error as e:
+        if e.errno not in _WOULD_BLOCK: raise
+        l = 0
+      if l == len(data):
+        del queue[:count]
+      else:
+        queue[:count] = [data[l:]]
+        return False
+    return True
+
+
+def parse_handshake (data):
+  """
+  Looks for the switch's FEATURES_REPLY in the start of a connection
+
+  Returns (dpid, data), where data is everything the switch sent except
+  its HELLO, or None if the reply hasn't arrived yet.  Raises
+  RuntimeError if the switch is talking nonsense.
+  """
+  kept = []
+  offset = 0
+  while len(data) - offset >= 8:
+    version = ord(data[offset])
+    ofp_type = ord(data[offset+1])
+    length = struct.unpack_from("!H", data, offset+2)[0]
+    if version != of.OFP_VERSION and ofp_type != of.OFPT_HELLO:
+      raise RuntimeError("Bad OpenFlow version (0x%02x)" % (version,))
+    if length < 8:
+      raise RuntimeError("Bad OpenFlow message length (%s)" % (length,))
+    if len(data) - offset < length: break
+    if ofp_type == of.OFPT_FEATURES_REPLY:
+      if length < 16:
+        raise RuntimeError("Truncated features reply")
+      dpid = struct.unpack_from("!Q", data, offset+8)[0]
+      kept.append(data[offset:])
+      return dpid,b''.join(kept)
+    if ofp_type != of.OFPT_HELLO:
+      kept.append(data[offset:offset+length])
+    offset += length
+  return None
+
+
+def worker_argv (argv, index, fds, master_only = ()):
+  """
+  Works out a worker's commandline from the front end's
+
+  The worker gets the same components and options, except for the ones in
+  master_only.  of_01 loses its front end options and is told which shard
+  it is and which file descriptors are its channels to the front end.
+  """
+  out = []
+  skip = False
+  component = None
+  for arg in argv:
+    if not arg.startswith("-"):
+      component = arg.split(":", 1)[0]
+      skip = component in master_only
+      if skip: continue
+      out.append(arg)
+      if component == "openflow.of_01":
+        out.append("--shard=%s" % (index,))
+        out.append("--shard_fds=%s,%s" % tuple(fds))
+      continue
+    if skip: continue
+    if component == "openflow.of_01":
+      name = arg.lstrip("-").split("=", 1)[0].replace("-", "_")
+      if name in _FRONT_END_OPTIONS: continue
+    out.append(arg)
+  return out
+
+
+def _close_fds (keep):
+  """
+  Closes all file descriptors except stdio and the ones in keep
+  """
+  last = 3
+  for fd in sorted(keep):
+    os.closerange(last, fd)
+    last = fd + 1
+  os.closerange(last, os.sysconf("SC_OPEN_MAX"))
+
+
+def _socket_from_fd (fd, family):
+  s = socket.fromfd(fd, family, socket.SOCK_STREAM)
+  os.close(fd) # fromfd() dups it
+  return s
+
+
+class _Worker (object):
+  """
+  The front end's handle on one worker process
+  """
+  def __init__ (self, index, argv, master_only):
+    self.index = index
+    self.alive = True
+    self.reader = MessageReader()
+    self.channel,theirs = socket.socketpair()
+    self.fd_channel,their_fds = socket.socketpair()
+    fds = (theirs.fileno(), their_fds.fileno())
+    args = [sys.executable, os.path.abspath(sys.argv[0])]
+    args += worker_argv(argv, index, fds, master_only)
+    log.debug("Starting worker %s: %s", index, " ".join(args))
+    self.proc = subprocess.Popen(args, preexec_fn = lambda: _close_fds(fds))
+    theirs.close()
+    their_fds.close()
+
+    # A worker that's slow to read mustn't hold up the front end
+    self.channel.setblocking(0)
+    self.fd_channel.setblocking(0)
+    self.writer = MessageWriter(self.channel)
+    self.hand_offs = [] # (socket, frame) waiting for the fd channel
+
+  def fileno (self):
+    return self.channel.fileno()
+
+  def hand_off (self, sock, dpid, data):
+    """
+    Gives sock to the worker (once there's room); we close it after that
+    """
+    self.hand_offs.append((sock, pack_message("switch", dpid, data)))
+    self.flush()
+
+  def send (self, frame):
+    self.writer.write(frame)
+
+  def flush (self):
+    """
+    Sends what it can; raises socket.error if the worker is gone
+    """
+    while self.hand_offs:
+      sock,frame = self.hand_offs[0]
+      # The socket goes first, so it's there when the worker reads about it
+      try:
+        sendfd(self.fd_channel.fileno(), sock.fileno())
+      except (OSError, socket.error) as e:
+        if e.errno in _WOULD_BLOCK: break
+        raise socket.error(e.errno, e.strerror)
+      del self.hand_offs[0]
+      sock.close()
+      self.writer.write(frame)
+    self.writer.flush()
+
+  def wlist (self):
+    """
+    Returns the channels we're waiting to be able to write to
+    """
+    w = []
+    if self.writer.pending: w.append(self.channel)
+    if self.hand_offs: w.append(self.fd_channel)
+    return w
+
+  def close (self):
+    self.alive = False
+    for sock,frame in self.hand_offs:
+      sock.close()
+    del self.hand_offs[:]
+    for s in (self.channel, self.fd_channel):
+      try:
+        s.close()
+      except Exception:
+        pass
+
+
+class ShardFrontEnd (Task):
+  """
+  Accepts switch connections and hands them to shard workers
+
+  It also relays messages between the workers.
+  """
+  handshake_timeout = 30
+  priority = PRIORITY_HIGH
+
+  def __init__ (self, port = 6633, address = '0.0.0.0', workers = 2,
+                argv = None, master_only = ()):
+    Task.__init__(self)
+    self.port = int(port)
+    self.address = address
+    self.worker_count = workers
+    self.argv = sys.argv[1:] if argv is None else argv
+    self.master_only = set(master_only)
+    self.workers = []
+    self.started = False
+
+    core.addListener(pox.core.GoingUpEvent, self._handle_GoingUpEvent)
+    core.addListener(pox.core.GoingDownEvent, self._handle_GoingDownEvent)
+
+  def _handle_GoingUpEvent (self, event):
+    self.start()
+
+  def _handle_GoingDownEvent (self, event):
+    # Workers quit when they lose their channel
+    for w in self.workers:
+      w.close()
+
+  def start (self):
+    if self.started:
+      return
+    self.started = True
+    for i in range(self.worker_count):
+      self.workers.append(_Worker(i, self.argv, self.master_only))
+    return super(ShardFrontEnd,self).start()
+
+  def run (self):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+      listener.bind((self.address, self.port))
+    except socket.error as (errno, strerror):
+      log.error("Error %i while binding socket: %s", errno, strerror)
+      return
+    listener.listen(16)
+    log.debug("Listening on %s:%s for %s workers", self.address, self.port,
+              len(self.workers))
+
+    pending = {} # socket -> [data, time accepted]
+
+    while core.running:
+      workers = [w for w in self.workers if w.alive]
+      writers = {}
+      for w in workers:
+        for s in w.wlist():
+          writers[s] = w
+      rlist,wlist,elist = yield Select([listener] + pending.keys() + workers,
+                                       writers.keys(), [], 5)
+      for s in wlist:
+        w = writers[s]
+        if not w.alive: continue
+        try:
+          w.flush()
+        except socket.error:
+          log.error("Lost worker %s", w.index)
+          w.close()
+
+      for s in rlist:
+        if s is listener:
+          sock = listener.accept()[0]
+          try:
+            sock.sendall(of.ofp_hello().pack() +
+                         of.ofp_features_request().pack())
+            pending[sock] = [b'', time.time()]
+          except socket.error:
+            sock.close()
+        elif isinstance(s, _Worker):
+          if s.alive: self._relay(s)
+        else:
+          self._handshake(s, pending)
+
+      now = time.time()
+      for sock,(data,accepted) in pending.items():
+        if now - accepted > self.handshake_timeout:
+          log.warning("Switch didn't finish handshake; closing")
+          del pending[sock]
+          sock.close()
+
+    listener.close()
+
+  def _handshake (self, sock, pending):
+    try:
+      d = sock.recv(4096)
+    except socket.error:
+      d = b''
+    if not d:
+      del pending[sock]
+      sock.close()
+      return
+    entry = pending[sock]
+    entry[0] += d
+    try:
+      r = parse_handshake(entry[0])
+    except RuntimeError as e:
+      log.warning("Closing connection during handshake: %s", e)
+      r = False
+    if r is None: return
+    del pending[sock]
+    if r is False:
+      sock.close()
+      return
+
+    dpid,data = r
+    w = self.workers[dpid % len(self.workers)]
+    if w.alive:
+      log.debug("Handing %s to worker %s", dpid_to_str(dpid), w.index)
+      try:
+        w.hand_off(sock, dpid, data)
+      except socket.error:
+        log.error("Couldn't hand %s to worker %s", dpid_to_str(dpid),
+                  w.index)
+        w.close()
+    else:
+      log.error("Worker %s for %s is gone", w.index, dpid_to_str(dpid))
+      sock.close()
+
+  def _relay (self, worker):
+    try:
+      d = worker.channel.recv(65536)
+    except socket.error as e:
+      if e.errno in _WOULD_BLOCK: return
+      d = b''
+    if not d:
+      log.error("Lost worker %s", worker.index)
+      worker.close()
+      return
+    for msg in worker.reader.feed(d):
+      frame = _HEADER.pack(len(msg)) + msg
+      for w in self.workers:
+        if w is worker or not w.alive: continue
+        try:
+          w.send(frame)
+        except socket.error:
+          log.error("Lost worker %s", w.index)
+          w.close()
+
+
+class ShardMessage (Event):
+  """
+  Raised on core.openflow_shard for a message from another shard
+
+  name and data are as passed to publish(), and shard is the index of the
+  worker which published it.
+  """
+  def __init__ (self, name, data, shard):
+    Event.__init__(self)
+    self.name = name
+    self.data = data
+    self.shard = shard
+
+
+class _ShardChannelTask (Task):
+  priority = PRIORITY_HIGH
+
+  def __init__ (self, shard):
+    Task.__init__(self)
+    self.shard = shard
+
+  def run (self):
+    shard = self.shard
+    channel = shard._channel
+    writer = shard._writer
+    pinger = shard._pinger
+    reader = MessageReader()
+    while core.running:
+      rlist,wlist,elist = yield Select([channel, pinger],
+                                       [channel] if writer.pending else [],
+                                       [], 5)
+      if pinger in rlist:
+        pinger.pongAll()
+      try:
+        if wlist: writer.flush()
+      except socket.error:
+        log.error("Lost the shard front end")
+        core.quit()
+        return
+      if channel not in rlist: continue
+      try:
+        d = channel.recv(65536)
+      except socket.error as e:
+        if e.errno in _WOULD_BLOCK: continue
+        d = b''
+      if not d:
+        log.error("Lost the shard front end")
+        core.quit()
+        return
+      for msg in reader.feed(d):
+        shard._handle_message(pickle.loads(msg))
+
+
+class OpenFlowShard (EventMixin):
+  """
+  The worker end of a sharded controller (core.openflow_shard)
+
+  index is which worker this is.  Use publish() to send something to all
+  the other workers, and listen for ShardMessage to hear from them.
+  """
+  _eventMixin_events = set([ShardMessage])
+
+  def __init__ (self, index, channel_fd, fd_channel_fd, of_task):
+    self.index = index
+    self._channel = _socket_from_fd(channel_fd, socket.AF_UNIX)
+    self._fd_channel = _socket_from_fd(fd_channel_fd, socket.AF_UNIX)
+    self._channel.setblocking(0)
+    self._writer = MessageWriter(self._channel)
+    self._pinger = make_pinger() # Wakes the Task when publish() has to wait
+    self._of_task = of_task
+    self._task = _ShardChannelTask(self)
+
+    core.addListener(pox.core.GoingUpEvent, self._handle_GoingUpEvent)
+    core.call_when_ready(lambda: _DiscoveryBridge(self),
+                         "openflow_discovery", name = "discovery bridge")
+    core.call_when_ready(lambda: _HostTrackerBridge(self),
+                         "host_tracker", name = "host_tracker bridge")
+
+  def _handle_GoingUpEvent (self, event):
+    self._task.start()
+
+  def publish (self, name, data = None):
+    """
+    Sends data (which must be picklable) to the other shards
+
+    If the channel is full, the rest is sent by the channel Task.
+    """
+    waiting = self._writer.pending
+    frame = pack_message("message", name, data, self.index)
+    if not self._writer.write(frame) and not waiting:
+      self._pinger.ping()
+
+  def _handle_message (self, msg):
+    if msg[0] == "switch":
+      dpid,data = msg[1:]
+      fd = recvfd(self._fd_channel.fileno())
+      sock = _socket_from_fd(fd, socket.AF_INET)
+      sock.setblocking(0)
+      log.debug("Got %s from the front end", dpid_to_str(dpid))
+      self._of_task.adopt(sock, data)
+    elif msg[0] == "message":
+      name,data,shard = msg[1:]
+      self.raiseEventNoErrors(ShardMessage, name, data, shard)
+
+
+class _DiscoveryBridge (object):
+  """
+  Shares links found by openflow.discovery between shards
+
+  A link is only ever seen by the shard with the switch at its far end.
+  Other shards keep it until that shard says it's gone.
+  """
+  NAME = "openflow_discovery.link"
+
+  def __init__ (self, shard):
+    self.shard = shard
+    self._applying = False
+    core.openflow_discovery.addListenerByName("LinkEvent",
+                                              self._handle_LinkEvent)
+    shard.addListener(ShardMessage, self._handle_ShardMessage)
+
+  def _handle_LinkEvent (self, event):
+    if self._applying: return
+    self.shard.publish(self.NAME, (event.added, tuple(event.link)))
+
+  def _handle_ShardMessage (self, event):
+    if event.name != self.NAME: return
+    added,link = event.data
+    discovery = core.openflow_discovery
+    link = discovery.Link(*link)
+    self._applying = True
+    try:
+      if added:
+        if link not in discovery.adjacency:
+          # Never times out here
+          discovery.adjacency[link] = float("inf")
+          discovery.raiseEventNoErrors("LinkEvent", True, link)
+      elif link in discovery.adjacency:
+        discovery._delete_links([link])
+    finally:
+      self._applying = False
+
+
+class _HostTrackerBridge (object):
+  """
+  Shares hosts found by host_tracker between shards
+
+  A host belongs to the shard which last saw it.  Other shards keep an
+  entry for it (refreshed so it doesn't expire) until that shard says it
+  has left or another shard says it moved.
+  """
+  NAME = "host_tracker.host"
+
+  def __init__ (self, shard):
+    import pox.host_tracker.host_tracker as ht
+    self._ht = ht
+    self.shard = shard
+    self._applying = False
+    self.remote = set() # MACs of hosts other shards own
+    core.host_tracker.addListenerByName("HostEvent", self._handle_HostEvent)
+    shard.addListener(ShardMessage, self._handle_ShardMessage)
+    Timer(ht.timeoutSec['timerInterval'], self._refresh, recurring = True)
+
+  def _refresh (self):
+    entries = core.host_tracker.entryByMAC
+    for mac in list(self.remote):
+      entry = entries.get(mac)
+      if entry is None:
+        self.remote.discard(mac)
+      else:
+        entry.refresh()
+
+  def _handle_HostEvent (self, event):
+    if self._applying: return
+    entry = event.entry
+    if event.join:
+      kind,dpid,port = "join",entry.dpid,entry.port
+    elif event.leave:
+      kind,dpid,port = "leave",entry.dpid,entry.port
+    else:
+      kind,dpid,port = "move",event.new_dpid,event.new_port
+    self.remote.discard(entry.macaddr)
+    self.shard.publish(self.NAME, (kind, entry.macaddr, dpid, port))
+
+  def _handle_ShardMessage (self, event):
+    if event.name != self.NAME: return
+    kind,mac,dpid,port = event.data
+    tracker = core.host_tracker
+    entry = tracker.entryByMAC.get(mac)
+    self._applying = True
+    try:
+      if kind == "leave":
+        if entry is None: return
+        tracker.raiseEventNoErrors(self._ht.HostEvent, entry, leave = True)
+        del tracker.entryByMAC[mac]
+        self.remote.discard(mac)
+        return
+
+      if entry is None:
+        entry = self._ht.MacEntry(dpid, port, mac)
+        tracker.entryByMAC[mac] = entry
+        tracker.raiseEventNoErrors(self._ht.HostEvent, entry, join = True)
+      elif (entry.dpid, entry.port) != (dpid, port):
+        e = self._ht.HostEvent(entry, move = True, new_dpid = dpid,
+                               new_port = port)
+        tracker.raiseEventNoErrors(e)
+        entry.dpid = e._new_dpid
+        entry.port = e._new_port
+      # Its own shard pings it
+      entry.ipAddrs.clear()
+      self.remote.add(mac)
+    finally:
+      self._applying = False
+
+
+def launch_front_end (port, address, workers, master_only = ()):
+  """
+  Sets up this POX as the front end for workers workers
+  """
+  if sendfd is None:
+    raise RuntimeError("Sharding isn't supported on this platform")
+  fe = ShardFrontEnd(port = port, address = address, workers = workers,
+                     master_only = master_only)
+  core.register("of_01", fe)
+  return fe
+
+
+def launch_worker (index, fds, of_task):
+  """
+  Sets up this POX as a worker
+  """
+  channel_fd,fd_channel_fd = fds
+  core.register("openflow_shard", OpenFlowShard(index, channel_fd,
+                                                fd_channel_fd, of_task))
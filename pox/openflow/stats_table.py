@@ -0,0 +1,284 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Columnar flow and port stats using NumPy
+
+Unpacking a flow stats reply builds an ofp_flow_stats (with an ofp_match
+and actions) for every flow, which is slow and takes a lot of memory for
+switches with lots of flows.  The functions here decode the replies
+straight into NumPy structured arrays with one row per flow (or port),
+and there are vectorized helpers for the things monitoring and
+load-aware balancing usually want: the top N flows, rates between polls,
+and totals per prefix.
+
+FlowStatsReceived and PortStatsReceived have a .table attribute which
+calls flow_stats_table()/port_stats_table() for you.  That works any
+time, but it's much faster if the replies weren't unpacked into objects
+to begin with.  Launching this component arranges that:
+
+  ./pox.py openflow.stats_table ...
+
+Afterwards, event.stats still works (the objects are made when someone
+first asks for them), so other components won't notice.
+
+Flow tables don't include actions.  Addresses are kept as integers
+(IPv4 addresses in host order, like IPAddr.toUnsigned(); Ethernet
+addresses as 48-bit integers).
+
+This needs NumPy.
+"""
+
+import struct
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+
+log = core.getLogger()
+
+# Fixed part of an ofp_flow_stats on the wire (before the actions)
+_FLOW_HEAD_LEN = 88
+
+_LENGTH = struct.Struct("!H")
+
+if np is not None:
+  _FLOW_WIRE = np.dtype([
+    ('length', '>u2'), ('table_id', 'u1'), ('pad', 'u1'),
+    ('wildcards', '>u4'), ('in_port', '>u2'),
+    ('dl_src', 'V6'), ('dl_dst', 'V6'),
+    ('dl_vlan', '>u2'), ('dl_vlan_pcp', 'u1'), ('pad1', 'u1'),
+    ('dl_type', '>u2'), ('nw_tos', 'u1'), ('nw_proto', 'u1'),
+    ('pad2', '>u2'), ('nw_src', '>u4'), ('nw_dst', '>u4'),
+    ('tp_src', '>u2'), ('tp_dst', '>u2'),
+    ('duration_sec', '>u4'), ('duration_nsec', '>u4'),
+    ('priority', '>u2'), ('idle_timeout', '>u2'), ('hard_timeout', '>u2'),
+    ('pad3', 'V6'),
+    ('cookie', '>u8'), ('packet_count', '>u8'), ('byte_count', '>u8'),
+  ])
+  assert _FLOW_WIRE.itemsize == _FLOW_HEAD_LEN
+
+  # The rows of a flow stats table.  key identifies the flow (it's the
+  # packed match and priority) and is what rate_deltas() lines them up by.
+  FLOW_DTYPE = np.dtype([
+    ('key', 'S42'), ('table_id', 'u1'),
+    ('wildcards', 'u4'), ('in_port', 'u2'),
+    ('dl_src', 'u8'), ('dl_dst', 'u8'),
+    ('dl_vlan', 'u2'), ('dl_vlan_pcp', 'u1'), ('dl_type', 'u2'),
+    ('nw_tos', 'u1'), ('nw_proto', 'u1'),
+    ('nw_src', 'u4'), ('nw_dst', 'u4'),
+    ('tp_src', 'u2'), ('tp_dst', 'u2'),
+    ('duration', 'f8'), ('priority', 'u2'),
+    ('idle_timeout', 'u2'), ('hard_timeout', 'u2'),
+    ('cookie', 'u8'), ('packet_count', 'u8'), ('byte_count', 'u8'),
+  ])
+
+  _PORT_COUNTERS = ['rx_packets', 'tx_packets', 'rx_bytes', 'tx_bytes',
+                    'rx_dropped', 'tx_dropped', 'rx_errors', 'tx_errors',
+                    'rx_frame_err', 'rx_over_err', 'rx_crc_err',
+                    'collisions']
+
+  _PORT_WIRE = np.dtype([('port_no', '>u2'), ('pad', 'V6')]
+                        + [(n, '>u8') for n in _PORT_COUNTERS])
+  assert _PORT_WIRE.itemsize == len(of.ofp_port_stats)
+
+  # The rows of a port stats table (key is the port number)
+  PORT_DTYPE = np.dtype([('key', 'u2')] + [(n, 'u8') for n in _PORT_COUNTERS])
+
+
+def _check ():
+  if np is None:
+    raise RuntimeError("pox.openflow.stats_table requires NumPy")
+
+
+def _body_data (parts, stats_type):
+  """
+  Returns the packed bodies of a list of stats replies as one string
+  """
+  if isinstance(parts, of.ofp_stats_reply):
+    parts = [parts]
+  data = []
+  for part in parts:
+    if part.type != stats_type:
+      raise ValueError("not the right kind of stats reply")
+    body = part.body
+    if type(body) is bytes:
+      data.append(body)
+    else:
+      # Already unpacked; we have to pack it again
+      data.extend(b.pack() for b in body)
+  return b''.join(data)
+
+
+def _flow_offsets (data, buf):
+  """
+  Finds where each ofp_flow_stats in data starts
+  """
+  n = len(data)
+  if n == 0: return np.zeros(0, dtype=np.intp)
+
+  # Often they're all the same length (e.g., they all have one action)
+  first = _LENGTH.unpack_from(data)[0]
+  if first >= _FLOW_HEAD_LEN and n % first == 0:
+    offsets = np.arange(0, n, first)
+    lengths = (buf[offsets].astype(np.uint16) << 8) | buf[offsets + 1]
+    if (lengths == first).all():
+      return offsets
+
+  offsets = []
+  offset = 0
+  while offset < n:
+    offsets.append(offset)
+    length = _LENGTH.unpack_from(data, offset)[0]
+    if length < _FLOW_HEAD_LEN or offset + length > n:
+      raise of.UnderrunError("bad flow stats length")
+    offset += length
+  return np.array(offsets, dtype=np.intp)
+
+
+def _mac_to_int (heads, start):
+  mac = np.zeros((len(heads), 8), dtype=np.uint8)
+  mac[:,2:] = heads[:,start:start+6]
+  return mac.view('>u8').ravel()
+
+
+def flow_stats_table (parts):
+  """
+  Decodes flow stats replies into an array of FLOW_DTYPE
+
+  parts is an ofp_stats_reply or a list of them (e.g., a
+  FlowStatsReceived's .ofp).
+  """
+  _check()
+  data = _body_data(parts, of.OFPST_FLOW)
+  buf = np.frombuffer(data, dtype=np.uint8)
+  offsets = _flow_offsets(data, buf)
+  count = len(offsets)
+
+  # Gather the fixed part of each entry into one block
+  heads = buf[offsets[:,None] + np.arange(_FLOW_HEAD_LEN)]
+  wire = heads.view(_FLOW_WIRE).ravel()
+
+  table = np.zeros(count, dtype=FLOW_DTYPE)
+  key = np.concatenate((heads[:,4:44], heads[:,52:54]), axis=1)
+  table['key'] = np.ascontiguousarray(key).view('S42').ravel()
+  for name in FLOW_DTYPE.names:
+    if name in ('key', 'dl_src', 'dl_dst', 'duration'): continue
+    table[name] = wire[name]
+  table['dl_src'] = _mac_to_int(heads, 10)
+  table['dl_dst'] = _mac_to_int(heads, 16)
+  table['duration'] = wire['duration_sec'] + wire['duration_nsec'] * 1e-9
+  return table
+
+
+def port_stats_table (parts):
+  """
+  Decodes port stats replies into an array of PORT_DTYPE
+  """
+  _check()
+  data = _body_data(parts, of.OFPST_PORT)
+  if len(data) % _PORT_WIRE.itemsize:
+    raise of.UnderrunError("bad port stats length")
+  wire = np.frombuffer(data, dtype=_PORT_WIRE)
+  table = np.zeros(len(wire), dtype=PORT_DTYPE)
+  table['key'] = wire['port_no']
+  for name in _PORT_COUNTERS:
+    table[name] = wire[name]
+  return table
+
+
+def top_n (table, n, field = 'byte_count'):
+  """
+  Returns the n rows with the largest values of field, largest first
+  """
+  _check()
+  values = table[field]
+  if n < len(values):
+    idx = np.argpartition(values, len(values) - n)[-n:]
+  else:
+    idx = np.arange(len(values))
+  idx = idx[np.argsort(values[idx])[::-1]]
+  return table[idx]
+
+
+def rate_deltas (previous, current, field = 'byte_count', interval = None):
+  """
+  Returns per-second rates of field for each row of current
+
+  Rows are matched up with previous by key.  For flows, the time between
+  polls comes from their durations; rows that are new (or whose counters
+  went backwards, because the flow was replaced) get their average rate
+  since they were installed.  Port tables have no durations, so give the
+  time between polls as interval; new ports get a rate of zero.
+  """
+  _check()
+  count = current[field].astype(np.float64)
+  rates = np.zeros(len(current), dtype=np.float64)
+  if interval is None:
+    duration = current['duration']
+    nz = duration > 0
+    rates[nz] = count[nz] / duration[nz]
+
+  if len(previous) == 0 or len(current) == 0:
+    return rates
+
+  order = np.argsort(previous['key'], kind='mergesort')
+  keys = previous['key'][order]
+  pos = np.searchsorted(keys, current['key'])
+  pos[pos == len(keys)] = 0
+  found = keys[pos] == current['key']
+  prev = previous[order[pos[found]]]
+
+  delta = count[found] - prev[field].astype(np.float64)
+  if interval is None:
+    elapsed = current['duration'][found] - prev['duration']
+  else:
+    elapsed = np.empty(len(delta))
+    elapsed.fill(interval)
+  ok = (delta >= 0) & (elapsed > 0)
+  r = rates[found]
+  r[ok] = delta[ok] / elapsed[ok]
+  if interval is not None:
+    r[~ok] = 0
+  rates[found] = r
+  return rates
+
+
+def aggregate_by_prefix (table, prefix_len, address = 'nw_dst',
+                         field = 'byte_count'):
+  """
+  Totals field for each IPv4 prefix of the given length
+
+  Returns (prefixes, totals), where the prefixes are network addresses
+  as integers.  The sums are exact (done in uint64).
+  """
+  _check()
+  if not 0 <= prefix_len <= 32:
+    raise ValueError("bad prefix length")
+  mask = (0xffFFffFF << (32 - prefix_len)) & 0xffFFffFF
+  nets = table[address] & np.uint32(mask)
+  prefixes,inverse = np.unique(nets, return_inverse=True)
+  totals = np.zeros(len(prefixes), dtype=np.uint64)
+  np.add.at(totals, inverse, table[field].astype(np.uint64))
+  return prefixes,totals
+
+
+def launch ():
+  """
+  Leaves flow and port stats replies packed so .table is fast
+  """
+  _check()
+  of.ofp_stats_reply.raw_types.update([of.OFPST_FLOW, of.OFPST_PORT])
@@ -26,7 +26,7 @@ from copy import copy
 
 sys.path.append(os.path.dirname(__file__) + "/../../..")
 
-from pox.lib.epoll_select import EpollSelect
+from pox.lib.epoll_select import EpollSelect, EpollPoller
 
 class TCPEcho(SocketServer.StreamRequestHandler):
   def handle(self):
@@ -100,5 +100,53 @@ class EpollSelectTest(unittest.TestCase):
       check( ([],[],[]), self.es.select(sockets, [], sockets, 0))
       check( ([],sockets,[]), self.es.select(sockets, sockets, sockets, 0))
 
+@unittest.skipUnless(sys.platform.startswith("linux"), "requires Linux")
+class EpollPollerTest(unittest.TestCase):
+  def setUp(self):
+    self.poller = EpollPoller()
+
+  def tearDown(self):
+    self.poller.close()
+
+  def test_poll(self):
+    a1, b1 = socket.socketpair()
+    a2, b2 = socket.socketpair()
+    self.poller.add(a1)
+    self.poller.add(a2)
+    self.assertEqual(len(self.poller), 2)
+    self.assertEqual(([], [], []), self.poller.poll(0))
+    b2.send("x")
+    self.assertEqual(([a2], [], []), self.poller.poll(0.5))
+    # level triggered, so it's still ready until we read
+    self.assertEqual(([a2], [], []), self.poller.poll(0))
+    a2.recv(1)
+    self.assertEqual(([], [], []), self.poller.poll(0))
+
+  def test_remove(self):
+    a, b = socket.socketpair()
+    self.poller.add(a)
+    self.poller.remove(a)
+    self.poller.remove(a)
+    b.send("x")
+    self.assertEqual(([], [], []), self.poller.poll(0))
+    self.assertFalse(a in self.poller)
+
+  def test_hangup(self):
+    a, b = socket.socketpair()
+    self.poller.add(a)
+    b.close()
+    # readable (recv will return EOF)
+    self.assertEqual(([a], [], []), self.poller.poll(0.5))
+
+  def test_want_write(self):
+    a, b = socket.socketpair()
+    self.poller.add(a)
+    self.poller.want_write(a)
+    self.assertEqual(([], [a], []), self.poller.poll(0.5))
+    b.send("x")
+    self.assertEqual(([a], [a], []), self.poller.poll(0.5))
+    self.poller.want_write(a, False)
+    self.assertEqual(([a], [], []), self.poller.poll(0))
+
 if __name__ == '__main__':
   unittest.main()
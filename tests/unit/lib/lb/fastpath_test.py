@@ -0,0 +1,97 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../../..")
+
+from pox.lib.addresses import IPAddr, EthAddr
+from pox.lib.packet import ethernet, vlan, ipv4, tcp, udp, arp
+import pox.openflow.libopenflow_01 as of
+from pox.lib.lb.fastpath import *
+
+
+def _packet (proto = ipv4.TCP_PROTOCOL, vlan_id = None, options = b''):
+  if proto == ipv4.TCP_PROTOCOL:
+    l4 = tcp(srcport = 1234, dstport = 80)
+    l4.off = 5
+    l4.payload = b'hello'
+  else:
+    l4 = udp(srcport = 1234, dstport = 80)
+    l4.payload = b'hello'
+  ip = ipv4(srcip = IPAddr("192.168.0.1"), dstip = IPAddr("10.0.1.1"),
+            protocol = proto)
+  ip.tos = 8
+  ip.payload = l4
+  e = ethernet(src = EthAddr("00:00:00:00:00:01"),
+               dst = EthAddr("00:00:00:00:00:02"))
+  if vlan_id is None:
+    e.type = ethernet.IP_TYPE
+    e.payload = ip
+  else:
+    e.type = ethernet.VLAN_TYPE
+    v = vlan(id = vlan_id, pcp = 3)
+    v.eth_type = ethernet.IP_TYPE
+    v.payload = ip
+    e.payload = v
+  data = e.pack()
+  if options:
+    # Splice IP options in after the header
+    i = len(data) - len(ip.pack())
+    hdr = bytearray(data[i:i+20])
+    hdr[0] = 0x40 | ((20 + len(options)) // 4)
+    data = data[:i] + bytes(hdr) + options + data[i+20:]
+  return data
+
+
+class PeekTest (unittest.TestCase):
+  def _check (self, data):
+    h = peek_tcp(data)
+    self.assertTrue(h is not None)
+    expected = of.ofp_match.from_packet(ethernet(data), 3)
+    self.assertEqual(h.match(3), expected)
+    return h
+
+  def test_tcp (self):
+    h = self._check(_packet())
+    self.assertEqual((h.nw_src, h.nw_dst, h.tp_src, h.tp_dst),
+                     (IPAddr("192.168.0.1"), IPAddr("10.0.1.1"), 1234, 80))
+
+  def test_vlan (self):
+    h = self._check(_packet(vlan_id = 42))
+    self.assertEqual((h.dl_vlan, h.dl_vlan_pcp), (42, 3))
+
+  def test_ip_options (self):
+    h = peek_tcp(_packet(options = b'\x01\x01\x01\x00'))
+    self.assertEqual((h.tp_src, h.tp_dst), (1234, 80))
+
+  def test_not_tcp (self):
+    self.assertEqual(peek_tcp(_packet(proto = ipv4.UDP_PROTOCOL)), None)
+    a = arp(protosrc = IPAddr("10.0.0.1"), protodst = IPAddr("10.0.1.1"))
+    e = ethernet(type = ethernet.ARP_TYPE, payload = a)
+    self.assertEqual(peek_tcp(e.pack()), None)
+
+  def test_fragments (self):
+    data = bytearray(_packet())
+    data[14+6] = 0x20 # More fragments; the first one still has the ports
+    self.assertEqual(peek_tcp(bytes(data)).tp_dst, 80)
+    data[14+7] = 0xb9 # Offset 185 * 8
+    self.assertEqual(peek_tcp(bytes(data)), None)
+
+  def test_truncated (self):
+    data = _packet()
+    self.assertEqual(peek_tcp(data[:14 + 20 + 10]), None)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../../..")
+
+from pox.lib.lb.health import *
+
+
+class HealthTrackerTest (unittest.TestCase):
+  def test_hysteresis (self):
+    t = HealthTracker(rise = 2, fall = 3)
+    self.assertTrue(t.is_healthy('s'))
+    self.assertEqual(t.report('s', False), None)
+    self.assertEqual(t.report('s', False), None)
+    self.assertEqual(t.report('s', True), None) # Resets the streak
+    self.assertEqual(t.report('s', False), None)
+    self.assertEqual(t.report('s', False), None)
+    self.assertEqual(t.report('s', False), False)
+    self.assertFalse(t.is_healthy('s'))
+    self.assertEqual(t.report('s', False), None)
+    self.assertEqual(t.report('s', True), None)
+    self.assertEqual(t.report('s', True), True)
+    self.assertTrue(t.is_healthy('s'))
+
+  def test_parse_check (self):
+    self.assertEqual(parse_check("tcp:22"), ('tcp', 22, '/'))
+    self.assertEqual(parse_check("HTTP:8080/status"),
+                     ('http', 8080, '/status'))
+    self.assertEqual(parse_check("http"), ('http', 80, '/'))
+    self.assertRaises(RuntimeError, parse_check, "icmp")
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import time
+
+sys.path.append(os.path.dirname(__file__) + "/../../../..")
+
+from pox.lib.addresses import IPAddr
+from pox.lib.lb.memory import *
+
+SERVICE = IPAddr("10.0.1.1")
+SERVER = IPAddr("10.0.0.1")
+
+def _entry (i):
+  key = (IPAddr("192.168.0.%i" % (i+1)), SERVICE, 1024 + i, 80)
+  return MemoryEntry(SERVER, key, 1)
+
+
+class FlowMemoryTest (unittest.TestCase):
+  def test_keys (self):
+    m = FlowMemory(timeout = 10)
+    e = _entry(0)
+    m.add(e)
+    self.assertEqual(len(m), 1)
+    self.assertTrue(m.get(e.key1) is e)
+    self.assertTrue(m.get((SERVER, e.srcip, 80, 1024)) is e)
+
+  def test_replace (self):
+    m = FlowMemory(timeout = 10)
+    e1 = _entry(0)
+    e2 = _entry(0)
+    m.add(e1)
+    m.add(e2)
+    self.assertEqual(len(m), 1)
+    self.assertTrue(m.get(e1.key1) is e2)
+    self.assertEqual(m.server_counts, {SERVER:1})
+
+  def test_expire (self):
+    m = FlowMemory(timeout = 10)
+    entries = [_entry(i) for i in range(10)]
+    for e in entries: m.add(e)
+    now = time.time()
+    self.assertEqual(m.expire(now + 5), 0)
+    m.refresh(entries[0], now + 5)
+    self.assertEqual(m.expire(now + 12), 9)
+    self.assertEqual(len(m), 1)
+    self.assertTrue(entries[0].key1 in m)
+    self.assertEqual(m.expire(now + 30), 1)
+    self.assertEqual(len(m), 0)
+
+  def test_linger (self):
+    m = FlowMemory(timeout = 300)
+    e1 = _entry(0)
+    e2 = _entry(1)
+    m.add(e1)
+    m.add(e2)
+    now = time.time()
+    m.linger(e1, 5, now)
+    self.assertEqual(m.expire(now + 10), 1)
+    self.assertFalse(e1.key1 in m)
+    self.assertTrue(e2.key1 in m)
+    self.assertEqual(m.expire(now + 400), 1)
+    self.assertEqual(len(m), 0)
+
+  def test_linger_refresh (self):
+    m = FlowMemory(timeout = 300)
+    e = _entry(0)
+    m.add(e)
+    now = time.time()
+    m.linger(e, 5, now)
+    m.refresh(e, now + 2) # e.g., the last ACK
+    self.assertEqual(m.expire(now + 10), 1)
+    self.assertEqual(len(m), 0)
+
+  def test_remove (self):
+    m = FlowMemory(timeout = 10)
+    e = _entry(0)
+    m.add(e)
+    self.assertTrue(m.remove(e))
+    self.assertFalse(m.remove(e))
+    self.assertEqual(m.expire(time.time() + 30), 0)
+    self.assertFalse(e.key2 in m)
+    self.assertEqual(m.server_counts, {})
+
+if __name__ == '__main__':
+  unittest.main()
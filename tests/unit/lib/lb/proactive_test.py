@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../../..")
+
+from pox.lib.addresses import IPAddr
+from pox.lib.lb.proactive import *
+
+def _servers (n):
+  return [IPAddr("10.0.0.%i" % (i+1)) for i in range(n)]
+
+def _counts (buckets):
+  counts = {}
+  for s in buckets.assignment:
+    counts[s] = counts.get(s, 0) + 1
+  return counts
+
+
+class PrefixBucketsTest (unittest.TestCase):
+  def test_prefixes (self):
+    b = PrefixBuckets("10.1.0.0/16", 2)
+    self.assertEqual(len(b), 4)
+    self.assertEqual(b.prefix(0), (IPAddr("10.1.0.0"), 18))
+    self.assertEqual(b.prefix(3), (IPAddr("10.1.192.0"), 18))
+    self.assertRaises(RuntimeError, PrefixBuckets, "10.0.0.0/30", 3)
+
+  def test_weighted (self):
+    a,b_,c = _servers(3)
+    b = PrefixBuckets(bits = 4)
+    b.rebalance([a,b_,c], {a:2, b_:1, c:1})
+    self.assertEqual(_counts(b), {a:8, b_:4, c:4})
+
+  def test_minimal_churn (self):
+    servers = _servers(4)
+    b = PrefixBuckets(bits = 5)
+    b.rebalance(servers)
+    before = list(b.assignment)
+    changed = b.rebalance(servers[:3])
+    # Only the departed server's buckets move
+    self.assertEqual(sorted(changed),
+                     [i for i,s in enumerate(before) if s == servers[3]])
+    changed = b.rebalance(servers)
+    self.assertEqual(len(changed), 8)
+    self.assertEqual(b.rebalance(servers), [])
+
+  def test_no_servers (self):
+    b = PrefixBuckets(bits = 2)
+    b.rebalance(_servers(2))
+    self.assertEqual(len(b.rebalance([])), 4)
+    self.assertEqual(b.assignment, [None] * 4)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import copy
+
+sys.path.append(os.path.dirname(__file__) + "/../../../..")
+
+from pox.lib.addresses import IPAddr
+from pox.lib.lb.registry import *
+
+CONFIG = {
+  "services" : [
+    {"dpid" : "3", "vip" : "10.0.1.1", "port" : 80,
+     "servers" : ["10.0.0.1", "10.0.0.2"]},
+    {"dpid" : ["3", "4"], "vip" : "10.0.1.2",
+     "servers" : ["10.0.0.4", "10.0.0.5"], "selector" : "hash"},
+  ]
+}
+
+
+class ServiceRegistryTest (unittest.TestCase):
+  def test_lookup (self):
+    r = ServiceRegistry()
+    r.set_services(parse_services(CONFIG))
+    self.assertEqual(len(r.services), 3)
+    s = r.lookup(3, IPAddr("10.0.1.1"), 80)
+    self.assertEqual(s.servers, (IPAddr("10.0.0.1"), IPAddr("10.0.0.2")))
+    self.assertEqual(r.lookup(3, IPAddr("10.0.1.1"), 443), None)
+    self.assertEqual(r.lookup(4, IPAddr("10.0.1.1"), 80), None)
+    self.assertEqual(r.lookup(4, IPAddr("10.0.1.2"), 443).selector, "hash")
+    self.assertTrue(r.lookup_server(3, IPAddr("10.0.0.2"), 80) is s)
+    self.assertEqual(r.lookup_server(3, IPAddr("10.0.0.2"), 22), None)
+    self.assertEqual(len(r.services_for(3)), 2)
+
+  def test_changes (self):
+    r = ServiceRegistry()
+    events = []
+    r.addListener(ServicesChanged, events.append)
+    r.set_services(parse_services(CONFIG))
+    self.assertEqual(len(events[-1].added), 3)
+
+    config = copy.deepcopy(CONFIG)
+    config["services"][1]["dpid"] = "3"
+    r.set_services(parse_services(config))
+    self.assertEqual([str(s) for s in events[-1].removed],
+                     ["10.0.1.2@00-00-00-00-00-04"])
+    self.assertEqual(events[-1].added, [])
+
+    config["services"][0]["servers"] = ["10.0.0.1"]
+    r.set_services(parse_services(config))
+    self.assertEqual(len(events), 3)
+    self.assertEqual(events[-1].removed[0].servers,
+                     (IPAddr("10.0.0.1"), IPAddr("10.0.0.2")))
+    self.assertEqual(events[-1].added[0].servers, (IPAddr("10.0.0.1"),))
+
+  def test_overrides (self):
+    o = Service("3", "10.0.1.1", 80, ["10.0.0.9"])
+    r = ServiceRegistry(overrides = [o])
+    r.set_services(parse_services(CONFIG))
+    self.assertTrue(r.lookup(3, IPAddr("10.0.1.1"), 80) is o)
+    self.assertEqual(r.lookup_server(3, IPAddr("10.0.0.1"), 80), None)
+
+  def test_conflict (self):
+    config = {"services" : [
+      {"dpid" : "3", "vip" : "10.0.1.1", "servers" : ["10.0.0.1"]},
+      {"dpid" : "3", "vip" : "10.0.1.2", "servers" : ["10.0.0.1"]},
+    ]}
+    r = ServiceRegistry()
+    self.assertRaises(RuntimeError, r.set_services, parse_services(config))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../../..")
+
+from pox.lib.addresses import IPAddr
+from pox.lib.lb.selection import *
+
+SERVICE = IPAddr("10.0.1.1")
+
+def _servers (n):
+  return [IPAddr("10.0.0.%i" % (i+1)) for i in range(n)]
+
+def _keys (n):
+  return [(IPAddr("192.168.%i.%i" % (i // 250, i % 250 + 1)), SERVICE,
+           1024 + i, 80) for i in range(n)]
+
+
+class RoundRobinTest (unittest.TestCase):
+  def test_cycles (self):
+    s = RoundRobinSelector()
+    s.set_servers(_servers(3))
+    picks = [s.pick(None) for _ in range(6)]
+    self.assertEqual(picks, _servers(3) * 2)
+
+  def test_empty (self):
+    s = RoundRobinSelector()
+    self.assertEqual(s.pick(None), None)
+
+
+class WeightedRoundRobinTest (unittest.TestCase):
+  def test_proportional (self):
+    a,b,c = _servers(3)
+    s = WeightedRoundRobinSelector({a:5, b:1, c:1})
+    s.set_servers([a,b,c])
+    picks = [s.pick(None) for _ in range(7)]
+    self.assertEqual(picks.count(a), 5)
+    self.assertEqual(picks.count(b), 1)
+    # Smooth: the heavy server doesn't get one long run
+    self.assertNotEqual(picks[:5], [a] * 5)
+
+  def test_big_weights (self):
+    a,b = _servers(2)
+    s = WeightedRoundRobinSelector({a:1000003, b:999983}) # Coprime
+    s.set_servers([a,b])
+    picks = [s.pick(None) for _ in range(1000)]
+    self.assertTrue(490 <= picks.count(a) <= 510)
+
+  def test_runtime_weights (self):
+    a,b = _servers(2)
+    s = WeightedRoundRobinSelector()
+    s.set_servers([a,b])
+    self.assertEqual(set(s.pick(None) for _ in range(4)), set([a,b]))
+    s.set_weight(a, 0)
+    self.assertEqual(set(s.pick(None) for _ in range(4)), set([b]))
+    s.set_weight(b, 0)
+    self.assertEqual(s.pick(None), None)
+
+  def test_unweighted_selector (self):
+    self.assertRaises(RuntimeError, RoundRobinSelector().set_weight,
+                      IPAddr("10.0.0.1"), 2)
+
+
+class LeastLoadTest (unittest.TestCase):
+  def test_least_connections (self):
+    a,b,c = _servers(3)
+    s = LeastConnectionsSelector({c:0})
+    s.set_servers([a,b,c])
+    s.connections.update({a:3, b:1})
+    self.assertEqual(s.pick(None), b)
+    s.connections[b] = 5
+    self.assertEqual(s.pick(None), a)
+    s.set_weight(b, 4)
+    self.assertEqual(s.pick(None), b)
+
+  def test_least_load (self):
+    a,b = _servers(2)
+    s = LeastLoadSelector()
+    s.set_servers([a,b])
+    s.connections.update({a:1, b:1})
+    s.rates.update({a:1000, b:100000})
+    self.assertEqual(s.pick(None), a)
+    # New flows count against a server before the rates catch up
+    s.connections[a] = 200
+    self.assertEqual(s.pick(None), b)
+
+
+class MaglevTest (unittest.TestCase):
+  def test_stable (self):
+    a = MaglevSelector(table_size = 251)
+    b = MaglevSelector(table_size = 251)
+    a.set_servers(_servers(4))
+    b.set_servers(reversed(_servers(4)))
+    for k in _keys(500):
+      self.assertEqual(a.pick(k), b.pick(k))
+
+  def test_balanced (self):
+    s = MaglevSelector(table_size = 1009)
+    s.set_servers(_servers(4))
+    counts = {}
+    for k in _keys(4000):
+      server = s.pick(k)
+      counts[server] = counts.get(server, 0) + 1
+    self.assertEqual(len(counts), 4)
+    for c in counts.values():
+      self.assertTrue(700 < c < 1300, counts)
+
+  def test_minimal_disruption (self):
+    s = MaglevSelector(table_size = 1009)
+    servers = _servers(5)
+    s.set_servers(servers)
+    keys = _keys(4000)
+    before = [s.pick(k) for k in keys]
+    s.set_servers(servers[:-1])
+    moved = 0
+    for k,old in zip(keys, before):
+      new = s.pick(k)
+      if old == servers[-1]:
+        self.assertNotEqual(new, old)
+      elif new != old:
+        moved += 1
+    # Flows on surviving servers should mostly stay put
+    self.assertTrue(moved < len(keys) * 0.1, moved)
+
+  def test_make_selector (self):
+    self.assertTrue(isinstance(make_selector('hash'), MaglevSelector))
+    self.assertRaises(RuntimeError, make_selector, 'bogus')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,130 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import socket
+import threading
+import time
+sys.path.append(os.path.dirname(__file__) + "/../../../..")
+
+from pox.lib.recoco import Task, Select, Recv, Send, Sleep, Timer
+from pox.lib.recoco import Coroutine, Return
+from pox.lib.recoco.loop import SelectLoop
+
+
+class _LoopTest (object):
+  use_epoll = True
+
+  def setUp (self):
+    self.sched = SelectLoop(isDefaultScheduler = False, daemon = True,
+                            useEpoll = self.use_epoll)
+    self.done = threading.Event()
+    self.socks = socket.socketpair()
+
+  def tearDown (self):
+    self.sched.quit()
+    for s in self.socks:
+      s.close()
+
+  def _wait (self):
+    self.assertTrue(self.done.wait(5))
+
+  def test_echo (self):
+    a,b = self.socks
+    got = []
+    def echo ():
+      d = yield Recv(b)
+      yield Send(b, d.upper())
+    def client ():
+      yield Send(a, b'hello')
+      rv = yield Select([a], [], [], 5)
+      got.append((rv[0], a.recv(100)))
+      self.done.set()
+    Coroutine(echo()).start(self.sched)
+    Coroutine(client()).start(self.sched)
+    self._wait()
+    self.assertEqual(got, [([a], b'HELLO')])
+    self.assertEqual(self.sched._selectHub._readers, {})
+
+  def test_shared_fd (self):
+    # Two Tasks waiting on the same socket both get woken
+    a,b = self.socks
+    got = []
+    def reader (name, timeout):
+      rv = yield Select([b], [], [], timeout)
+      got.append((name, rv[0]))
+      if len(got) == 2: self.done.set()
+    Coroutine(reader("first", 5)).start(self.sched)
+    Coroutine(reader("second", 5)).start(self.sched)
+    time.sleep(0.05)
+    a.send(b'x')
+    self._wait()
+    self.assertEqual(sorted(got), [("first", [b]), ("second", [b])])
+    self.assertEqual(self.sched._selectHub._readers, {})
+
+  def test_timeout (self):
+    a,b = self.socks
+    got = []
+    class Waiter (Task):
+      def run (s):
+        start = time.time()
+        rv = yield Select([a], [], [], 0.05)
+        got.append((rv, time.time() - start))
+        yield Sleep(0.01)
+        self.done.set()
+    Waiter().start(self.sched)
+    self._wait()
+    self.assertEqual(got[0][0], ([],[],[]))
+    self.assertTrue(got[0][1] >= 0.05)
+
+  def test_other_thread (self):
+    # Timers and Tasks started from another thread wake the loop
+    a,b = self.socks
+    got = []
+    def reader ():
+      yield Select([b], [], [])
+      got.append(b.recv(10))
+    Timer(0.02, lambda: self.done.set(), scheduler = self.sched)
+    Coroutine(reader()).start(self.sched)
+    time.sleep(0.05)
+    a.send(b'x')
+    self._wait()
+    time.sleep(0.05)
+    self.assertEqual(got, [b'x'])
+
+  def test_closed (self):
+    a,b = self.socks
+    got = []
+    def reader ():
+      rv = yield Select([b.fileno()], [], [b.fileno()], 5)
+      got.append(rv)
+      self.done.set()
+    fd = os.dup(b.fileno())
+    Coroutine(reader()).start(self.sched)
+    time.sleep(0.05)
+    a.close()
+    self._wait()
+    os.close(fd)
+    self.assertTrue(got[0][0] or got[0][2])
+
+
+class EpollLoopTest (_LoopTest, unittest.TestCase):
+  pass
+
+
+class SelectLoopTest (_LoopTest, unittest.TestCase):
+  use_epoll = False
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,234 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import threading
+import time
+sys.path.append(os.path.dirname(__file__) + "/../../../..")
+
+from pox.lib.recoco import Scheduler, Task, Timer, Sleep, ReadyQueue
+from pox.lib.recoco import Coroutine, Return
+from pox.lib.recoco import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+
+def _scheduler (**kw):
+  return Scheduler(isDefaultScheduler = False, daemon = True, **kw)
+
+
+class TimerQueueTest (unittest.TestCase):
+  def setUp (self):
+    self.sched = _scheduler(startInThread = False)
+    self.timers = self.sched.timers
+    self.calls = []
+
+  def tearDown (self):
+    self.sched.quit()
+
+  def _add (self, when, name):
+    return self.timers.add(when, self.calls.append, (name,))
+
+  def test_order (self):
+    for when,name in [(30, 'c'), (10, 'a'), (20, 'b'), (20, 'b2')]:
+      self._add(when, name)
+    self.assertAlmostEqual(self.timers.next_time(), 10)
+    self.assertEqual(self.timers.run(now = 5), 0)
+    self.assertEqual(self.timers.run(now = 25), 3)
+    self.assertEqual(self.calls, ['a', 'b', 'b2'])
+    self.timers.run(now = 30)
+    self.assertEqual(self.calls, ['a', 'b', 'b2', 'c'])
+    self.assertEqual(len(self.timers), 0)
+
+  def test_coalesce (self):
+    tick = self.timers.RESOLUTION
+    self._add(10 + tick * 0.1, 'a')
+    self._add(10 + tick * 0.6, 'b')
+    self._add(10 + tick * 1.5, 'c')
+    # The scheduler wakes once for the first two...
+    wake = self.timers.next_time()
+    self.assertAlmostEqual(wake, 10 + tick)
+    self.timers.run(now = wake)
+    self.assertEqual(self.calls, ['a', 'b'])
+    # ...but nothing runs early
+    self.assertEqual(self.timers.run(now = 10 + tick * 1.4), 0)
+
+  def test_cancel (self):
+    entries = [self._add(i, i) for i in range(200)]
+    for e in entries[:150]:
+      self.timers.cancel(e)
+    self.timers.cancel(entries[0]) # Twice is fine
+    self.assertEqual(len(self.timers), 50)
+    self.assertTrue(len(self.timers._heap) < 200) # Cleaned up
+    self.assertAlmostEqual(self.timers.next_time(), 150)
+
+    self.timers.run(now = 1000)
+    self.assertEqual(self.calls, range(150, 200))
+    self.assertEqual(len(self.timers), 0)
+
+    # A call can cancel one that's due in the same batch
+    self.timers.add(2000, lambda: self.timers.cancel(later))
+    later = self._add(2000, 'later')
+    self.timers.run(now = 2000)
+    self.assertEqual(self.calls[-1], 199)
+    self.assertEqual(len(self.timers), 0)
+
+  def test_timer (self):
+    t = Timer(5, self.calls.append, absoluteTime = True, args = ('t',),
+              scheduler = self.sched)
+    t2 = Timer(6, self.calls.append, absoluteTime = True, args = ('t2',),
+               scheduler = self.sched)
+    t2.cancel()
+    self.timers.run(now = 10)
+    self.assertEqual(self.calls, ['t'])
+
+    t3 = Timer(5, self.calls.append, absoluteTime = True, args = ('t3',),
+               scheduler = self.sched, started = False)
+    self.assertEqual(len(self.timers), 0)
+    t3.start(self.sched)
+    self.timers.run(now = 10)
+    self.assertEqual(self.calls, ['t', 't3'])
+
+
+class SchedulerTimerTest (unittest.TestCase):
+  def setUp (self):
+    self.sched = _scheduler()
+    self.done = threading.Event()
+
+  def tearDown (self):
+    self.sched.quit()
+    self.sched._event.set()
+
+  def test_recurring (self):
+    calls = []
+    def tick ():
+      calls.append(time.time())
+      if len(calls) == 3:
+        self.done.set()
+        return False # Stop
+    Timer(0.01, tick, recurring = True, scheduler = self.sched)
+    self.done.wait(5)
+    time.sleep(0.05)
+    self.assertEqual(len(calls), 3)
+    self.assertEqual(len(self.sched.timers), 0)
+
+  def test_sleep (self):
+    woke = []
+    class Sleeper (Task):
+      def run (s):
+        start = time.time()
+        rv = yield Sleep(0.02)
+        woke.append((time.time() - start, rv))
+        rv = yield 0.02 # Numbers mean sleep too
+        woke.append((time.time() - start, rv))
+        self.done.set()
+    Sleeper().start(self.sched)
+    self.done.wait(5)
+    self.assertEqual(len(woke), 2)
+    self.assertTrue(woke[0][0] >= 0.02 and woke[1][0] >= 0.04)
+    self.assertEqual(woke[0][1], ([],[],[]))
+
+
+class _Named (object):
+  def __init__ (self, name, priority):
+    self.name = name
+    self.priority = priority
+
+  def __repr__ (self):
+    return self.name
+
+
+class ReadyQueueTest (unittest.TestCase):
+  def test_strict (self):
+    q = ReadyQueue()
+    for name,p in [('n1', PRIORITY_NORMAL), ('l1', PRIORITY_LOW),
+                   ('h1', PRIORITY_HIGH), ('n2', 1.5), ('h2', 3)]:
+      q.append(_Named(name, p))
+    q.appendleft(_Named('n0', PRIORITY_NORMAL))
+    self.assertEqual(len(q), 6)
+    order = [q.popleft().name for i in range(6)]
+    self.assertEqual(order, ['h1', 'h2', 'n0', 'n1', 'n2', 'l1'])
+    self.assertRaises(IndexError, q.popleft)
+
+  def test_aging (self):
+    q = ReadyQueue()
+    low = _Named('low', PRIORITY_LOW)
+    high = _Named('high', PRIORITY_HIGH)
+    q.append(low)
+    order = []
+    for i in range(20):
+      q.append(high)
+      t = q.popleft()
+      order.append(t)
+      if t is low: break
+    # The low task gets its turn after being passed over AGE_LIMIT times
+    self.assertEqual(len(order), q.AGE_LIMIT)
+    self.assertTrue(low not in q and high in q)
+
+
+class SchedulerPriorityTest (unittest.TestCase):
+  def setUp (self):
+    self.sched = _scheduler(startInThread = False)
+
+  def tearDown (self):
+    self.sched.quit()
+
+  def test_preempt (self):
+    ran = []
+    class Spinner (Task):
+      def run (s):
+        while True:
+          ran.append(s.name)
+          time.sleep(0.001)
+          yield 0
+    bulk = Spinner(name = 'bulk')
+    bulk.priority = PRIORITY_LOW
+    io = Spinner(name = 'io')
+    io.priority = PRIORITY_HIGH
+    bulk.start(self.sched, fast = True)
+    io.start(self.sched, fast = True)
+    for i in range(80):
+      self.sched.cycle()
+    self.assertEqual(ran.count('bulk'), 80 // ReadyQueue.AGE_LIMIT)
+    self.assertEqual(io.slices, 80 - ran.count('bulk'))
+    self.assertTrue(io.cpu_time >= io.slices * 0.001)
+    self.assertTrue(bulk.cpu_time < io.cpu_time)
+
+class CoroutineTest (unittest.TestCase):
+  def test_calls (self):
+    sched = _scheduler(startInThread = False)
+    log = []
+    def add (a, b):
+      yield 0
+      raise Return(a + b)
+    def fail ():
+      yield 0
+      raise ValueError("oops")
+    def nothing ():
+      yield 0
+    def main ():
+      log.append((yield add(1, 2)))
+      log.append((yield nothing()))
+      try:
+        yield fail()
+      except ValueError as e:
+        log.append(str(e))
+      log.append((yield add((yield add(1, 1)), 3)))
+    c = Coroutine(main())
+    c.start(sched, fast = True)
+    while sched.cycle(): pass
+    sched.quit()
+    self.assertEqual(log, [3, None, "oops", 5])
+    self.assertEqual(str(c), "<Coroutine/main>")
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,103 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../../..")
+
+from pox.lib.revent import *
+
+
+class Ping (Event):
+  made = 0
+  def __init__ (self, n = 0):
+    Event.__init__(self)
+    Ping.made += 1
+    self.n = n
+
+
+class Extra (Event):
+  def _invoke (self, handler, *args, **kw):
+    return handler(self, "extra", *args, **kw)
+
+
+class Other (Event):
+  pass
+
+
+class Source (EventMixin):
+  _eventMixin_events = set([Ping, Extra])
+
+
+class DispatchTest (unittest.TestCase):
+  def setUp (self):
+    self.s = Source()
+    self.log = []
+
+  def test_early_out (self):
+    Ping.made = 0
+    self.assertEqual(self.s.raiseEvent(Ping, 1), None)
+    self.assertEqual(Ping.made, 0)
+    eid = self.s.addListener(Ping, lambda e: self.log.append(e.n))
+    e = self.s.raiseEvent(Ping, 2)
+    self.assertEqual((Ping.made, e.source, self.log), (1, self.s, [2]))
+    self.s.removeListener(eid)
+    self.assertEqual(self.s.raiseEvent(Ping, 3), None)
+    self.assertEqual(Ping.made, 1)
+
+  def test_undefined (self):
+    self.assertEqual(self.s.raiseEvent(Other), None)
+    self.assertRaises(RuntimeError, self.s.raiseEvent, Other())
+
+  def test_returns (self):
+    s = self.s
+    log = self.log
+    s.addListener(Ping, lambda e: log.append('a'))
+    s.addListener(Ping, lambda e: log.append('once'), once = True)
+    s.addListener(Ping, lambda e: (log.append('rm'), EventRemove)[1])
+    s.addListener(Ping, lambda e: (log.append('halt'), e.n == 1)[1])
+    s.addListener(Ping, lambda e: log.append('z'))
+    s.raiseEvent(Ping, 1)
+    self.assertEqual(log, ['a', 'once', 'rm', 'halt'])
+    del log[:]
+    e = s.raiseEvent(Ping(2))
+    self.assertEqual(log, ['a', 'halt', 'z'])
+    self.assertFalse(e.halt)
+
+  def test_changes_during_raise (self):
+    # Listeners added while handling an event are called next time
+    s = self.s
+    def add (e):
+      s.addListener(Ping, lambda e: self.log.append('new'))
+      self.log.append('add')
+      return EventRemove
+    s.addListener(Ping, add, priority = 1)
+    s.raiseEvent(Ping)
+    s.raiseEvent(Ping)
+    self.assertEqual(self.log, ['add', 'new'])
+
+  def test_invoke (self):
+    self.s.addListener(Extra, lambda e, x, y = None: self.log.append((x, y)))
+    self.s.raiseEvent(Extra)
+    self.s.raiseEventNoErrors(Extra(), y = 2)
+    self.assertEqual(self.log, [("extra", None), ("extra", 2)])
+
+  def test_clear (self):
+    self.s.addListener(Ping, lambda e: self.log.append(1))
+    self.s.raiseEvent(Ping)
+    self.s.clearHandlers()
+    self.assertEqual(self.s.raiseEvent(Ping), None)
+    self.assertEqual(self.log, [1])
+
+if __name__ == '__main__':
+  unittest.main()
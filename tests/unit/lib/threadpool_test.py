@@ -0,0 +1,106 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import threading
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.lib.threadpool import *
+from pox.lib.recoco import Scheduler, Task, BlockingTask
+
+
+def _fail ():
+  raise ValueError("nope")
+
+
+class ThreadPoolTest (unittest.TestCase):
+  def setUp (self):
+    self.sched = Scheduler(isDefaultScheduler = False, daemon = True)
+    self.pool = ThreadPool(max_workers = 2, max_queue = 2,
+                           scheduler = self.sched)
+    self.done = threading.Event()
+
+  def tearDown (self):
+    self.pool.shutdown()
+    self.sched.quit()
+
+  def test_results (self):
+    f = self.pool.submit(pow, 2, 10)
+    self.assertEqual(f.result(5), 1024)
+    self.assertTrue(f.done() and not f.cancelled())
+    f = self.pool.submit(_fail)
+    self.assertRaises(ValueError, f.result, 5)
+    self.assertEqual(str(f.exception()), "nope")
+    s = self.pool.stats()
+    self.assertEqual((s['submitted'], s['completed'], s['failed']), (2, 1, 1))
+
+  def test_task (self):
+    got = []
+    pool = self.pool
+    class Cruncher (Task):
+      def run (s):
+        f = yield pool.submit(sum, range(100))
+        got.append((f.result(), threading.current_thread()))
+        f = yield pool.submit(_fail)
+        got.append(type(f.exception()))
+        self.done.set()
+    Cruncher().start(self.sched)
+    self.assertTrue(self.done.wait(5))
+    self.assertEqual(got, [(4950, self.sched._thread), ValueError])
+
+  def test_callback (self):
+    got = []
+    def cb (f):
+      got.append((f.result(), threading.current_thread()))
+      self.done.set()
+    gate = threading.Event()
+    f = self.pool.submit(lambda: gate.wait(5) and 5)
+    f.add_done_callback(cb)
+    gate.set()
+    self.assertTrue(self.done.wait(5))
+    self.assertEqual(got, [(5, self.sched._thread)])
+
+  def test_bounds (self):
+    gate = threading.Event()
+    pool = self.pool
+    running = [pool.submit(gate.wait, 5) for i in range(2)]
+    while pool.stats()['queued']: pass # Wait until they're started
+    queued = [pool.submit(len, 'x') for i in range(2)]
+    self.assertRaises(PoolFull, pool.submit, len, 'y')
+    self.assertTrue(queued[1].cancel())
+    self.assertFalse(running[0].cancel())
+    gate.set()
+    self.assertEqual(queued[0].result(5), 1)
+    self.assertRaises(CancelledError, queued[1].result)
+    pool.join()
+    s = pool.stats()
+    self.assertEqual((s['workers'], s['rejected'], s['cancelled'],
+                      s['completed']), (2, 1, 1, 3))
+
+  def test_reuse (self):
+    for i in range(10):
+      self.pool.submit(len, 'x').result(5)
+    self.assertEqual(self.pool.stats()['workers'], 1)
+
+  def test_blocking_task (self):
+    got = []
+    def cb (rv, exc):
+      got.append(rv)
+      self.done.set()
+    BlockingTask(pow, cb, (3, 2)).start(self.sched)
+    self.assertTrue(self.done.wait(5))
+    self.assertEqual(got, [9])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,204 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import time
+top = os.path.dirname(__file__) + "/../../.."
+sys.path.append(top)
+sys.path.append(top + "/mylb")
+sys.path.append(top + "/pox") # For proto.arp_responder
+
+from pox.lib.addresses import IPAddr, EthAddr
+from pox.lib.packet import ethernet, ipv4, tcp
+import pox.openflow.libopenflow_01 as of
+from pox.lib.lb.fastpath import peek_tcp
+from pox.lib.lb import ServerDrained
+from pox.lib.lb.selection import RandomSelector
+
+import lbcode
+import lbcode_dynamic
+import lbcode_multi
+
+VIP = IPAddr("10.0.1.1")
+SERVERS = [IPAddr("10.0.0.1"), IPAddr("10.0.0.2")]
+
+
+class FakeConnection (object):
+  eth_addr = EthAddr("00:00:00:00:00:fe")
+  dpid = 1
+
+  def __init__ (self):
+    self.sent = []
+    self.requests = []
+
+  def send (self, msg):
+    self.sent.append(msg)
+
+  def request (self, msg, callback = None, timeout = None):
+    r = FakeRequest(msg, callback)
+    self.requests.append(r)
+    return r
+
+
+class FakeRequest (object):
+  def __init__ (self, msg, callback):
+    self.request = msg
+    self.callback = callback
+    self.done = False
+
+  def answer (self, flows):
+    self.done = True
+    self.ok = True
+    self.body = flows
+    self.callback(self)
+
+
+class FakePacketIn (object):
+  def __init__ (self, data, port = 1):
+    self.data = data
+    self.port = port
+    self.ofp = of.ofp_packet_in(in_port = port, buffer_id = 5, data = data)
+
+
+def _flow (server, to_server = True):
+  """
+  Returns flow stats for a per-flow rule like the balancers install
+  """
+  f = of.ofp_flow_stats(idle_timeout = 10)
+  if to_server:
+    f.match = of.ofp_match(nw_src = IPAddr("192.168.0.1"), nw_dst = VIP)
+    f.actions.append(of.ofp_action_nw_addr.set_dst(server))
+  else:
+    f.match = of.ofp_match(nw_src = server, nw_dst = IPAddr("192.168.0.1"))
+    f.actions.append(of.ofp_action_nw_addr.set_src(VIP))
+  f.actions.append(of.ofp_action_output(port = 1))
+  return f
+
+
+def _syn (srcport = 1234):
+  t = tcp(srcport = srcport, dstport = 80)
+  t.off = 5
+  ip = ipv4(srcip = IPAddr("192.168.0.1"), dstip = VIP,
+            protocol = ipv4.TCP_PROTOCOL, payload = t)
+  e = ethernet(src = EthAddr("00:00:00:00:00:01"),
+               dst = FakeConnection.eth_addr, type = ethernet.IP_TYPE,
+               payload = ip)
+  return e.pack()
+
+
+class _BalancerTest (object):
+  module = None
+
+  def setUp (self):
+    self.con = FakeConnection()
+    self.lb = self.module.iplb(self.con, VIP, SERVERS)
+    self.lb._stopped = True # Stop probing (where that's supported)
+    for i,s in enumerate(SERVERS):
+      self.lb.live_servers[s] = EthAddr("00:00:00:00:01:%02x" % (i,)),i+2
+    self.lb._servers_changed()
+
+  def _new_flow (self, srcport = 1234):
+    del self.con.sent[:]
+    data = _syn(srcport)
+    self.lb._handle_tcp(FakePacketIn(data), peek_tcp(data))
+    return self.con.sent
+
+  def test_balanced (self):
+    sent = self._new_flow()
+    self.assertEqual(len(self.lb.memory), 1)
+    self.assertTrue(isinstance(sent[0], bytes)) # The packed flow_mod
+
+  def test_all_drained (self):
+    for s in SERVERS:
+      self.lb.drain_server(s)
+    sent = self._new_flow()
+    # Dropped, rather than remembered with no server
+    self.assertEqual(len(self.lb.memory), 0)
+    self.assertEqual([type(m) for m in sent], [of.ofp_packet_out])
+
+  def test_drained (self):
+    drained = []
+    self.lb.addListener(ServerDrained, lambda e: drained.append(e.server))
+    self._new_flow()
+    a = self.lb.memory.server_counts.keys()[0]
+    self.lb.drain_server(a)
+    self.assertEqual(self.con.requests, []) # It still has a flow
+
+    # We forget the flow, but the switch is still carrying it
+    self.lb.memory.expire(time.time() + 1000)
+    self.lb._do_expire()
+    self.assertEqual(len(self.con.requests), 1)
+    self.con.requests[0].answer([_flow(a, False), _flow(a), _flow(a)])
+    self.assertEqual(drained, [])
+
+    # Don't ask again right away
+    self.lb._do_expire()
+    self.assertEqual(len(self.con.requests), 1)
+
+    self.lb._drain_check_time = 0
+    self.lb._do_expire()
+    other = SERVERS[1] if a == SERVERS[0] else SERVERS[0]
+    self.con.requests[1].answer([_flow(other)])
+    self.assertEqual(drained, [a])
+
+
+class LBCodeTest (_BalancerTest, unittest.TestCase):
+  module = lbcode
+
+
+class LBCodeDynamicTest (_BalancerTest, unittest.TestCase):
+  module = lbcode_dynamic
+
+
+class LBCodeMultiTest (_BalancerTest, unittest.TestCase):
+  module = lbcode_multi
+
+  def _multi (self, service):
+    # A MultiBalancer already running self.lb for service
+    registry = lbcode_multi.ServiceRegistry()
+    registry.set_services([service])
+    mb = object.__new__(lbcode_multi.MultiBalancer)
+    mb.registry = registry
+    mb.default_selector = None
+    mb.fin_timeout = None
+    mb.balancers = {service.key : self.lb}
+    mb._by_dpid = {service.dpid : [self.lb]}
+    mb._vips = set()
+    registry.addListeners(mb)
+    self.addCleanup(lbcode_multi.arp_responder._arp_table.pop, VIP, None)
+    return registry
+
+  def test_reconfigure (self):
+    new = IPAddr("10.0.0.3")
+    registry = self._multi(lbcode_multi.Service(1, VIP, None, SERVERS))
+    self._new_flow()
+    self.lb.drain_server(SERVERS[1])
+    selector = self.lb.selector
+
+    registry.set_services([lbcode_multi.Service(1, VIP, None,
+                                                SERVERS + [new])])
+    self.assertEqual(self.lb.servers, SERVERS + [new])
+    self.assertTrue(self.lb.selector is selector)
+    self.assertEqual(len(self.lb.memory), 1)
+    self.assertTrue(SERVERS[1] in self.lb.draining)
+
+    registry.set_services([lbcode_multi.Service(1, VIP, None, [new],
+                                                selector = "random")])
+    self.assertEqual(self.lb.servers, [new])
+    self.assertEqual(self.lb.live_servers, {})
+    self.assertEqual(self.lb.draining, {})
+    self.assertTrue(isinstance(self.lb.selector, RandomSelector))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -111,6 +111,32 @@ class FlowTableTest(unittest.TestCase):
       t.remove_expired_entries(now=time)
       self.assertEqual(sorted([e.cookie for e in t.entries]), remaining)
 
+  def test_entry_for_packet(self):
+    from pox.lib.packet import ethernet, ipv4, tcp
+    def packet(src, dport):
+      t = tcp(srcport=1234, dstport=dport)
+      ip = ipv4(srcip=IPAddr(src), dstip=IPAddr("10.0.0.9"), protocol=6,
+                payload=t)
+      return ethernet(src=EthAddr("00:00:00:00:00:01"),
+                      dst=EthAddr("00:00:00:00:00:02"), type=0x800,
+                      payload=ip)
+
+    t = FlowTable()
+    web = TableEntry(priority=9, match=ofp_match(dl_type=0x800, nw_proto=6,
+                                                 tp_dst=80))
+    subnet = TableEntry(priority=5, match=ofp_match(dl_type=0x800,
+                                                    nw_src="10.1.0.0/16"))
+    arp = TableEntry(priority=7, match=ofp_match(dl_type=0x806))
+    for e in (web, subnet, arp):
+      t.add_entry(e)
+    self.assertTrue(t.entry_for_packet(packet("10.1.2.3", 80), 1) is web)
+    self.assertTrue(t.entry_for_packet(packet("10.1.2.3", 22), 1) is subnet)
+    self.assertEqual(t.entry_for_packet(packet("10.2.2.3", 22), 1), None)
+    t.remove_entry(web)
+    self.assertTrue(t.entry_for_packet(packet("10.1.2.3", 80), 1) is subnet)
+    self.assertEqual(t.matching_entries(ofp_match(dl_type=0x800)),
+                     [subnet])
+
   # def test_check_for_overlap_entries(self):
 
 
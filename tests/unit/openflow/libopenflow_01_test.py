@@ -134,6 +134,71 @@ class ofp_match_test(unittest.TestCase):
     assertNoMatch(create(nw_src="10.0.0.0/25"), create(nw_src="10.0.0.0/24"))
     assertMatch(create(nw_src="10.0.0.0/25"), create(nw_src="10.0.0.127"))
     assertNoMatch(create(nw_src="10.0.0.0/25"), create(nw_src="10.0.0.128"))
+  def test_compiled_match(self):
+    """ CompiledMatch: round trips and agrees with matches_with_wildcards """
+    ref = ofp_match(in_port=1, dl_src=EthAddr("00:00:00:00:00:01"),
+                    dl_vlan=5, dl_type=0x800, nw_proto=6,
+                    nw_src="10.0.0.1", nw_dst="11.0.0.0/8", tp_dst=80)
+    others = [ref, ofp_match(), ofp_match(in_port=1),
+              ofp_match(in_port=1, dl_type=0),
+              ofp_match(dl_type=0x800, nw_src="10.0.0.0/24"),
+              ofp_match(dl_type=0x800, nw_src="10.0.0.0/25"),
+              ofp_match(dl_type=0x800, nw_src="10.0.0.128"),
+              ofp_match(dl_vlan=5, tp_dst=80), ofp_match(tp_dst=81),
+              ofp_match(nw_dst="11.1.2.3", tp_dst=80)]
+    for a in others:
+      ca = CompiledMatch(a)
+      self.assertEqual(ca.to_match(), a)
+      self.assertEqual(CompiledMatch(ca.to_match()), ca)
+      for b in others:
+        self.assertEqual(ca.matches_with_wildcards(CompiledMatch(b)),
+                         a.matches_with_wildcards(b),
+                         "%s\n%s" % (a.show(), b.show()))
+
+    # Unlike ofp_match, host bits under a prefix don't count
+    m = ofp_match()
+    m.set_nw_src(IPAddr("10.0.0.1"), 24)
+    c = CompiledMatch(m)
+    self.assertEqual(c.to_match().get_nw_src(), (IPAddr("10.0.0.1"), 24))
+    self.assertTrue(c.matches_with_wildcards(
+        CompiledMatch(ofp_match(nw_src="10.0.0.7"))))
+    self.assertEqual(c, CompiledMatch(ofp_match(nw_src="10.0.0.0/24")))
+
+  def test_locked_pack(self):
+    """ ofp_match: locked matches reuse their packed form """
+    m = ofp_match(dl_type=0x800, nw_proto=17, nw_src="10.0.0.0/8", tp_dst=53)
+    packed = m.pack(flow_mod=True)
+    hash(m)
+    self.assertEqual(m.pack(flow_mod=True), packed)
+    self.assertTrue(m.pack(flow_mod=True) is m.pack(flow_mod=True))
+    self.assertEqual(m.pack(), ofp_match(dl_type=0x800, nw_proto=17,
+                                         nw_src="10.0.0.0/8", tp_dst=53).pack())
+    self.assertRaises(AttributeError, m.unpack, packed)
+
+
+  def test_wildcarded_fields_pack(self):
+    """ ofp_match: wildcarded fields pack as zero and round trip """
+    import struct
+    wc = (OFPFW_ALL & ~(OFPFW_DL_TYPE | OFPFW_NW_PROTO | OFPFW_TP_DST
+                        | OFPFW_NW_SRC_MASK | OFPFW_NW_DST_MASK)
+          | OFPFW_NW_SRC_ALL | (8 << OFPFW_NW_DST_SHIFT))
+    fmt = "!LH6s6sHBxHBBxxLLHH"
+    # What a switch might send back, with junk in the wildcarded fields
+    raw = struct.pack(fmt, wc, 3, b'\x01' * 6, b'\x02' * 6, 7, 1, 0x800,
+                      4, 6, 0x01020304, 0x0a000001, 1234, 80)
+    m = ofp_match()
+    m.unpack(raw)
+    self.assertEqual(m.in_port, None)
+    packed = m.pack()
+    self.assertEqual(packed, struct.pack(fmt, wc, 0, b'\0' * 6, b'\0' * 6,
+                                         0, 0, 0x800, 0, 6, 0, 0x0a000001,
+                                         0, 80))
+    m2 = ofp_match()
+    m2.unpack(packed)
+    self.assertEqual(m2, m)
+    self.assertEqual(hash(m2), hash(m))
+    self.assertEqual(m2.pack(), packed)
+
 
 class ofp_command_test(unittest.TestCase):
   # custom map of POX class to header type, for validation
@@ -248,6 +313,63 @@ class ofp_command_test(unittest.TestCase):
   some_actions = ([], [out(port=2)], [out(port=2), out(port=3)], [ out(port=OFPP_FLOOD) ], [ dl_addr.set_dst(EthAddr("00:"*5 + "01")), out(port=1) ])
 
 
+  def test_flow_mod_template(self):
+    actions = [ofp_action_dl_addr.set_dst(EthAddr("00:00:00:00:00:01")),
+               ofp_action_output(port=2)]
+    kw = dict(idle_timeout=10, priority=5, flags=OFPFF_SEND_FLOW_REM,
+              actions=actions)
+    t = FlowModTemplate(**kw)
+    matches = [ofp_match(in_port=i, dl_type=0x800, nw_dst="10.0.0.%i" % i)
+               for i in range(1, 4)]
+    for m in matches:
+      fm = ofp_flow_mod(xid=9, match=m, buffer_id=7, **kw)
+      self.assertEqual(t.pack(m, buffer_id=7, xid=9), fm.pack())
+      self.assertEqual(t.pack(m.pack(flow_mod=True), buffer_id=7, xid=9),
+                       fm.pack())
+    self.assertEqual(len(t), len(fm))
+
+    packed = t.pack_many(matches, [None, 7, None])
+    offset = 0
+    for m,buffer_id in zip(matches, [None, 7, None]):
+      offset,fm = ofp_flow_mod.unpack_new(packed, offset)
+      self.assertEqual((fm.match, fm.buffer_id, fm.actions),
+                       (m, buffer_id, actions))
+    self.assertEqual(offset, len(packed))
+
+    # Unbuffered packets go out in a packet_out after a barrier
+    pi = ofp_packet_in(in_port=1, data=b"x" * 64)
+    packed = t.pack(matches[0], data=pi)
+    offset,fm = ofp_flow_mod.unpack_new(packed)
+    offset,br = ofp_barrier_request.unpack_new(packed, offset)
+    offset,po = ofp_packet_out.unpack_new(packed, offset)
+    self.assertEqual((po.data, po.in_port), (pi.data, 1))
+    pi.buffer_id = 3
+    self.assertEqual(len(t.pack(matches[0], data=pi)), len(t))
+    self.assertRaises(ValueError, FlowModTemplate, ofp_flow_mod(data=pi))
+
+  def test_lazy_packet_in(self):
+    pi = ofp_packet_in(xid=7, in_port=3, buffer_id=9, data=b"x" * 100)
+    packed = b"junk" + pi.pack() + b"more"
+    offset,o = ofp_packet_in.unpack_new(packed, 4)
+    self.assertEqual(offset, len(packed) - 4)
+    self.assertEqual((o.in_port, o.buffer_id, o.xid, len(o)), (3, 9, 7, 118))
+    self.assertTrue(o._raw is not None)
+    self.assertEqual(o, pi)
+    self.assertEqual(o.data, b"x" * 100)
+    self.assertTrue(o._raw is None)
+    self.assertRaises(UnderrunError, ofp_packet_in.unpack_new, packed[:50], 4)
+
+    o = ofp_packet_in.unpack_new(packed, 4)[1]
+    o.detach()
+    self.assertTrue(o._raw is None)
+    self.assertEqual(o.data, b"x" * 100)
+
+    # Unbuffered, and resent without anyone looking at the data first
+    pi.buffer_id = None
+    o = ofp_packet_in.unpack_new(pi.pack())[1]
+    po = ofp_packet_out(data=o)
+    self.assertEqual(po.data, b"x" * 100)
+
   def test_pack_custom_packet_out(self):
     xid_gen = xid_generator()
     packet = ethernet(src=EthAddr("00:00:00:00:00:01"), dst=EthAddr("00:00:00:00:00:02"),
@@ -0,0 +1,418 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import socket
+import errno
+import threading
+
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.of_01 as of_01
+from pox.openflow import WriteQueueHigh, WriteQueueLow, PacketInFlood
+from pox.openflow import PacketIn
+
+
+class FakeSocket (object):
+  """
+  Hands out data in chunks of the given sizes (the last one repeats)
+
+  send() takes at most room bytes (if room isn't None).
+  """
+  def __init__ (self, data = b'', chunks = [0]):
+    self.data = data
+    self.chunks = list(chunks)
+    self.sent = []
+    self.room = None
+
+  def send (self, data):
+    if self.room is not None:
+      if self.room == 0:
+        raise socket.error(errno.EAGAIN, "Resource temporarily unavailable")
+      data = data[:self.room]
+      self.room -= len(data)
+    self.sent.append(data)
+    return len(data)
+
+  def shutdown (self, how):
+    pass
+
+  def recv_into (self, buf, nbytes = 0):
+    size = self.chunks.pop(0) if len(self.chunks) > 1 else self.chunks[0]
+    n = min(size, nbytes or len(buf), len(self.data))
+    buf[:n] = self.data[:n]
+    self.data = self.data[n:]
+    return n
+
+
+class ReadTest (unittest.TestCase):
+  def setUp (self):
+    self._handlers = of_01.handlers
+    self.msgs = []
+    of_01.handlers = [lambda con, msg: self.msgs.append(msg)] * 256
+
+  def tearDown (self):
+    of_01.handlers = self._handlers
+
+  def _read (self, data, chunks):
+    sock = FakeSocket(data, chunks)
+    con = of_01.Connection(sock)
+    results = []
+    while sock.data:
+      results.append(con.read())
+    return con,results
+
+  def test_split_messages (self):
+    pi = of.ofp_packet_in(in_port = 1, data = b'x' * 100)
+    msgs = [of.ofp_echo_request(xid = 1), pi, of.ofp_echo_request(xid = 2)]
+    data = b''.join(m.pack() for m in msgs)
+    con,results = self._read(data, [3, 20, 50, len(data)])
+    self.assertEqual(results, [True] * 4)
+    self.assertEqual(self.msgs, msgs)
+    self.assertEqual(type(self.msgs[1].data), bytes)
+    self.assertEqual(con._buf_start, con._buf_end)
+
+  def test_large_message (self):
+    pi = of.ofp_packet_in(in_port = 1, data = b'x' * 60000)
+    data = pi.pack() * 3
+    con,results = self._read(data, [65536])
+    self.assertEqual(self.msgs, [pi] * 3)
+    self.assertTrue(con._read_size > of_01._READ_SIZE_MIN)
+
+  def test_bad_version (self):
+    data = of.ofp_echo_request().pack()
+    bad = bytearray(data)
+    bad[0] = 0x42
+    con,results = self._read(data + bytes(bad), [100])
+    self.assertEqual(results, [False])
+    self.assertEqual(len(self.msgs), 1)
+
+  def test_feed (self):
+    sock = FakeSocket(chunks = [100])
+    con = of_01.Connection(sock, send_hello = False)
+    self.assertFalse(con in of_01.sendQueues.pending)
+    data = of.ofp_echo_request(xid = 1).pack()
+    self.assertTrue(con.feed(data + data[:5]))
+    self.assertEqual(len(self.msgs), 1)
+    sock.data = data[5:]
+    self.assertTrue(con.read())
+    self.assertEqual(self.msgs, [of.ofp_echo_request(xid = 1)] * 2)
+
+
+class SendTest (unittest.TestCase):
+  def setUp (self):
+    self.sock = FakeSocket()
+    self.con = of_01.Connection(self.sock)
+    self.events = []
+    self.con.addListener(WriteQueueHigh, self.events.append)
+    self.con.addListener(WriteQueueLow, self.events.append)
+    self.con.write_queue_high = 1000
+    self.con.write_queue_low = 200
+
+  def tearDown (self):
+    of_01.sendQueues.take()
+
+  def test_coalesce (self):
+    self.assertTrue(self.con in of_01.sendQueues.pending)
+    msgs = [of.ofp_flow_mod(match = of.ofp_match(in_port = i))
+            for i in range(10)]
+    data = [m.pack() for m in msgs]
+    for d in data:
+      self.con.send(d)
+    self.assertEqual(self.sock.sent, [])
+    self.assertTrue(self.con.flush())
+    self.assertEqual(len(self.sock.sent), 1)
+    self.assertEqual(self.sock.sent[0][8:], b''.join(data))
+
+  def test_partial (self):
+    self.sock.room = 0
+    self.con.send(b'x' * 500)
+    self.assertFalse(self.con.flush())
+    self.sock.room = 100
+    self.assertFalse(self.con.flush())
+    self.con.send(b'y' * 10)
+    self.sock.room = None
+    self.assertTrue(self.con.flush())
+    data = b''.join(self.sock.sent)
+    self.assertEqual(data[8:], b'x' * 500 + b'y' * 10)
+
+  def test_watermarks (self):
+    self.sock.room = 0
+    for i in range(5):
+      self.con.send(b'x' * 300)
+    self.assertTrue(self.con.send_blocked)
+    self.assertEqual([type(e) for e in self.events], [WriteQueueHigh])
+    self.sock.room = 1000
+    self.con.flush()
+    self.assertTrue(self.con.send_blocked)
+    self.sock.room = 400
+    self.con.flush()
+    self.assertFalse(self.con.send_blocked)
+    self.assertEqual([type(e) for e in self.events],
+                     [WriteQueueHigh, WriteQueueLow])
+    self.assertEqual(self.events[-1].queued, 8 + 1500 - 1400)
+
+  def test_scheduler_thread (self):
+    # Sends from, e.g., a Timer are flushed without waking the task
+    class FakeScheduler (object):
+      _thread = threading.current_thread()
+      def __init__ (self):
+        self.calls = []
+      def callLater (self, func, *args, **kw):
+        self.calls.append(func)
+    class FakePinger (object):
+      pings = 0
+      def ping (self):
+        self.pings += 1
+    self.con.flush() # The HELLO
+    del self.sock.sent[:]
+    sq = of_01.sendQueues
+    sq.take()
+    sq.waker = FakePinger()
+    sq.scheduler = FakeScheduler()
+    try:
+      self.con.send(b'x' * 10)
+      self.con.send(b'y' * 10)
+      self.assertEqual(len(sq.scheduler.calls), 1)
+      self.sock.room = 15
+      sq.scheduler.calls[0]()
+      self.assertEqual(self.sock.sent, [b'x' * 10 + b'y' * 5])
+      # The rest has to wait for the task
+      self.assertTrue(self.con in sq.pending)
+      self.assertEqual(sq.waker.pings, 1)
+    finally:
+      sq.waker = None
+      sq.scheduler = None
+
+  def test_threads (self):
+    # Sends from other threads while the queues are being flushed
+    self.con.write_queue_high = 1 << 30
+    sq = of_01.sendQueues
+    def sender ():
+      for i in range(500):
+        self.con.send(b'x' * 10)
+    threads = [threading.Thread(target = sender) for i in range(4)]
+    for t in threads: t.start()
+    while any(t.is_alive() for t in threads):
+      for con in sq.take():
+        con.flush()
+    for t in threads: t.join()
+    # Anything left over must still be waiting to be flushed
+    if self.con._send_queue:
+      self.assertTrue(self.con in sq.pending)
+    self.assertTrue(self.con.flush())
+    self.assertEqual(len(b''.join(self.sock.sent)), 8 + 4 * 500 * 10)
+    self.assertEqual(self.con._send_queued, 0)
+
+  def test_disconnect (self):
+    self.con.send(b'x' * 10)
+    self.con.disconnect()
+    self.assertFalse(self.con in of_01.sendQueues.pending)
+    self.assertTrue(self.con.flush())
+    self.assertEqual(self.sock.sent, [])
+
+
+class RequestTest (unittest.TestCase):
+  def setUp (self):
+    self.con = of_01.Connection(FakeSocket())
+    self.done = []
+
+  def tearDown (self):
+    of_01.sendQueues.take()
+    # Don't leave the timeout timer running on the shared scheduler
+    del of_01._request_timeouts[:]
+    if of_01._request_timer is not None:
+      of_01._request_timer.cancel()
+      of_01._request_timer = None
+
+  def _request (self, msg, **kw):
+    return self.con.request(msg, callback = self.done.append, **kw)
+
+  def _flow_stats (self, xid, ports, more = False):
+    body = [of.ofp_flow_stats(match = of.ofp_match(in_port = p))
+            for p in ports]
+    return of.ofp_stats_reply(xid = xid, type = of.OFPST_FLOW, body = body,
+                              flags = 1 if more else 0).pack()
+
+  def test_pipelined_stats (self):
+    req = lambda: of.ofp_stats_request(body = of.ofp_flow_stats_request())
+    r1 = self._request(req())
+    r2 = self._request(req())
+    self.con.feed(self._flow_stats(r1.xid, [1], more = True))
+    self.con.feed(self._flow_stats(r2.xid, [5], more = True))
+    self.con.feed(self._flow_stats(r2.xid, [6]))
+    self.assertEqual(self.done, [r2])
+    self.con.feed(self._flow_stats(r1.xid, [2, 3]))
+    self.assertEqual(self.done, [r2, r1])
+    self.assertEqual([f.match.in_port for f in r1.body], [1, 2, 3])
+    self.assertEqual([f.match.in_port for f in r2.body], [5, 6])
+    self.assertEqual(len(r1.reply), 2)
+    self.assertTrue(r1.ok)
+
+  def test_barrier (self):
+    fm = self._request(of.ofp_flow_mod())
+    b = self._request(of.ofp_barrier_request())
+    late = self._request(of.ofp_flow_mod())
+    self.con.feed(of.ofp_barrier_reply(xid = b.xid).pack())
+    self.assertEqual(self.done, [fm, b])
+    self.assertEqual((fm.status, b.status, late.status), ("ok", "ok", None))
+
+  def test_error (self):
+    fm = self._request(of.ofp_flow_mod())
+    b = self._request(of.ofp_barrier_request())
+    err = of.ofp_error(xid = fm.xid, type = of.OFPET_FLOW_MOD_FAILED,
+                       code = of.OFPFMFC_ALL_TABLES_FULL)
+    self.con.feed(err.pack() + of.ofp_barrier_reply(xid = b.xid).pack())
+    self.assertEqual(self.done, [fm, b])
+    self.assertEqual(fm.status, "error")
+    self.assertEqual(fm.error.code, of.OFPFMFC_ALL_TABLES_FULL)
+    self.assertTrue(b.ok)
+
+  def test_timeout (self):
+    r = self._request(of.ofp_echo_request(), timeout = 1000)
+    forever = self._request(of.ofp_echo_request(), timeout = 0)
+    of_01._expire_requests(r.expires_at - 1)
+    self.assertEqual(self.done, [])
+    of_01._expire_requests(r.expires_at)
+    self.assertEqual(self.done, [r])
+    self.assertEqual(r.status, "timeout")
+    # Late replies are ignored
+    self.con.feed(of.ofp_echo_reply(xid = r.xid).pack())
+    self.con.feed(of.ofp_echo_reply(xid = forever.xid).pack())
+    self.assertEqual(self.done, [r, forever])
+    self.assertTrue(forever.ok)
+
+  def test_unacked_forgotten (self):
+    # Requests which finish without a barrier don't wait for one
+    timed_out = self._request(of.ofp_flow_mod())
+    failed = self._request(of.ofp_flow_mod(), timeout = 0)
+    cancelled = self._request(of.ofp_flow_mod(), timeout = 0)
+    waiting = self._request(of.ofp_flow_mod(), timeout = 0)
+    self._request(of.ofp_echo_request()).cancel()
+    of_01._expire_requests(timed_out.expires_at)
+    cancelled.cancel()
+    err = of.ofp_error(xid = failed.xid, type = of.OFPET_FLOW_MOD_FAILED,
+                       code = of.OFPFMFC_ALL_TABLES_FULL)
+    self.con.feed(err.pack())
+    self.assertEqual(list(self.con._unacked), [waiting])
+    self.assertEqual((timed_out.status, failed.status, cancelled.status),
+                     ("timeout", "error", "cancelled"))
+
+  def test_disconnect (self):
+    r = self._request(of.ofp_echo_request())
+    self.con.disconnect()
+    self.assertEqual(r.status, "disconnected")
+    r2 = self._request(of.ofp_echo_request())
+    self.assertEqual(self.done, [r, r2])
+    self.assertEqual(r2.status, "disconnected")
+
+
+class AdmissionTest (unittest.TestCase):
+  def setUp (self):
+    self.con = of_01.Connection(FakeSocket())
+    self.floods = []
+    self.con.addListener(PacketInFlood, self.floods.append)
+
+  def tearDown (self):
+    of_01.sendQueues.take()
+
+  def _packet_in (self, dl_type, proto = 17, port = 1, vlan = False):
+    if vlan: dl_type = b'\x81\x00\x00\x05' + dl_type
+    data = b'\x00' * 12 + dl_type + b'\x45' + b'\x00' * 8 + chr(proto)
+    data += b'\x00' * 40
+    msg = of.ofp_packet_in(in_port = port, buffer_id = 7, data = data)
+    return of.ofp_packet_in.unpack_new(msg.pack())[1]
+
+  def test_classes (self):
+    tcp = self._packet_in(b'\x08\x00', 6)
+    self.assertEqual(of_01._packet_in_class(tcp),
+                     (of_01.PI_TCP, b'\x08\x00', 6))
+    udp = self._packet_in(b'\x08\x00', 17)
+    self.assertEqual(of_01._packet_in_class(udp)[0], of_01.PI_OTHER)
+    arp = self._packet_in(b'\x08\x06')
+    self.assertEqual(of_01._packet_in_class(arp)[0], of_01.PI_CONTROL)
+    self.assertTrue(tcp._raw is not None) # Didn't copy the data out
+
+  def test_vlan_classes (self):
+    tcp = self._packet_in(b'\x08\x00', 6, vlan = True)
+    self.assertEqual(of_01._packet_in_class(tcp),
+                     (of_01.PI_TCP, b'\x08\x00', 6))
+    udp = self._packet_in(b'\x08\x00', 17, vlan = True)
+    self.assertEqual(of_01._packet_in_class(udp)[0], of_01.PI_OTHER)
+    lldp = self._packet_in(b'\x88\xcc', vlan = True)
+    self.assertEqual(of_01._packet_in_class(lldp)[0], of_01.PI_CONTROL)
+
+  def test_vlan_budget (self):
+    a = of_01.PacketInAdmission(port_rate = 0.001, port_burst = 8)
+    tcp = self._packet_in(b'\x08\x00', 6, vlan = True)
+    admitted = [a.admit(self.con, tcp) for i in range(8)]
+    self.assertEqual(admitted, [True] * 6 + [False] * 2)
+    self.assertEqual(self.floods[0].traffic_class, "tcp")
+
+  def test_port_budget (self):
+    a = of_01.PacketInAdmission(port_rate = 0.001, port_burst = 8)
+    tcp = self._packet_in(b'\x08\x00', 6)
+    arp = self._packet_in(b'\x08\x06')
+    admitted = [a.admit(self.con, tcp) for i in range(10)]
+    # TCP has to leave a quarter of the burst
+    self.assertEqual(admitted, [True] * 6 + [False] * 4)
+    # Control traffic can overdraw by a burst
+    self.assertTrue(all(a.admit(self.con, arp) for i in range(10)))
+    self.assertFalse(a.admit(self.con, arp))
+    self.assertTrue(a.admit(self.con, self._packet_in(b'\x08\x00', 6, 2)))
+
+    c = a.counters()
+    self.assertEqual(c['tcp'], {'admitted' : 7, 'shed' : 4})
+    self.assertEqual(c['control'], {'admitted' : 10, 'shed' : 1})
+    self.assertEqual(self.con.packet_ins_shed, 5)
+
+    # Only one drop rule while the port is blocked
+    self.assertEqual(a.blocks, 1)
+    self.assertEqual(len(self.floods), 1)
+    self.assertEqual((self.floods[0].port, self.floods[0].traffic_class),
+                     (1, "tcp"))
+    fm = of.ofp_flow_mod.unpack_new(self.con._send_queue[-1])[1]
+    self.assertEqual((fm.match.in_port, fm.match.dl_type, fm.match.nw_proto,
+                      fm.buffer_id, fm.hard_timeout), (1, 0x800, 6, 7, 5))
+
+  def test_other_block (self):
+    a = of_01.PacketInAdmission(port_rate = 0.001, port_burst = 4)
+    udp = self._packet_in(b'\x08\x00', 17)
+    arp = self._packet_in(b'\x08\x06')
+    self.assertEqual(of_01._packet_in_class(arp)[2], None)
+    self.assertEqual([a.admit(self.con, udp) for i in range(5)],
+                     [True] * 4 + [False])
+    # The drop rule is only for UDP, so new TCP flows still get through
+    fm = of.ofp_flow_mod.unpack_new(self.con._send_queue[-1])[1]
+    self.assertEqual((fm.match.dl_type, fm.match.nw_proto), (0x800, 17))
+    self.assertEqual(self.floods[0].nw_proto, 17)
+
+  def test_detach (self):
+    seen = []
+    self.con.addListener(PacketIn, lambda e: seen.append(e.ofp._raw))
+    msg = self._packet_in(b'\x08\x00', 6)
+    of_01.handle_PACKET_IN(self.con, msg)
+    self.assertTrue(seen[0] is not None) # Handlers still got it lazily
+    self.assertTrue(msg._raw is None) # ...but it doesn't keep the buffer
+
+  def test_switch_budget (self):
+    a = of_01.PacketInAdmission(rate = 0.001, burst = 4, block_time = 0)
+    msgs = [self._packet_in(b'\x08\x00', port = p) for p in range(6)]
+    self.assertEqual([a.admit(self.con, m) for m in msgs],
+                     [True] * 4 + [False] * 2)
+    self.assertEqual(a.blocks, 0)
+
+if __name__ == '__main__':
+  unittest.main()
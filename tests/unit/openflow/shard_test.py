@@ -0,0 +1,83 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import cPickle as pickle
+import socket
+
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.shard import *
+
+
+class HandshakeTest (unittest.TestCase):
+  def test_features_reply (self):
+    echo = of.ofp_echo_request(xid = 5).pack()
+    reply = of.ofp_features_reply(datapath_id = 0x1234).pack()
+    data = of.ofp_hello().pack() + echo + reply
+    self.assertEqual(parse_handshake(data[:-3]), None)
+    self.assertEqual(parse_handshake(data), (0x1234, echo + reply))
+
+  def test_bad_version (self):
+    data = bytearray(of.ofp_features_reply().pack())
+    data[0] = 0x42
+    self.assertRaises(RuntimeError, parse_handshake, bytes(data))
+
+
+class ArgvTest (unittest.TestCase):
+  def test_worker_argv (self):
+    argv = ["log.level", "--DEBUG", "openflow.of_01", "--port=7000",
+            "--epoll=False", "--workers=4", "--master_only=web.webcore",
+            "web.webcore", "--port=8000", "forwarding.l2_learning"]
+    self.assertEqual(worker_argv(argv, 2, (5, 6), ["web.webcore"]),
+                     ["log.level", "--DEBUG", "openflow.of_01",
+                      "--shard=2", "--shard_fds=5,6", "--epoll=False",
+                      "forwarding.l2_learning"])
+
+
+class MessageReaderTest (unittest.TestCase):
+  def test_split (self):
+    data = pack_message("message", "x", 1, 0) + pack_message("switch", 7)
+    r = MessageReader()
+    self.assertEqual(r.feed(data[:3]), [])
+    msgs = r.feed(data[3:-1]) + r.feed(data[-1:])
+    self.assertEqual([pickle.loads(m) for m in msgs],
+                     [("message", "x", 1, 0), ("switch", 7)])
+    self.assertEqual(r.buf, b'')
+
+
+class MessageWriterTest (unittest.TestCase):
+  def test_queue (self):
+    a,b = socket.socketpair()
+    a.setblocking(0)
+    w = MessageWriter(a)
+    big = pack_message("message", "x", b'y' * 2000000, 0)
+    self.assertTrue(w.write(pack_message("switch", 7)))
+    self.assertFalse(w.write(big)) # Would have blocked
+    self.assertTrue(w.pending)
+    self.assertFalse(w.write(pack_message("switch", 8)))
+
+    r = MessageReader()
+    msgs = []
+    while len(msgs) < 3:
+      msgs += r.feed(b.recv(65536))
+      w.flush()
+    self.assertFalse(w.pending)
+    self.assertEqual([pickle.loads(m)[1] for m in msgs], [7, "x", 8])
+    a.close()
+    b.close()
+
+if __name__ == '__main__':
+  unittest.main()
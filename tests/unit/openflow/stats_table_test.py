@@ -0,0 +1,121 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.lib.addresses import IPAddr, EthAddr
+import pox.openflow.libopenflow_01 as of
+from pox.openflow import FlowStatsReceived
+import pox.openflow.stats_table as st
+
+
+def _flow (i, byte_count, duration = 10, actions = 1):
+  m = of.ofp_match(dl_type = 0x800, nw_proto = 6, tp_dst = 80,
+                   dl_src = EthAddr("00:00:00:00:01:%02x" % i),
+                   nw_dst = IPAddr("10.0.%i.%i" % (i // 4, i)))
+  return of.ofp_flow_stats(match = m, priority = 5, duration_sec = duration,
+                           duration_nsec = 500000000,
+                           packet_count = byte_count // 100,
+                           byte_count = byte_count,
+                           actions = [of.ofp_action_output(port = 1)]
+                                     * actions)
+
+def _replies (flows, raw):
+  """
+  Packs flows into two stats replies and unpacks them again
+  """
+  half = len(flows) // 2
+  parts = [of.ofp_stats_reply(type = of.OFPST_FLOW, body = flows[:half],
+                              flags = 1),
+           of.ofp_stats_reply(type = of.OFPST_FLOW, body = flows[half:])]
+  if raw:
+    of.ofp_stats_reply.raw_types.add(of.OFPST_FLOW)
+  try:
+    return [of.ofp_stats_reply.unpack_new(p.pack())[1] for p in parts]
+  finally:
+    of.ofp_stats_reply.raw_types.discard(of.OFPST_FLOW)
+
+
+@unittest.skipIf(st.np is None, "requires NumPy")
+class FlowTableTest (unittest.TestCase):
+  def _check (self, flows, raw):
+    parts = _replies(flows, raw)
+    self.assertEqual(type(parts[0].body) is bytes, raw)
+    table = st.flow_stats_table(parts)
+    self.assertEqual(len(table), len(flows))
+    for row,f in zip(table, flows):
+      self.assertEqual(row['dl_src'], int(f.match.dl_src.toStr(""), 16))
+      self.assertEqual(row['nw_dst'], f.match.nw_dst.toUnsigned())
+      self.assertEqual((row['tp_dst'], row['priority'], row['byte_count']),
+                       (80, 5, f.byte_count))
+      self.assertEqual(row['duration'], f.duration_sec + 0.5)
+    return parts
+
+  def test_uniform (self):
+    self._check([_flow(i, i * 1000) for i in range(10)], True)
+
+  def test_mixed_lengths (self):
+    self._check([_flow(i, i * 1000, actions = i % 3) for i in range(10)],
+                True)
+
+  def test_objects (self):
+    self._check([_flow(i, i * 1000) for i in range(10)], False)
+
+  def test_lazy_event_stats (self):
+    flows = [_flow(i, i * 1000) for i in range(6)]
+    parts = _replies(flows, True)
+    e = FlowStatsReceived(None, parts, None)
+    self.assertEqual(e.stats, flows)
+    self.assertEqual(len(e.table), 6)
+
+  def test_helpers (self):
+    table = st.flow_stats_table(_replies([_flow(i, (i % 5) * 1000)
+                                          for i in range(10)], True))
+    top = st.top_n(table, 3)
+    self.assertEqual(list(top['byte_count']), [4000, 4000, 3000])
+
+    later = table.copy()
+    later['byte_count'] += 500
+    later['duration'] += 5
+    later = later[2:] # Two flows went away...
+    new = st.flow_stats_table(_replies([_flow(20, 20500, duration = 20),
+                                        _flow(21, 0)], True))
+    later = st.np.concatenate((later, new)) # ...and two arrived
+    rates = st.rate_deltas(table, later)
+    self.assertEqual(list(rates[:8]), [100.0] * 8)
+    self.assertEqual(list(rates[8:]), [1000.0, 0.0])
+
+    prefixes,totals = st.aggregate_by_prefix(table, 24)
+    self.assertEqual(list(prefixes), [IPAddr("10.0.%i.0" % i).toUnsigned()
+                                      for i in range(3)])
+    self.assertEqual(list(totals), [6000, 7000, 7000])
+
+
+@unittest.skipIf(st.np is None, "requires NumPy")
+class PortTableTest (unittest.TestCase):
+  def test_rates (self):
+    def reply (n):
+      body = [of.ofp_port_stats(port_no = p, rx_bytes = n * p,
+                                tx_packets = p) for p in (1, 2, 3)]
+      return of.ofp_stats_reply(type = of.OFPST_PORT, body = body)
+    before = st.port_stats_table(reply(100))
+    after = st.port_stats_table(reply(300))[1:]
+    self.assertEqual(list(after['key']), [2, 3])
+    self.assertEqual(list(after['rx_bytes']), [600, 900])
+    rates = st.rate_deltas(before, after, 'rx_bytes', interval = 2)
+    self.assertEqual(list(rates), [200.0, 300.0])
+
+if __name__ == '__main__':
+  unittest.main()
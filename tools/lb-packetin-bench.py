@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmark for load balancer PacketIn classification
+
+Compares what iplb used to do with each TCP PacketIn (parse the whole
+packet, find() the TCP and IP layers, build the match with from_packet())
+against the header peeking in pox.lib.lb.fastpath.  Three kinds of
+packets are timed: ones for the VIP (which need a match built), ones from
+a server, and ones for neither (which only need classifying).
+
+Run from the POX directory:
+  python tools/lb-packetin-bench.py [-n packets]
+"""
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pox.lib.addresses import IPAddr, EthAddr
+from pox.lib.packet import ethernet, ipv4, tcp
+import pox.openflow.libopenflow_01 as of
+from pox.lib.lb.fastpath import peek_tcp
+
+VIP = IPAddr("10.0.1.1")
+SERVERS = frozenset([IPAddr("10.0.0.1"), IPAddr("10.0.0.2")])
+
+
+def make_packet (src, dst, srcport, dstport):
+  t = tcp(srcport = srcport, dstport = dstport)
+  t.off = 5
+  t.payload = b'x' * 64
+  ip = ipv4(srcip = IPAddr(src), dstip = IPAddr(dst),
+            protocol = ipv4.TCP_PROTOCOL, payload = t)
+  e = ethernet(src = EthAddr("00:00:00:00:00:01"),
+               dst = EthAddr("00:00:00:00:00:02"),
+               type = ethernet.IP_TYPE, payload = ip)
+  return e.pack()
+
+
+def legacy (data, inport):
+  packet = ethernet(data)
+  tcpp = packet.find('tcp')
+  if not tcpp:
+    packet.find('arp')
+    return None
+  ipp = packet.find('ipv4')
+  if ipp.srcip in SERVERS or ipp.dstip == VIP:
+    key = ipp.srcip,ipp.dstip,tcpp.srcport,tcpp.dstport
+    return key,of.ofp_match.from_packet(packet, inport)
+  return None
+
+
+def fast (data, inport):
+  h = peek_tcp(data)
+  if h is None: return None
+  if h.nw_src in SERVERS or h.nw_dst == VIP:
+    key = h.nw_src,h.nw_dst,h.tp_src,h.tp_dst
+    return key,h.match(inport)
+  return None
+
+
+def run (f, packets, n):
+  count = 0
+  start = time.time()
+  while count < n:
+    for data in packets:
+      f(data, 1)
+    count += len(packets)
+  return count / (time.time() - start)
+
+
+def main ():
+  parser = argparse.ArgumentParser(description = __doc__.split("\n")[1])
+  parser.add_argument("-n", type = int, default = 100000,
+                      help = "packets per test")
+  args = parser.parse_args()
+
+  kinds = [
+    ("to VIP", [make_packet("192.168.0.%i" % (i+1), VIP, 1024+i, 80)
+                for i in range(100)]),
+    ("from server", [make_packet("10.0.0.1", "192.168.0.%i" % (i+1), 80,
+                                 1024+i) for i in range(100)]),
+    ("other", [make_packet("192.168.0.%i" % (i+1), "10.9.9.9", 1024+i, 22)
+               for i in range(100)]),
+  ]
+
+  for data in kinds[0][1]:
+    assert legacy(data, 1) == fast(data, 1)
+
+  print "%-12s %14s %14s %8s" % ("packets", "legacy pkt/s", "fast pkt/s",
+                                 "speedup")
+  for name,packets in kinds:
+    before = run(legacy, packets, args.n)
+    after = run(fast, packets, args.n)
+    print "%-12s %14.0f %14.0f %7.1fx" % (name, before, after, after/before)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmarks for packing and unpacking OpenFlow 1.0 messages
+
+Times libopenflow_01's pack() and unpack_new() for the message types a
+busy controller handles most: packet_ins, flow_mods and packet_outs (with
+their matches and actions), flow_removeds and echos.  Packing is timed
+both for fresh objects and for a locked match that gets reused.  The "lb"
+tests compare building a load balancer's per-flow flow_mod from scratch
+against using a FlowModTemplate (given the match either way).
+
+Run from the POX directory:
+  python tools/of-codec-bench.py [-t seconds] [test ...]
+"""
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pox.lib.addresses import IPAddr, EthAddr
+import pox.openflow.libopenflow_01 as of
+
+
+def make_match (i = 0):
+  return of.ofp_match(in_port = 1, dl_src = EthAddr("00:00:00:00:00:01"),
+                      dl_dst = EthAddr("00:00:00:00:00:02"),
+                      dl_type = 0x800, nw_proto = 6,
+                      nw_src = IPAddr("10.0.0.1"),
+                      nw_dst = IPAddr("10.0.%i.%i" % (i // 250, i % 250)),
+                      tp_src = 1024 + i, tp_dst = 80)
+
+def make_flow_mod (match):
+  return of.ofp_flow_mod(match = match, idle_timeout = 10,
+                         actions = [of.ofp_action_output(port = 2)])
+
+def lb_actions ():
+  return [of.ofp_action_dl_addr.set_dst(EthAddr("00:00:00:00:01:01")),
+          of.ofp_action_nw_addr.set_dst(IPAddr("10.0.0.10")),
+          of.ofp_action_output(port = 3)]
+
+def make_packet_out ():
+  return of.ofp_packet_out(in_port = 1, data = b'x' * 128,
+                           actions = [of.ofp_action_output(port = 2)])
+
+def make_flow_removed ():
+  return of.ofp_flow_removed(match = make_match(), priority = 5,
+                             duration_sec = 10, packet_count = 5,
+                             byte_count = 500)
+
+
+def pack_tests ():
+  locked = make_match()
+  hash(locked)
+  fm = make_flow_mod(locked)
+  po = make_packet_out()
+  match = make_match()
+  template = of.FlowModTemplate(idle_timeout = 10, actions = lb_actions())
+  return [
+    ("pack match", lambda: make_match().pack()),
+    ("pack locked match", lambda: locked.pack(flow_mod = True)),
+    ("pack flow_mod", lambda: make_flow_mod(match).pack()),
+    ("pack flow_mod again", fm.pack),
+    ("pack lb flow_mod", lambda: of.ofp_flow_mod(match = match,
+                                                 idle_timeout = 10,
+                                                 actions = lb_actions()).pack()),
+    ("pack lb template", lambda: template.pack(match)),
+    ("pack packet_out", lambda: make_packet_out().pack()),
+    ("pack packet_out again", po.pack),
+    ("pack echo", lambda: of.ofp_echo_request().pack()),
+  ]
+
+def unpack_tests ():
+  def unpack (cls, data):
+    u = cls.unpack_new
+    return lambda: u(data)
+  pi = of.ofp_packet_in(in_port = 1, buffer_id = 5,
+                        data = b'x' * 128).pack()
+  return [
+    ("unpack packet_in", unpack(of.ofp_packet_in, pi)),
+    ("unpack packet_in+data",
+     lambda: of.ofp_packet_in.unpack_new(pi)[1].data),
+    ("unpack flow_mod", unpack(of.ofp_flow_mod,
+                               make_flow_mod(make_match()).pack())),
+    ("unpack packet_out", unpack(of.ofp_packet_out,
+                                 make_packet_out().pack())),
+    ("unpack flow_removed", unpack(of.ofp_flow_removed,
+                                   make_flow_removed().pack())),
+    ("unpack echo", unpack(of.ofp_echo_request,
+                           of.ofp_echo_request().pack())),
+  ]
+
+
+def run (f, duration):
+  count = 0
+  start = time.time()
+  end = start + duration
+  while True:
+    for i in xrange(100):
+      f()
+    count += 100
+    now = time.time()
+    if now >= end: break
+  return count / (now - start)
+
+
+def main ():
+  parser = argparse.ArgumentParser(description = __doc__.split("\n")[1])
+  parser.add_argument("-t", type = float, default = 1,
+                      help = "seconds per test")
+  parser.add_argument("tests", nargs = "*",
+                      help = "only run tests containing these strings")
+  args = parser.parse_args()
+
+  of._logger = None # No prerequisite warnings
+
+  print "%-24s %12s %10s" % ("test", "ops/s", "usec/op")
+  for name,f in pack_tests() + unpack_tests():
+    if args.tests and not any(t in name for t in args.tests): continue
+    rate = run(f, args.t)
+    print "%-24s %12.0f %10.2f" % (name, rate, 1e6 / rate)
+
+
+if __name__ == '__main__':
+  main()
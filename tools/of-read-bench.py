@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark for OpenFlow Connection.read()
+
+Replays a stream of switch-to-controller OpenFlow messages through
+Connection.read() using a fake socket, and reports messages per second
+for the old read (recv() into a string which is concatenated and sliced)
+and the current one.  Handlers are replaced with a no-op, so this times
+framing and unpacking only.
+
+The streams are either synthetic (PacketIns, big flow stats replies and
+a mix) or the switch side of pcap files like the ones
+of_01's wrap_socket() writes.
+
+Each replay is timed with the socket handing back as much as is asked for
+(a busy switch) and with it handing back one TCP segment at a time.
+
+Run from the POX directory:
+  python tools/of-read-bench.py [-t seconds] [--port P] [capture.pcap ...]
+"""
+
+import sys
+import os
+import time
+import struct
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pox.core
+pox.core.initialize()
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.of_01 as of_01
+from pox.lib.packet import ethernet
+
+SEGMENT = 1448
+
+
+class ReplaySocket (object):
+  """
+  Hands out data from a string, at most chunk bytes per call
+  """
+  def __init__ (self, data, chunk = None):
+    self.data = data
+    self.pos = 0
+    self.chunk = chunk
+
+  def send (self, data):
+    return len(data)
+
+  def recv (self, size):
+    if self.chunk: size = min(size, self.chunk)
+    d = self.data[self.pos:self.pos+size]
+    self.pos += len(d)
+    return d
+
+  def recv_into (self, buf, size = 0):
+    if not size: size = len(buf)
+    if self.chunk: size = min(size, self.chunk)
+    d = self.data[self.pos:self.pos+size]
+    buf[:len(d)] = d
+    self.pos += len(d)
+    return len(d)
+
+
+class LegacyConnection (of_01.Connection):
+  """
+  A Connection with the old read()
+  """
+  def __init__ (self, sock):
+    super(LegacyConnection,self).__init__(sock)
+    self.buf = ''
+
+  def read (self):
+    unpackers = of_01.unpackers
+    handlers = of_01.handlers
+    try:
+      d = self.sock.recv(2048)
+    except:
+      return False
+    if len(d) == 0:
+      return False
+    self.buf += d
+    buf_len = len(self.buf)
+
+    offset = 0
+    while buf_len - offset >= 8:
+      ofp_type = ord(self.buf[offset+1])
+      if ord(self.buf[offset]) != of.OFP_VERSION:
+        if ofp_type != of.OFPT_HELLO:
+          return False
+      msg_length = ord(self.buf[offset+2]) << 8 | ord(self.buf[offset+3])
+      if buf_len - offset < msg_length: break
+      new_offset,msg = unpackers[ofp_type](self.buf, offset)
+      assert new_offset - offset == msg_length
+      offset = new_offset
+      handlers[ofp_type](self, msg)
+
+    if offset != 0:
+      self.buf = self.buf[offset:]
+
+    return True
+
+
+def synthetic_streams ():
+  def packet_ins (size):
+    return [of.ofp_packet_in(in_port = i % 4 + 1, buffer_id = i,
+                             data = b'\x00' * size) for i in range(200)]
+
+  def stats_reply (entries):
+    body = [of.ofp_flow_stats(match = of.ofp_match(in_port = i),
+                              actions = [of.ofp_action_output(port = 1)])
+            for i in range(entries)]
+    return of.ofp_stats_reply(body = body, type = of.OFPST_FLOW)
+
+  mixed = packet_ins(128)
+  for i in range(20):
+    mixed.append(of.ofp_echo_request(xid = i))
+    mixed.append(of.ofp_flow_removed(match = of.ofp_match(in_port = i)))
+  mixed.append(stats_reply(50))
+
+  streams = [
+    ("packet_in 128B", packet_ins(128)),
+    ("packet_in 1500B", packet_ins(1500)),
+    ("flow stats 64KB", [stats_reply(680)] * 2),
+    ("mixed", mixed),
+  ]
+  return [(name, b''.join(m.pack() for m in msgs)) for name,msgs in streams]
+
+
+def pcap_stream (filename, port):
+  """
+  Pulls the TCP payloads headed for port out of a pcap file
+  """
+  data = []
+  with open(filename, "rb") as f:
+    hdr = f.read(24)
+    endian = "<" if struct.unpack("<I", hdr[:4])[0] == 0xa1b2c3d4 else ">"
+    while True:
+      rec = f.read(16)
+      if len(rec) < 16: break
+      caplen = struct.unpack(endian + "IIII", rec)[2]
+      p = ethernet(f.read(caplen))
+      t = p.find('tcp')
+      if t and t.dstport == port and t.payload:
+        data.append(t.payload)
+  return b''.join(data)
+
+
+def count_messages (data):
+  n = 0
+  offset = 0
+  while offset < len(data):
+    offset += struct.unpack_from("!H", data, offset + 2)[0]
+    n += 1
+  return n
+
+
+def run (cls, data, count, duration, chunk):
+  """
+  Replays data until duration seconds have passed and returns msgs/sec
+  """
+  done = 0
+  start = time.time()
+  while True:
+    con = cls(ReplaySocket(data, chunk))
+    while con.read():
+      pass
+    done += count
+    elapsed = time.time() - start
+    if elapsed >= duration: break
+  return done / elapsed
+
+
+def main ():
+  parser = argparse.ArgumentParser(description = __doc__.split("\n")[1])
+  parser.add_argument("-t", type = float, default = 2,
+                      help = "seconds per test")
+  parser.add_argument("--port", type = int, default = 6633,
+                      help = "controller TCP port in captures")
+  parser.add_argument("captures", nargs = "*", help = "pcap files to replay")
+  args = parser.parse_args()
+
+  if args.captures:
+    streams = [(os.path.basename(f), pcap_stream(f, args.port))
+               for f in args.captures]
+  else:
+    streams = synthetic_streams()
+
+  got = []
+
+  print "%-28s %6s %14s %14s %8s" % ("stream", "msgs", "legacy msg/s",
+                                     "new msg/s", "speedup")
+  for name,data in streams:
+    count = count_messages(data)
+    of_01.handlers = [lambda con, msg: got.append(msg)] * 256
+    run(of_01.Connection, data, count, 0, None)
+    check = got[:]
+    del got[:]
+    run(LegacyConnection, data, count, 0, None)
+    assert got == check
+    del got[:]
+    of_01.handlers = [lambda con, msg: None] * 256
+
+    for chunk in (None, SEGMENT):
+      label = "%s%s" % (name, " (segments)" if chunk else "")
+      before = run(LegacyConnection, data, count, args.t, chunk)
+      after = run(of_01.Connection, data, count, args.t, chunk)
+      print "%-28s %6s %14.0f %14.0f %7.1fx" % (label, count, before, after,
+                                                after/before)
+
+
+if __name__ == '__main__':
+  main()
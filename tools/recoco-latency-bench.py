@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+I/O wakeup latency of the recoco schedulers
+
+Compares the normal Scheduler (which waits for I/O in a SelectHub thread)
+with SelectLoop (which waits in its own thread), with and without epoll.
+"pingpong" bounces a byte between two Tasks over a socket pair and times
+the round trips.  "wakeup" has another thread write a timestamp to a
+socket every millisecond and times how long it takes the Task reading
+it to see it.  Either way, there's also a Task waiting on --idle other
+sockets, since a controller usually has lots of quiet connections.
+
+Run from the POX directory:
+  python tools/recoco-latency-bench.py [-n rounds] [--idle N] [test ...]
+"""
+
+import sys
+import os
+import time
+import socket
+import struct
+import threading
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pox.lib.recoco import Scheduler, Task, Select
+from pox.lib.recoco.loop import SelectLoop
+
+
+SCHEDULERS = [
+  ("hub", lambda: Scheduler(isDefaultScheduler = False, daemon = True)),
+  ("hub+epoll", lambda: Scheduler(isDefaultScheduler = False, daemon = True,
+                                  useEpoll = True)),
+  ("loop", lambda: SelectLoop(isDefaultScheduler = False, daemon = True,
+                              useEpoll = False)),
+  ("loop+epoll", lambda: SelectLoop(isDefaultScheduler = False,
+                                    daemon = True)),
+]
+
+_STAMP = struct.Struct("d")
+
+
+class Idler (Task):
+  def __init__ (self, socks):
+    Task.__init__(self)
+    self.socks = socks
+
+  def run (self):
+    while True:
+      yield Select(self.socks, [], [], 1)
+
+
+class Ponger (Task):
+  def __init__ (self, sock):
+    Task.__init__(self)
+    self.sock = sock
+
+  def run (self):
+    while True:
+      yield Select([self.sock], [], [])
+      d = self.sock.recv(64)
+      if not d: break
+      self.sock.send(d)
+
+
+class Pinger (Task):
+  def __init__ (self, sock, rounds, done):
+    Task.__init__(self)
+    self.sock = sock
+    self.rounds = rounds
+    self.done = done
+    self.times = []
+
+  def run (self):
+    for i in xrange(self.rounds):
+      start = time.time()
+      self.sock.send(b'x')
+      yield Select([self.sock], [], [])
+      self.sock.recv(64)
+      self.times.append(time.time() - start)
+    self.done.set()
+
+
+class Reader (Task):
+  def __init__ (self, sock, rounds, done):
+    Task.__init__(self)
+    self.sock = sock
+    self.rounds = rounds
+    self.done = done
+    self.times = []
+
+  def run (self):
+    while len(self.times) < self.rounds:
+      yield Select([self.sock], [], [])
+      d = self.sock.recv(_STAMP.size)
+      now = time.time()
+      self.times.append(now - _STAMP.unpack(d)[0])
+    self.done.set()
+
+
+def pingpong (sched, rounds):
+  a,b = socket.socketpair()
+  done = threading.Event()
+  p = Pinger(a, rounds, done)
+  Ponger(b).start(sched)
+  p.start(sched)
+  done.wait(60)
+  a.close()
+  b.close()
+  return p.times
+
+
+def wakeup (sched, rounds):
+  a,b = socket.socketpair()
+  done = threading.Event()
+  r = Reader(b, rounds, done)
+  r.start(sched)
+  time.sleep(0.1)
+  for i in xrange(rounds):
+    a.send(_STAMP.pack(time.time()))
+    time.sleep(0.001)
+    if done.is_set(): break
+  done.wait(60)
+  a.close()
+  b.close()
+  return r.times
+
+
+def main ():
+  parser = argparse.ArgumentParser(description = __doc__.split("\n")[1])
+  parser.add_argument("-n", type = int, default = 2000,
+                      help = "rounds per test")
+  parser.add_argument("--idle", type = int, default = 200,
+                      help = "number of idle sockets")
+  parser.add_argument("tests", nargs = "*",
+                      help = "only run tests containing these strings")
+  args = parser.parse_args()
+
+  print "%-24s %10s %10s %10s" % ("test", "median us", "p99 us", "ops/s")
+  for test in (pingpong, wakeup):
+    for sname,make in SCHEDULERS:
+      name = "%s %s" % (test.__name__, sname)
+      if args.tests and not any(t in name for t in args.tests): continue
+      sched = make()
+      pairs = [socket.socketpair() for i in xrange(args.idle)]
+      if pairs:
+        Idler([p[0] for p in pairs]).start(sched)
+      start = time.time()
+      times = sorted(test(sched, args.n))
+      elapsed = time.time() - start
+      sched.quit()
+      sched._event.set()
+      for p in pairs:
+        p[0].close()
+        p[1].close()
+      if not times:
+        print "%-24s failed" % (name,)
+        continue
+      print "%-24s %10.1f %10.1f %10.0f" % (name,
+          times[len(times) // 2] * 1e6,
+          times[int(len(times) * 0.99)] * 1e6, len(times) / elapsed)
+      time.sleep(0.2)
+
+
+if __name__ == '__main__':
+  main()
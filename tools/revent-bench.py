@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmark for raising revent events
+
+Times raiseEvent() and raiseEventNoErrors() with an event class (the
+way of_01 raises PacketIn) for various numbers of listeners, with
+handlers which return None and ones which return EventContinue.
+
+Run from the POX directory:
+  python tools/revent-bench.py [-t seconds] [-l counts]
+"""
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pox.lib.revent import EventMixin, Event, EventContinue
+
+
+class Ping (Event):
+  def __init__ (self, con, msg):
+    Event.__init__(self)
+    self.con = con
+    self.msg = msg
+
+
+class Source (EventMixin):
+  _eventMixin_events = set([Ping])
+
+
+def run (f, duration):
+  count = 0
+  start = time.time()
+  end = start + duration
+  while True:
+    for i in xrange(100):
+      f(Ping, 1, 2)
+    count += 100
+    now = time.time()
+    if now >= end: break
+  return count / (now - start)
+
+
+def main ():
+  parser = argparse.ArgumentParser(description = __doc__.split("\n")[1])
+  parser.add_argument("-t", type = float, default = 1,
+                      help = "seconds per test")
+  parser.add_argument("-l", default = "0,1,2,5,10",
+                      help = "listener counts")
+  args = parser.parse_args()
+
+  print "%-38s %12s %10s" % ("test", "raises/s", "usec/raise")
+  for kind,rv in (("None", None), ("EventContinue", EventContinue)):
+    for n in [int(x) for x in args.l.split(",")]:
+      for method in ("raiseEvent", "raiseEventNoErrors"):
+        if n == 0 and kind != "None": continue
+        s = Source()
+        for i in xrange(n):
+          s.addListener(Ping, lambda event: rv)
+        rate = run(getattr(s, method), args.t)
+        name = "%s %i x %s" % (method, n, kind)
+        print "%-38s %12.0f %10.2f" % (name, rate, 1e6 / rate)
+
+
+if __name__ == '__main__':
+  main()